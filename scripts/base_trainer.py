@@ -7,9 +7,9 @@ from keras.callbacks import ReduceLROnPlateau, TerminateOnNaN, EarlyStopping
 
 import env
 
-from slam.data_manager import GeneratorFactory
+from slam.data_manager import GeneratorFactory, SharedImageCache, BatchProducer
 from slam.models import ModelFactory
-from slam.evaluation import MlflowLogger, Predict, TerminateOnLR, ModelCheckpoint, CyclicLR
+from slam.evaluation import MlflowLogger, Predict, TerminateOnLR, ModelCheckpoint, CyclicLR, LoaderStats
 from slam.preprocessing import get_dataset_root, get_config, DATASET_TYPES
 from slam.utils import set_computation, chmod
 
@@ -20,6 +20,16 @@ class BaseTrainer:
                  run_name,
                  bundle_name,
                  cache=True,
+                 cache_size=None,
+                 cache_path=None,
+                 packed=False,
+                 disk_cache_dir=None,
+                 loader_workers=0,
+                 max_queue_size=10,
+                 rank=None,
+                 world_size=None,
+                 tfrecord_dir=None,
+                 profile_loader=False,
                  batch_size=128,
                  epochs=100,
                  optimizer='adam',
@@ -43,7 +53,8 @@ class BaseTrainer:
                  train_generator_args=None,
                  val_generator_args=None,
                  test_generator_args=None,
-                 predict_only=False):
+                 predict_only=False,
+                 predict_chunk_size=None):
 
         self.tracking_uri = env.TRACKING_URI
         self.artifact_path = env.ARTIFACT_PATH
@@ -59,6 +70,17 @@ class BaseTrainer:
         self.run_dir = None
         self.bundle_name = bundle_name
         self.cache = cache
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.packed = packed
+        self.disk_cache_dir = disk_cache_dir
+        self.loader_workers = loader_workers
+        self.max_queue_size = max_queue_size
+        # defaults follow the environment of torch.distributed launchers
+        self.rank = int(os.environ.get('RANK', 0)) if rank is None else rank
+        self.world_size = int(os.environ.get('WORLD_SIZE', 1)) if world_size is None else world_size
+        self.tfrecord_dir = tfrecord_dir
+        self.profile_loader = profile_loader
         self.batch_size = batch_size
         self.epochs = epochs
         self.optimizer = optimizer
@@ -85,6 +107,7 @@ class BaseTrainer:
         self.x_col = None
 
         self.predict_only = predict_only
+        self.predict_chunk_size = predict_chunk_size
         if self.predict_only:
             self.evaluate = False
         else:
@@ -173,6 +196,15 @@ class BaseTrainer:
         mlflow.log_metric('successfully_finished', 1)
         mlflow.end_run()
 
+    def get_cache(self):
+        if not self.cache:
+            return None
+
+        if self.cache_size:
+            return SharedImageCache(path=self.cache_path, max_bytes=int(self.cache_size * 2 ** 30))
+
+        return {}
+
     def get_dataset(self,
                     train_trajectories=None,
                     val_trajectories=None):
@@ -191,7 +223,11 @@ class BaseTrainer:
                                 batch_size=self.batch_size,
                                 preprocess_mode=self.preprocess_mode,
                                 depth_multiplicator=self.config['depth_multiplicator'],
-                                cached_images={} if self.cache else None,
+                                cached_images=self.get_cache(),
+                                packed=self.packed,
+                                disk_cache_dir=self.disk_cache_dir,
+                                rank=self.rank,
+                                world_size=self.world_size,
                                 train_strides=self.config['train_strides'],
                                 val_strides=self.config['val_strides'],
                                 test_strides=self.config['test_strides'],
@@ -217,7 +253,8 @@ class BaseTrainer:
                       evaluate=True,
                       save_dir=None,
                       prefix=None,
-                      save_metric='val_loss'):
+                      save_metric='val_loss',
+                      loader_profilers=None):
         callbacks = []
 
         terminate_on_nan_callback = TerminateOnNaN()
@@ -236,7 +273,8 @@ class BaseTrainer:
                                    max_to_visualize=self.max_to_visualize,
                                    backend=self.backend,
                                    cuda=self.cuda,
-                                   workers=8)
+                                   workers=8,
+                                   chunk_size=self.predict_chunk_size)
         callbacks.append(predict_callback)
 
         if self.period:
@@ -268,6 +306,10 @@ class BaseTrainer:
                                                     restore_best_weights=True)
             callbacks.append(early_stopping_callback)
 
+        if loader_profilers:
+            loader_stats_callback = LoaderStats(loader_profilers)
+            callbacks.append(loader_stats_callback)
+
         if self.use_mlflow:
             mlflow_callback = MlflowLogger(alias={'loss': 'train_loss'},
                                            prefix=prefix,
@@ -280,6 +322,23 @@ class BaseTrainer:
             print(callback)
         return callbacks
 
+    def get_tfrecord_generator(self, dataset, subset):
+        from slam.data_manager.tfrecord import ensure_tfrecords, TFRecordGenerator
+
+        # all ranks share one unsharded export, records are split between ranks when reading
+        if subset == 'train':
+            generator = dataset.get_train_generator(augment=False, shard=False)
+        else:
+            generator = dataset.get_val_generator()
+        subset_dir = ensure_tfrecords(generator, os.path.join(self.tfrecord_dir, subset))
+
+        return TFRecordGenerator(subset_dir,
+                                 batch_size=self.batch_size,
+                                 shuffle=subset == 'train',
+                                 seed=self.seed,
+                                 rank=self.rank if subset == 'train' else 0,
+                                 world_size=self.world_size if subset == 'train' else 1)
+
     def fit_generator(self,
                       model,
                       dataset,
@@ -288,22 +347,50 @@ class BaseTrainer:
                       save_dir=None,
                       prefix=None,
                       save_metric='val_loss'):
-        train_generator = dataset.get_train_generator()
-        val_generator = dataset.get_val_generator()
+        if self.tfrecord_dir:
+            train_generator = self.get_tfrecord_generator(dataset, 'train')
+            val_generator = self.get_tfrecord_generator(dataset, 'val')
+        else:
+            train_generator = dataset.get_train_generator(shard=True)
+            val_generator = dataset.get_val_generator()
+        steps_per_epoch = len(train_generator)
+        validation_steps = len(val_generator)
+
+        loader_profilers = None
+        if self.profile_loader and not self.tfrecord_dir:
+            loader_profilers = {'train': train_generator.profiler, 'val': val_generator.profiler}
+            for profiler in loader_profilers.values():
+                profiler.enabled = True
+
+        if self.loader_workers and not self.tfrecord_dir:
+            train_generator = BatchProducer(train_generator,
+                                            workers=self.loader_workers,
+                                            max_queue_size=self.max_queue_size,
+                                            seed=self.seed)
+            val_generator = BatchProducer(val_generator,
+                                          workers=self.loader_workers,
+                                          max_queue_size=self.max_queue_size,
+                                          seed=self.seed)
         callbacks = self.get_callbacks(model,
                                        dataset,
                                        evaluate=evaluate,
                                        save_dir=save_dir,
                                        prefix=prefix,
-                                       save_metric=save_metric)
+                                       save_metric=save_metric,
+                                       loader_profilers=loader_profilers)
 
         model.fit_generator(train_generator,
-                            steps_per_epoch=len(train_generator),
+                            steps_per_epoch=steps_per_epoch,
                             epochs=epochs,
                             validation_data=val_generator,
-                            validation_steps=len(val_generator),
+                            validation_steps=validation_steps,
                             shuffle=True,
-                            callbacks=callbacks)
+                            callbacks=callbacks,
+                            workers=0 if self.loader_workers or self.tfrecord_dir else 1)
+
+        if self.loader_workers and not self.tfrecord_dir:
+            train_generator.close()
+            val_generator.close()
 
     def train(self):
         if self.use_mlflow:
@@ -370,6 +457,31 @@ class BaseTrainer:
         parser.add_argument('--cuda', action='store_true',
                             help='Use GPU for evaluation (only for backend=="torch")')
 
+        parser.add_argument('--cache_size', type=float, default=None,
+                            help='Size of the host-wide shared image cache in GB '
+                                 '(by default each process keeps its own cache)')
+        parser.add_argument('--cache_path', type=str, default=None,
+                            help='Path to the shared image cache arena (default: /dev/shm/slam_image_cache)')
+
+        parser.add_argument('--disk_cache_dir', type=str, default=None,
+                            help='Directory of the persistent preprocessed-frame cache shared by runs on this host')
+        parser.add_argument('--packed', action='store_true',
+                            help='Serve frames from packed trajectories (see scripts/prepare_dataset/pack_dataset.py)')
+
+        parser.add_argument('--loader_workers', type=int, default=0,
+                            help='Number of processes that assemble training batches (0 to load in the main process)')
+        parser.add_argument('--max_queue_size', type=int, default=10,
+                            help='Number of batches prepared ahead by loader workers')
+        parser.add_argument('--tfrecord_dir', type=str, default=None,
+                            help='Train from TFRecord files in this directory through tf.data '
+                                 '(train and val subsets are exported on first use, augmentations are not applied)')
+        parser.add_argument('--profile_loader', action='store_true',
+                            help='Log time of data loading stages, cache hits and batch fill ratio every epoch')
+        parser.add_argument('--rank', type=int, default=None,
+                            help='Index of this node among nodes sharing the training set (default: $RANK or 0)')
+        parser.add_argument('--world_size', type=int, default=None,
+                            help='Number of nodes sharing the training set (default: $WORLD_SIZE or 1)')
+
         parser.add_argument('--seed', type=int, default=42,
                             help='Random seed')
         parser.add_argument('--stride', type=int, default=None)
@@ -380,5 +492,8 @@ class BaseTrainer:
 
         parser.add_argument('--predict_only', action='store_true',
                             help='If true predicts output without metric evaluation')
+        parser.add_argument('--predict_chunk_size', type=int, default=None,
+                            help='Predict trajectories by chunks of this size and write predictions to disk as they go '
+                                 '(memory does not grow with trajectory length)')
 
         return parser
@@ -0,0 +1,85 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import __init_path__
+import env
+
+
+def generate_trajectory(trajectory_dir,
+                        length=100,
+                        height=120,
+                        width=160,
+                        invalid_depth_ratio=0.05,
+                        nan_flow_ratio=0.05,
+                        seed=0):
+    """Write a random trajectory in the layout of prepared datasets: rgb PNGs, depth, optical flow
+    and motion maps as .npy files and df.csv with motions and intrinsics.
+
+    Depth has zeros and flow has NaNs in a fraction of pixels, so fill functions run as on real data.
+    """
+    random_state = np.random.RandomState(seed)
+    for subdir in ('rgb', 'depth', 'optical_flow', 'motion_maps'):
+        os.makedirs(os.path.join(trajectory_dir, subdir), exist_ok=True)
+
+    for index in range(length):
+        image = random_state.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        Image.fromarray(image).save(os.path.join(trajectory_dir, 'rgb', f'{index}.png'))
+
+        depth = random_state.uniform(0.5, 10, (height, width)).astype('float32')
+        depth[random_state.rand(height, width) < invalid_depth_ratio] = 0
+        np.save(os.path.join(trajectory_dir, 'depth', f'{index}.npy'), depth)
+
+    rows = []
+    for index in range(length - 1):
+        flow = random_state.uniform(-0.05, 0.05, (height, width, 2)).astype('float32')
+        flow[random_state.rand(height, width) < nan_flow_ratio] = np.nan
+        np.save(os.path.join(trajectory_dir, 'optical_flow', f'{index}_{index + 1}.npy'), flow)
+
+        motion_maps = random_state.uniform(-1, 1, (7, height, width)).astype('float32')
+        np.save(os.path.join(trajectory_dir, 'motion_maps', f'{index}_{index + 1}.npy'), motion_maps)
+
+        euler_angles = random_state.normal(0, 0.01, 3)
+        translation = random_state.normal(0, 0.1, 3) + (0, 0, 0.5)
+        rows.append({'path_to_rgb': f'rgb/{index}.png',
+                     'path_to_rgb_next': f'rgb/{index + 1}.png',
+                     'path_to_depth': f'depth/{index}.npy',
+                     'path_to_depth_next': f'depth/{index + 1}.npy',
+                     'path_to_optical_flow': f'optical_flow/{index}_{index + 1}.npy',
+                     'path_to_motion_maps': f'motion_maps/{index}_{index + 1}.npy',
+                     'euler_x': euler_angles[0], 'euler_y': euler_angles[1], 'euler_z': euler_angles[2],
+                     't_x': translation[0], 't_y': translation[1], 't_z': translation[2],
+                     'f_x': 0.6, 'f_y': 0.8, 'c_x': 0.5, 'c_y': 0.5})
+
+    pd.DataFrame(rows).to_csv(os.path.join(trajectory_dir, 'df.csv'), index=False)
+
+
+def generate_dataset(dataset_root, num_trajectories=2, length=100, height=120, width=160, seed=0):
+    trajectories = [f'{index:02d}' for index in range(num_trajectories)]
+    for index, trajectory in enumerate(trajectories):
+        generate_trajectory(os.path.join(dataset_root, trajectory),
+                            length=length,
+                            height=height,
+                            width=width,
+                            seed=seed + index)
+    return trajectories
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset_root', type=str, required=True)
+    parser.add_argument('--num_trajectories', type=int, default=2)
+    parser.add_argument('--length', type=int, default=100, help='Number of frames in every trajectory')
+    parser.add_argument('--height', type=int, default=120)
+    parser.add_argument('--width', type=int, default=160)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_dataset(args.dataset_root,
+                     num_trajectories=args.num_trajectories,
+                     length=args.length,
+                     height=args.height,
+                     width=args.width,
+                     seed=args.seed)
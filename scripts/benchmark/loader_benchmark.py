@@ -0,0 +1,246 @@
+import os
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import itertools
+import platform
+import numpy as np
+from collections import defaultdict
+
+import __init_path__
+import env
+
+from slam.data_manager import GeneratorFactory, SharedImageCache
+from generate_synthetic import generate_dataset
+
+
+LOAD_CONFIGS = {
+    'rgb': {'image_col': ['path_to_rgb', 'path_to_rgb_next'], 'load_mode': 'rgb', 'preprocess_mode': 'rgb'},
+    'flow_xy': {'image_col': ['path_to_optical_flow'], 'load_mode': 'flow_xy', 'preprocess_mode': 'flow_xy'},
+    'flow_xy_nan': {'image_col': ['path_to_optical_flow'], 'load_mode': 'flow_xy', 'preprocess_mode': 'flow_xy_nan'},
+    'depth': {'image_col': ['path_to_depth', 'path_to_depth_next'], 'load_mode': 'depth', 'preprocess_mode': 'depth'},
+    'disparity': {'image_col': ['path_to_depth'], 'load_mode': 'depth', 'preprocess_mode': 'disparity'},
+    'motion_maps': {'image_col': ['path_to_motion_maps'], 'load_mode': 'motion_maps', 'preprocess_mode': 'motion_maps'},
+    'flow_depth': {'image_col': ['path_to_optical_flow', 'path_to_depth'],
+                   'load_mode': ['flow_xy', 'depth'],
+                   'preprocess_mode': ['flow_xy', 'depth']},
+}
+
+CACHE_CONFIGS = ('none', 'memory', 'shared', 'disk')
+
+# stages are methods of ExtendedDataFrameIterator, nested stages are included in the time of outer ones
+STAGES = ('_get_batches_of_transformed_samples',
+          '_get_preprocessed_image',
+          '_load_image',
+          '_preprocess_image',
+          '_generate_flows',
+          '_augment_with_rectangle')
+
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    """Records latencies of generator methods by wrapping them on the instance."""
+    def __init__(self, generator, stages=STAGES):
+        self.latencies = defaultdict(list)
+        self.bytes_read = 0
+
+        for stage in stages:
+            setattr(generator, stage, self._wrap(stage, getattr(generator, stage)))
+
+        load_image = generator._load_image
+
+        def count_bytes(fpath, load_mode):
+            self.bytes_read += os.path.getsize(fpath)
+            return load_image(fpath, load_mode)
+
+        generator._load_image = count_bytes
+
+    def _wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start_time = time.perf_counter()
+            result = fn(*args, **kwargs)
+            self.latencies[stage].append(time.perf_counter() - start_time)
+            return result
+        return timed
+
+    def reset(self):
+        self.latencies.clear()
+        self.bytes_read = 0
+
+    def summary(self):
+        summary = dict()
+        for stage, latencies in self.latencies.items():
+            latencies_ms = np.array(latencies) * 1000
+            summary[stage.strip('_')] = {'calls': len(latencies_ms),
+                                         'total_ms': float(latencies_ms.sum()),
+                                         **{f'p{q}_ms': float(np.percentile(latencies_ms, q)) for q in PERCENTILES}}
+        return summary
+
+
+def get_cache_kwargs(cache, work_dir):
+    if cache == 'memory':
+        return {'cached_images': {}}, None
+    if cache == 'shared':
+        shared_cache = SharedImageCache(path=os.path.join(work_dir, 'shared_cache'), max_bytes=2 ** 30)
+        return {'cached_images': shared_cache}, shared_cache
+    if cache == 'disk':
+        return {'disk_cache_dir': os.path.join(work_dir, 'disk_cache')}, None
+    return {}, None
+
+
+def run_config(dataset_root,
+               trajectories,
+               load_config,
+               cache,
+               generate_flow_by_rt_proba,
+               augment_with_rectangle_proba,
+               target_size,
+               batch_size,
+               epochs,
+               max_batches):
+    work_dir = tempfile.mkdtemp()
+    cache_kwargs, shared_cache = get_cache_kwargs(cache, work_dir)
+
+    config = LOAD_CONFIGS[load_config]
+    generator_args = {'generate_flow_by_rt_proba': generate_flow_by_rt_proba,
+                      'augment_with_rectangle_proba': augment_with_rectangle_proba}
+    if generate_flow_by_rt_proba > 0:
+        generator_args['generate_distribution'] = 'normal'
+
+    try:
+        dataset = GeneratorFactory(dataset_root,
+                                   train_trajectories=trajectories,
+                                   x_col=config['image_col'],
+                                   image_col=config['image_col'],
+                                   load_mode=config['load_mode'],
+                                   preprocess_mode=config['preprocess_mode'],
+                                   train_generator_args=generator_args,
+                                   target_size=target_size,
+                                   batch_size=batch_size,
+                                   **cache_kwargs)
+        generator = dataset.get_train_generator()
+        timer = StageTimer(generator)
+        generator.profiler.enabled = True
+
+        results = []
+        for epoch in range(epochs):
+            timer.reset()
+            generator.profiler.reset()
+            samples = 0
+            num_batches = min(len(generator), max_batches or len(generator))
+            start_time = time.perf_counter()
+            for _ in range(num_batches):
+                batch_x, _ = next(generator)
+                samples += len(batch_x[0])
+            elapsed = time.perf_counter() - start_time
+
+            results.append({'epoch': epoch,
+                            'batches': num_batches,
+                            'samples': samples,
+                            'seconds': elapsed,
+                            'samples_per_sec': samples / elapsed,
+                            'bytes_read': timer.bytes_read,
+                            'stages': timer.summary(),
+                            'profiler': generator.profiler.summary()})
+        return results
+    finally:
+        if shared_cache is not None:
+            shared_cache.unlink()
+        shutil.rmtree(work_dir)
+
+
+def get_augmentations(load_config, augmentations):
+    config = LOAD_CONFIGS[load_config]
+    # flow synthesis needs flow and depth columns, rectangle augmentation is applied to synthesized flow only
+    can_generate = 'path_to_optical_flow' in config['image_col'] and any(col.endswith('depth')
+                                                                         for col in config['image_col'])
+    return augmentations if can_generate else [(0, 0)]
+
+
+def run_benchmark(dataset_root,
+                  trajectories,
+                  load_configs,
+                  caches,
+                  augmentations,
+                  target_size,
+                  batch_size,
+                  epochs,
+                  max_batches):
+    records = []
+    for load_config, cache in itertools.product(load_configs, caches):
+        for generate_flow_by_rt_proba, augment_with_rectangle_proba in get_augmentations(load_config, augmentations):
+            params = {'load_config': load_config,
+                      'cache': cache,
+                      'generate_flow_by_rt_proba': generate_flow_by_rt_proba,
+                      'augment_with_rectangle_proba': augment_with_rectangle_proba}
+            print(f'Benchmark {params}')
+            epochs_results = run_config(dataset_root,
+                                        trajectories,
+                                        target_size=target_size,
+                                        batch_size=batch_size,
+                                        epochs=epochs,
+                                        max_batches=max_batches,
+                                        **params)
+            for result in epochs_results:
+                print(f'\tepoch {result["epoch"]}: {result["samples_per_sec"]:.1f} samples/sec, '
+                      f'{result["bytes_read"] / 2 ** 20:.1f} MiB read')
+            records.append({**params, 'epochs': epochs_results})
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset_root', type=str, default=None,
+                        help='Benchmark on trajectories in this directory (by default synthetic ones are generated)')
+    parser.add_argument('--trajectories', type=str, nargs='+', default=None)
+    parser.add_argument('--num_trajectories', type=int, default=2)
+    parser.add_argument('--length', type=int, default=100, help='Number of frames in synthetic trajectories')
+    parser.add_argument('--height', type=int, default=120, help='Height of synthetic frames')
+    parser.add_argument('--width', type=int, default=160, help='Width of synthetic frames')
+    parser.add_argument('--target_size', type=int, nargs=2, default=(60, 80))
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=2, help='Epochs after the first one read from warm caches')
+    parser.add_argument('--max_batches', type=int, default=None, help='Maximum number of batches per epoch')
+    parser.add_argument('--load_configs', type=str, nargs='+', default=list(LOAD_CONFIGS.keys()),
+                        choices=list(LOAD_CONFIGS.keys()))
+    parser.add_argument('--caches', type=str, nargs='+', default=list(CACHE_CONFIGS), choices=CACHE_CONFIGS)
+    parser.add_argument('--augmentations', type=lambda x: tuple(map(float, x.split(','))), nargs='+',
+                        default=[(0, 0), (0.5, 0), (0.5, 0.5)],
+                        help='Pairs "generate_flow_by_rt_proba,augment_with_rectangle_proba"')
+    parser.add_argument('--output', type=str, default='loader_benchmark.json')
+    args = parser.parse_args()
+
+    dataset_root = args.dataset_root
+    trajectories = args.trajectories
+    synthetic = dataset_root is None
+    if synthetic:
+        dataset_root = tempfile.mkdtemp()
+        trajectories = generate_dataset(dataset_root,
+                                        num_trajectories=args.num_trajectories,
+                                        length=args.length,
+                                        height=args.height,
+                                        width=args.width)
+
+    try:
+        records = run_benchmark(dataset_root,
+                                trajectories,
+                                load_configs=args.load_configs,
+                                caches=args.caches,
+                                augmentations=args.augmentations,
+                                target_size=tuple(args.target_size),
+                                batch_size=args.batch_size,
+                                epochs=args.epochs,
+                                max_batches=args.max_batches)
+    finally:
+        if synthetic:
+            shutil.rmtree(dataset_root)
+
+    report = {'args': {k: v for k, v in vars(args).items()},
+              'host': {'python': platform.python_version(), 'cpus': os.cpu_count(), 'node': platform.node()},
+              'records': records}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved results to {args.output}')
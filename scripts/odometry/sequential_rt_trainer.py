@@ -4,7 +4,7 @@ from functools import partial
 
 from scripts.base_trainer import BaseTrainer
 from slam.models import construct_sequential_rt_model
-from slam.linalg import Intrinsics
+from slam.linalg import get_intrinsics
 
 
 class SequentialRTTrainer(BaseTrainer):
@@ -27,12 +27,12 @@ class SequentialRTTrainer(BaseTrainer):
                          **kwargs)
 
         height, width = self.config['target_size']
-        self.intrinsics = Intrinsics(f_x=f_x,
-                                     f_y=f_y,
-                                     c_x=c_x,
-                                     c_y=c_y,
-                                     width=width,
-                                     height=height)
+        self.intrinsics = get_intrinsics(f_x=f_x,
+                                         f_y=f_y,
+                                         c_x=c_x,
+                                         c_y=c_y,
+                                         width=width,
+                                         height=height)
 
         self.use_input_flow = use_input_flow
         self.use_diff_flow = use_diff_flow
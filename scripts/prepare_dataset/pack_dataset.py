@@ -0,0 +1,53 @@
+import os
+import argparse
+from pathlib import Path
+
+import __init_path__
+import env
+
+from slam.data_manager.packed_dataset import pack_dataset, DEFAULT_LOAD_MODES
+from slam.preprocessing import get_dataset_root, get_config, DATASET_TYPES
+
+
+def get_trajectories(dataset_root, csv_name):
+    return sorted(path.parent.relative_to(dataset_root).as_posix()
+                  for path in Path(dataset_root).rglob(csv_name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--leader_board', type=str, choices=DATASET_TYPES, default=None,
+                        help='Pack trajectories of the leader board with its target size')
+    parser.add_argument('--dataset_root', type=str, default=None)
+    parser.add_argument('--trajectories', type=str, nargs='+', default=None,
+                        help='Name of trajectories (by default all trajectories with csv in dataset root)')
+    parser.add_argument('--target_size', type=int, nargs=2, default=None, help='Height and width of frames')
+    parser.add_argument('--columns', type=str, nargs='+', default=list(DEFAULT_LOAD_MODES.keys()))
+    parser.add_argument('--load_modes', type=str, nargs='+', default=list(DEFAULT_LOAD_MODES.values()))
+    parser.add_argument('--csv_name', type=str, default='df.csv')
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    dataset_root = args.dataset_root
+    trajectories = args.trajectories
+    target_size = args.target_size
+
+    if args.leader_board is not None:
+        dataset_root = dataset_root or get_dataset_root(args.leader_board)
+        config = get_config(dataset_root, args.leader_board)
+        target_size = target_size or config['target_size']
+        trajectories = trajectories or [trajectory for key in ('train_trajectories',
+                                                               'val_trajectories',
+                                                               'test_trajectories')
+                                        for trajectory in (config[key] or [])]
+
+    assert dataset_root is not None and target_size is not None
+    trajectories = trajectories or get_trajectories(dataset_root, args.csv_name)
+
+    assert len(args.columns) == len(args.load_modes)
+    pack_dataset(dataset_root,
+                 trajectories,
+                 tuple(target_size),
+                 load_modes=dict(zip(args.columns, args.load_modes)),
+                 csv_name=args.csv_name,
+                 overwrite=args.overwrite)
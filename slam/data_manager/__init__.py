@@ -1,6 +1,16 @@
 from .generator_factory import GeneratorFactory
+from .image_cache import SharedImageCache
+from .batch_producer import BatchProducer
+from .disk_cache import DiskImageCache
+from .cross_trajectory_iterator import CrossTrajectoryIterator
+from .loader_profiler import LoaderProfiler
 
 
 __all__ = [
-    'GeneratorFactory'
+    'GeneratorFactory',
+    'SharedImageCache',
+    'BatchProducer',
+    'DiskImageCache',
+    'CrossTrajectoryIterator',
+    'LoaderProfiler'
 ]
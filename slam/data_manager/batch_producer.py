@@ -0,0 +1,99 @@
+import sys
+import cv2
+import threading
+import multiprocessing
+import numpy as np
+from collections import deque
+
+
+_worker_generator = None
+
+
+def _init_worker(generator):
+    global _worker_generator
+    _worker_generator = generator
+
+    # batches are already built in parallel, intra-op threads would only oversubscribe cores
+    cv2.setNumThreads(1)
+    # torch is only a resize fallback, so it is limited if loaded but never imported here
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(1)
+
+
+def _produce_batch(args):
+    index_array, batch_index, seed = args
+    # batches are seeded by their position, so augmentation does not depend on which worker builds them
+    np.random.seed((seed + batch_index) % 2 ** 32)
+    _worker_generator.batches_seen = batch_index
+    profiler = _worker_generator.profiler
+    profiler.reset()
+    batch = _worker_generator._get_batches_of_transformed_samples(index_array)
+    # stats of the batch go back with it, the wrapped generator aggregates them for the epoch
+    return batch, profiler.get_state()
+
+
+class BatchProducer:
+    """Assembles batches of ExtendedDataFrameIterator in a pool of worker processes.
+
+    Index arrays are still drawn from the wrapped generator in the calling process, so the
+    per-epoch order of samples is the same as without workers for a given seed. Up to
+    `max_queue_size` batches are prepared ahead and returned strictly in order.
+
+    Workers are forked with a copy of the generator. A SharedImageCache is shared by all of them,
+    while a plain dict cache is duplicated in every worker and filled independently, so each frame
+    is decoded and held in memory once per worker.
+    """
+    def __init__(self, generator, workers=4, max_queue_size=10, seed=None):
+        assert workers > 0
+        self.generator = generator
+        self.workers = workers
+        self.max_queue_size = max(max_queue_size, 1)
+        self.seed = generator.seed if seed is None else seed
+
+        self.pool = None
+        self.queue = deque()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.generator)
+
+    def __iter__(self):
+        return self
+
+    def _start(self):
+        context = multiprocessing.get_context('fork')
+        self.pool = context.Pool(self.workers, initializer=_init_worker, initargs=(self.generator,))
+
+    def _submit(self):
+        with self.generator.lock:
+            index_array = next(self.generator.index_generator)
+
+        task = (index_array, self.generator.batches_seen + len(self.queue), self.seed)
+        self.queue.append(self.pool.apply_async(_produce_batch, (task,)))
+
+    def __next__(self):
+        with self.lock:
+            if self.pool is None:
+                self._start()
+
+            while len(self.queue) < self.max_queue_size:
+                self._submit()
+
+            batch, profiler_state = self.queue.popleft().get()
+            self.generator.profiler.merge(profiler_state)
+            self.generator.batches_seen += 1
+            return batch
+
+    def next(self):
+        return self.__next__()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.queue.clear()
+
+    def __del__(self):
+        self.close()
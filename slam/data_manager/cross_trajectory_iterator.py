@@ -0,0 +1,119 @@
+import time
+import queue
+import threading
+import numpy as np
+import pandas as pd
+
+
+class CrossTrajectoryIterator:
+    """Batches of one ExtendedDataFrameIterator over several trajectories, in dataframe order.
+
+    Batches are filled up to batch_size across trajectory boundaries, so only the last batch of
+    the whole subset is partial. Every batch comes with row indices and trajectory ids of its
+    samples to split model outputs back into trajectories. Up to `max_queue_size` batches are
+    assembled ahead in a background thread, so loading overlaps with the model.
+    """
+    def __init__(self, generator, max_queue_size=10):
+        self.generator = generator
+        self.batch_size = generator.batch_size
+        self.max_queue_size = max_queue_size
+        self.trajectory_ids = generator.df['trajectory_id'].values
+        self.stats = dict()
+
+    def __len__(self):
+        return (len(self.trajectory_ids) + self.batch_size - 1) // self.batch_size
+
+    def _get_batches(self):
+        for start in range(0, len(self.trajectory_ids), self.batch_size):
+            index_array = np.arange(start, min(start + self.batch_size, len(self.trajectory_ids)))
+            yield self.generator._get_batches_of_transformed_samples(index_array), index_array
+
+    def _produce(self, batches, stop):
+        try:
+            for batch in self._get_batches():
+                if stop.is_set():
+                    return
+                batches.put(batch)
+        except BaseException as e:
+            batches.put(e)
+            return
+        batches.put(None)
+
+    def _prefetch(self):
+        batches = queue.Queue(self.max_queue_size)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            # unblock the producer if the consumer stopped early and the queue is full
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+    def __iter__(self):
+        self.generator.reset()
+        batches = self._prefetch() if self.max_queue_size else self._get_batches()
+        for batch, index_array in batches:
+            yield batch, index_array, self.trajectory_ids[index_array]
+
+    def get_trajectory_batches_num(self):
+        """Number of batches needed to predict every trajectory separately."""
+        lengths = pd.Series(self.trajectory_ids).value_counts().values
+        return int(np.sum((lengths + self.batch_size - 1) // self.batch_size))
+
+    def predict(self, model):
+        """Predict all samples and demultiplex outputs by trajectory.
+
+        Returns:
+            outputs: dict from trajectory id to (row_indices, list of model outputs), in order of
+                     first appearance in generator.df
+        """
+        start_time = time.time()
+        predict_time = 0
+
+        row_indices = []
+        outputs = []
+        for batch, index_array, _ in self:
+            batch_x = batch if self.generator.predict_generator else batch[0]
+
+            predict_start_time = time.time()
+            batch_output = model.predict_on_batch(batch_x)
+            predict_time += time.time() - predict_start_time
+
+            batch_output = batch_output if isinstance(batch_output, list) else [batch_output]
+            assert len(batch_output[0]) == len(index_array), 'Invalid samples are dropped from batch'
+            row_indices.append(index_array)
+            outputs.append(batch_output)
+
+        row_indices = np.concatenate(row_indices)
+        outputs = [np.concatenate(output) for output in zip(*outputs)]
+
+        trajectory_codes, unique_trajectory_ids = pd.factorize(self.trajectory_ids[row_indices])
+        order = np.argsort(trajectory_codes, kind='stable')
+        bounds = np.cumsum(np.bincount(trajectory_codes, minlength=len(unique_trajectory_ids)))[:-1]
+
+        demuxed = dict()
+        for trajectory_id, positions in zip(unique_trajectory_ids, np.split(order, bounds)):
+            demuxed[trajectory_id] = (row_indices[positions], [output[positions] for output in outputs])
+
+        total_time = time.time() - start_time
+        samples = len(row_indices)
+        self.stats = {'samples': samples,
+                      'batches': len(self),
+                      'trajectory_batches': self.get_trajectory_batches_num(),
+                      'batch_utilisation': samples / (len(self) * self.batch_size),
+                      'predict_samples_per_sec': samples / max(predict_time, 1e-9),
+                      'samples_per_sec': samples / max(total_time, 1e-9)}
+        return demuxed
@@ -0,0 +1,99 @@
+import os
+import re
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+INDEX_VERSION = 1
+
+
+def parse_frame_indices(paths):
+    return np.array([int(Path(path).stem) for path in paths], dtype=np.int64)
+
+
+def parse_se3(se3_as_str):
+    se3 = np.array(re.sub(r'\n|\[|\]', '', se3_as_str).strip().split(), dtype=float)
+    return se3.reshape((4, 4))
+
+
+def read_trajectory_df(csv_path):
+    """Read trajectory csv and parse columns stored as strings: frame indices and camera transform."""
+    df = pd.read_csv(csv_path)
+
+    if 'path_to_rgb' in df.columns and 'path_to_rgb_next' in df.columns:
+        df['from_index'] = parse_frame_indices(df['path_to_rgb'].values)
+        df['to_index'] = parse_frame_indices(df['path_to_rgb_next'].values)
+
+    if 'T_body_cam' in df.columns:
+        assert df['T_body_cam'].nunique() == 1
+        df['T_body_cam'] = [parse_se3(df['T_body_cam'].values[0])] * len(df)
+
+    return df
+
+
+class DatasetIndex:
+    """Parsed per-trajectory dataframes of one dataset stored in a single file next to trajectories.
+
+    Every trajectory csv is parsed by `read_trajectory_df` once. Entries are keyed by mtime and size
+    of the source csv and are parsed again when it changes.
+    """
+    def __init__(self, dataset_root, csv_name='df.csv'):
+        self.dataset_root = dataset_root
+        self.csv_name = csv_name
+        self.path = os.path.join(dataset_root, f'.{Path(csv_name).stem}_index.pkl')
+        self.entries = self._load()
+        self.modified = False
+
+    def __repr__(self):
+        return f'DatasetIndex(path={self.path}, trajectories={len(self.entries)})'
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                index = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return dict()
+
+        if index.get('version') != INDEX_VERSION:
+            return dict()
+        return index['entries']
+
+    def _get_stamp(self, csv_path):
+        stat = os.stat(csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, trajectory_name):
+        csv_path = os.path.join(self.dataset_root, trajectory_name, self.csv_name)
+        stamp = self._get_stamp(csv_path)
+
+        entry = self.entries.get(trajectory_name)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, read_trajectory_df(csv_path))
+            self.entries[trajectory_name] = entry
+            self.modified = True
+
+        return entry[1].copy()
+
+    def save(self):
+        if not self.modified:
+            return
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.dataset_root, suffix='.tmp')
+        except OSError:
+            print(f'Dataset root {self.dataset_root} is not writable, dataset index is not saved')
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'version': INDEX_VERSION, 'entries': self.entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.modified = False
@@ -0,0 +1,59 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+
+class DiskImageCache:
+    """Content-addressed cache of preprocessed frames on local disk.
+
+    Every entry is a separate .npy file named by the hash of its key, so entries can be shared by
+    concurrent runs on one host. Writes go to a temporary file in the same directory and are
+    published with an atomic rename, readers never see partial files.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return f'DiskImageCache(cache_dir={self.cache_dir})'
+
+    @staticmethod
+    def get_source_key(fpath):
+        fpath = os.path.realpath(fpath)
+        return fpath, os.stat(fpath).st_mtime_ns
+
+    def _get_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.npy')
+
+    def get(self, key):
+        """Read-only in-memory array of the entry or None.
+
+        Entries are read into memory rather than memory-mapped: they usually end up in an in-memory
+        cache, and one mapping per cached frame would exhaust the per-process map limit.
+        """
+        try:
+            image_arr = np.load(self._get_path(key))
+        except (FileNotFoundError, ValueError):
+            return None
+
+        image_arr.setflags(write=False)
+        return image_arr
+
+    def put(self, key, image_arr):
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(image_arr))
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def __contains__(self, key):
+        return os.path.exists(self._get_path(key))
@@ -1,15 +1,20 @@
 import os
 import psutil
 import numpy as np
-from pathlib import Path
+import pandas as pd
 import keras_preprocessing.image as keras_image
 
 from slam.utils import (get_channels_num,
                         get_fill_fn,
-                        load_image_arr,
-                        resize_image_arr)
+                        get_image_size,
+                        load_image_by_mode)
 
-from slam.linalg import Intrinsics, create_optical_flow_from_rt
+from slam.linalg import create_optical_flow_from_rt_batch
+from slam.data_manager.image_cache import SharedImageCache
+from slam.data_manager.disk_cache import DiskImageCache
+from slam.data_manager.packed_dataset import PackedTrajectory
+from slam.data_manager.dataset_index import parse_frame_indices
+from slam.data_manager.loader_profiler import LoaderProfiler
 
 
 def get_proba_fn(mode, proba=None, steps=None):
@@ -30,10 +35,81 @@ def get_proba_fn(mode, proba=None, steps=None):
     return proba_fn
 
 
+# storage dtype of cached frames per load mode, frames are promoted to the batch dtype on assembly
+DEFAULT_CACHE_DTYPES = {'rgb': 'uint8',
+                        'rgba': 'uint8',
+                        'grayscale': 'uint8',
+                        'flow_xy': 'float16',
+                        'flow_xy_nan': 'float16',
+                        'depth': 'float16',
+                        'disparity': 'float16',
+                        'motion_maps': 'float16',
+                        'motion_maps_xy': 'float16',
+                        'motion_maps_z': 'float16'}
+
+
+# columns shared by all rows of a trajectory, the row appended by include_last keeps them
+TRAJECTORY_COLS = ('trajectory_id', 'f_x', 'f_y', 'c_x', 'c_y', 'T_body_cam', 'T_cam_body')
+
+
+def to_storage_dtype(image_arr, dtype):
+    if dtype is None or image_arr.dtype == dtype:
+        return image_arr
+
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.rint(image_arr), info.min, info.max).astype(dtype)
+
+    return image_arr.astype(dtype)
+
+
 def sample_coordinates(image_size):
     return np.random.uniform(low=(0, 0), high=image_size).astype(int)
 
 
+def get_shard_indices(num_samples, rank=0, world_size=1, seed=None, epoch=0):
+    """Samples read by `rank` out of `world_size` ranks.
+
+    With a seed all ranks draw the same permutation of all samples for `epoch` and `rank` takes every
+    `world_size`-th sample of it, so every rank sees samples of all trajectories and a different
+    subset every epoch. Without a seed samples are strided in their original order. All shards have
+    equal size to keep ranks in lockstep, the order is padded with its first samples.
+    """
+    if num_samples == 0:
+        return np.arange(0)
+
+    shard_size = -(-num_samples // world_size)
+    if seed is None:
+        order = np.arange(num_samples)
+    else:
+        order = np.random.RandomState((seed + epoch) % 2 ** 32).permutation(num_samples)
+    return np.resize(order, shard_size * world_size)[rank::world_size]
+
+
+def get_preprocess_modes(image_cols, preprocess_mode):
+    if isinstance(preprocess_mode, str) or preprocess_mode is None:
+        return {col: preprocess_mode for col in image_cols}
+
+    if isinstance(preprocess_mode, dict):
+        return preprocess_mode
+
+    assert len(preprocess_mode) == len(image_cols)
+    return dict(zip(image_cols, preprocess_mode))
+
+
+def get_image_shapes(image_cols, target_size, preprocess_mode):
+    return {col: tuple(target_size) + (get_channels_num(preprocess_mode[col]),) for col in image_cols}
+
+
+def get_input_shapes(x_col, image_col, target_size=(256, 256), preprocess_mode=None):
+    """Shapes of model inputs produced by ExtendedDataFrameIterator, inferred without loading any data."""
+    x_cols = [x_col] if isinstance(x_col, str) else x_col
+    image_cols = [image_col] if isinstance(image_col, str) else (image_col or [])
+    image_shapes = get_image_shapes(image_cols, target_size, get_preprocess_modes(image_cols, preprocess_mode))
+    return [image_shapes.get(col, (1,)) for col in x_cols]
+
+
 class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_image.Iterator):
     def __init__(self,
                  dataframe,
@@ -57,6 +133,8 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
                  fill_depth_method='random',
                  depth_multiplicator=1.0,
                  cached_images=None,
+                 cache_dtypes=None,
+                 disk_cache=None,
                  filter_invalid=True,
                  max_memory_consumption=0.8,
                  placeholder=None,
@@ -72,12 +150,15 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
                  augment_with_rectangle_mode='constant',
                  epochs=100,
                  predict_generator=False,
+                 packed=False,
+                 rank=0,
+                 world_size=1,
+                 profile=False,
                  **kwargs):
 
         if target_size == -1:
             path_to_first_image = os.path.join(directory, dataframe[image_col].iloc[0].values[0])
-            first_image = load_image_arr(path_to_first_image)
-            target_size = first_image.shape[:2]
+            target_size = get_image_size(path_to_first_image)
 
         super().set_processing_attrs(image_data_generator,
                                      target_size,
@@ -89,8 +170,9 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
                                      subset=subset,
                                      interpolation=interpolation)
 
-        dataframe['to_index'] = dataframe['path_to_rgb_next'].apply(lambda x: int(Path(x).stem))
-        dataframe['from_index'] = dataframe['path_to_rgb'].apply(lambda x: int(Path(x).stem))
+        if 'to_index' not in dataframe.columns or 'from_index' not in dataframe.columns:
+            dataframe['to_index'] = parse_frame_indices(dataframe['path_to_rgb_next'].values)
+            dataframe['from_index'] = parse_frame_indices(dataframe['path_to_rgb'].values)
         index_diff = dataframe['to_index'] - dataframe['from_index']
         is_in_interval = (min_frame_ind_diff < index_diff) & (index_diff < max_frame_ind_diff)
         dataframe = dataframe[is_in_interval].reset_index(drop=True)
@@ -102,7 +184,13 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
         self.dtype = dtype
         self.samples = len(self.df)
 
-        super(ExtendedDataFrameIterator, self).__init__(self.samples,
+        assert 0 <= rank < world_size
+        self.rank = rank
+        self.world_size = world_size
+        self.shard_indices = get_shard_indices(self.samples, rank, world_size)
+        self.epoch = 0
+
+        super(ExtendedDataFrameIterator, self).__init__(len(self.shard_indices),
                                                         batch_size,
                                                         shuffle,
                                                         seed)
@@ -115,7 +203,7 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
         if not self.predict_generator:
             assert set(self.y_cols) <= set(self.df.columns)
 
-        print('y columns', self.return_cols)
+        print('y columns', self.y_cols)
         self.return_cols = self.y_cols[:]
 
         weight_col = weight_col or []
@@ -132,16 +220,16 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
             assert len(load_mode) == len(self.image_cols)
             self.load_mode = dict(zip(self.image_cols, load_mode))
 
-        if isinstance(preprocess_mode, str) or preprocess_mode is None:
-            self.preprocess_mode = {col: preprocess_mode for col in self.image_cols}
-        else:
-            assert len(preprocess_mode) == len(self.image_cols)
-            self.preprocess_mode = dict(zip(self.image_cols, preprocess_mode))
+        self.preprocess_mode = get_preprocess_modes(self.image_cols, preprocess_mode)
+        self.image_shapes = get_image_shapes(self.image_cols, self.target_size, self.preprocess_mode)
 
-        self.image_shapes = {col: self.target_size + (get_channels_num(self.preprocess_mode[col]),)
-                             for col in self.image_cols}
+        self.packed = packed
+        if self.packed:
+            self._init_packed()
 
-        self.fill_flow_fn = get_fill_fn(fill_flow_method, nan_value=np.nan, mean=0, std=1)
+        self.fill_flow_method = fill_flow_method
+        self.fill_depth_method = fill_depth_method
+        self.fill_flow_fn = get_fill_fn(fill_flow_method, nan_value=np.nan)
         self.fill_depth_fn = get_fill_fn(fill_depth_method, nan_value=0)
         self.depth_multiplicator = depth_multiplicator
         self.filter_invalid = filter_invalid
@@ -194,12 +282,17 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
                                                             steps=len(self) * epochs)
 
         self.batches_seen = 0
+        self.profiler = LoaderProfiler(enabled=profile)
 
         self.cached_images = None
         self.set_cache(cached_images)
+        self.cache_dtypes = {**DEFAULT_CACHE_DTYPES, **(cache_dtypes or {})}
+        self.disk_cache = DiskImageCache(disk_cache) if isinstance(disk_cache, str) else disk_cache
         self.max_memory_consumption = max_memory_consumption
         self.stop_caching = False
 
+        self._compile_dataframe()
+
     @property
     def channel_counts(self):
         return [get_channels_num(self.preprocess_mode[col])
@@ -207,65 +300,90 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
 
     @property
     def input_shapes(self):
-        return [self.image_shapes.get(col, (1,)) for col in self.x_cols]
+        return get_input_shapes(self.x_cols, self.image_cols, self.target_size, self.preprocess_mode)
 
-    def _include_last(self):
-        index = len(self.df)
+    def _set_index_array(self):
+        # every rank computes the same epoch permutation, so shards are disjoint within an epoch
+        self.index_array = self.shard_indices
+        if self.shuffle:
+            seed = 0 if self.seed is None else self.seed
+            self.index_array = get_shard_indices(self.samples, self.rank, self.world_size, seed, self.epoch)
+            self.epoch += 1
 
-        for col in self.df.columns:
-            col_next = col + '_next'
-            if col_next in self.df.columns:
-                self.df.at[index, col] = self.df[col_next].iloc[index - 1]
+    def _include_last(self):
+        # the last frame of the trajectory, as a row built from *_next columns of the last pair
+        last_row = self.df.iloc[-1]
+        row = {col: last_row[col + '_next'] for col in self.df.columns if col + '_next' in self.df.columns}
+        row.update({col: last_row[col] for col in TRAJECTORY_COLS if col in self.df.columns})
+        self.df = pd.concat([self.df, pd.DataFrame([row])], ignore_index=True, sort=False)
+
+    def _init_packed(self):
+        trajectory_ids = self.df['trajectory_id'].astype(str).values
+        unique_trajectory_ids, trajectory_codes = np.unique(trajectory_ids, return_inverse=True)
+        self.packed_trajectories = [PackedTrajectory(os.path.join(self.directory, trajectory_id), self.target_size)
+                                    for trajectory_id in unique_trajectory_ids]
+
+        self.packed_index = dict()
+        for col in self.image_cols:
+            rows = np.zeros(self.samples, dtype=np.int64)
+            for code, packed_trajectory in enumerate(self.packed_trajectories):
+                mask = trajectory_codes == code
+                prefix_length = len(unique_trajectory_ids[code]) + 1
+                frames = [fname[prefix_length:] for fname in self.df_images[col].values[mask]]
+                rows[mask] = packed_trajectory.get_rows(self.load_mode[col], frames)
+            self.packed_index[col] = (trajectory_codes, rows)
+
+    def _load_packed_images(self, col, index_array):
+        trajectory_codes, rows = self.packed_index[col]
+        codes = trajectory_codes[index_array]
+        batch_rows = rows[index_array]
+
+        images = None
+        for code in np.unique(codes):
+            mask = codes == code
+            trajectory_images = self.packed_trajectories[code].take(self.load_mode[col], batch_rows[mask])
+            if images is None:
+                images = np.empty((len(index_array),) + trajectory_images.shape[1:], dtype=self.dtype)
+            images[mask] = trajectory_images
+        return images
 
     def _check_stop_caching(self):
         self.stop_caching = False
-        if (self.cached_images is not None) and (len(self.cached_images) % 1000 == 0):
+        # shared cache has an explicit byte budget and evicts by itself
+        if isinstance(self.cached_images, dict) and (len(self.cached_images) % 1000 == 0):
             self.stop_caching = psutil.virtual_memory().percent / 100 > self.max_memory_consumption
 
     def set_cache(self, cached_images):
         if cached_images is not None:
-            assert isinstance(cached_images, dict)
+            assert isinstance(cached_images, (dict, SharedImageCache))
             if len(cached_images) == 0:
                 print('Set empty cache')
+            elif isinstance(cached_images, SharedImageCache):
+                print(f'Set shared cache: {cached_images}')
         else:
             print('No cache')
         self.cached_images = cached_images
 
-    def _load_image(self, fpath, load_mode):
-        if os.path.islink(fpath):
-            fpath = os.readlink(fpath)
-
-        if fpath.endswith('.npy'):
-            image_arr = np.load(fpath)
-        else:
-            pil_mode = None
-            if load_mode == 'grayscale':
-                pil_mode = 'L'
-            elif load_mode == 'rgba':
-                pil_mode = 'RGBA'
-            elif load_mode == 'rgb':
-                pil_mode = 'RGB'
-
-            image_arr = load_image_arr(fpath, mode=pil_mode)
-
-        if len(image_arr.shape) == 2:
-            image_arr = np.expand_dims(image_arr, -1)
+    def _get_cache_key(self, fpath, load_mode, preprocess_mode):
+        # the shared cache outlives this iterator, so everything that affects the stored array is in the key
+        return (fpath, tuple(self.target_size), load_mode, preprocess_mode, self.cache_dtypes.get(load_mode),
+                self.depth_multiplicator, self.fill_flow_method, self.fill_depth_method)
 
-        if load_mode == 'motion_maps':
-            image_arr = image_arr.transpose((1, 2, 0))
-
-        if load_mode == 'motion_maps_z':
-            image_arr = image_arr[[2, 5]].transpose((1, 2, 0))
-
-        if load_mode == 'motion_maps_xy':
-            image_arr = image_arr[[0, 1, 4, 5]].transpose((1, 2, 0))
-
-        image_arr = resize_image_arr(image_arr,
-                                     self.target_size,
-                                     data_format=self.data_format,
-                                     mode=self.interpolation)
+    def _load_image(self, fpath, load_mode):
+        with self.profiler.stage('load'):
+            image_arr = load_image_by_mode(fpath,
+                                           load_mode,
+                                           self.target_size,
+                                           data_format=self.data_format,
+                                           interpolation=self.interpolation)
+        self.profiler.count('bytes_decoded', image_arr.nbytes)
         return image_arr
 
+    @staticmethod
+    def _fill_channels(fill_fn, image_arr):
+        # fill functions work on stacks of frames, so all channels are filled in one call
+        return np.moveaxis(fill_fn(np.moveaxis(image_arr, -1, 0)), 0, -1)
+
     def _preprocess_image(self, image_arr, load_mode, preprocess_mode):
         if load_mode == 'depth':
             image_arr *= self.depth_multiplicator
@@ -285,7 +403,7 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
                     image_arr = np.ones_like(image_arr) * (1. / max_depth)
 
             elif (image_arr == 0).any():
-                image_arr = self.fill_depth_fn(image_arr)
+                image_arr = self._fill_channels(self.fill_depth_fn, image_arr)
 
         if load_mode == preprocess_mode:
             return image_arr
@@ -293,8 +411,7 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
         if load_mode == 'flow_xy' and preprocess_mode == 'flow_xy_nan':
             isnan = (np.isnan(image_arr[:, :, 0]) | np.isnan(image_arr[:, :, 1])).astype(self.dtype)
             if isnan.any():
-                image_arr[:, :, 0] = self.fill_flow_fn(image_arr[:, :, 0])
-                image_arr[:, :, 1] = self.fill_flow_fn(image_arr[:, :, 1])
+                image_arr = self._fill_channels(self.fill_flow_fn, image_arr)
 
             image_arr = np.concatenate([image_arr, np.expand_dims(isnan, -1)], axis=-1)
 
@@ -311,23 +428,91 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
 
         return image_arr
 
-    def _get_preprocessed_image(self, fname, load_mode, preprocess_mode):
-        fpath = os.path.join(self.directory, fname)
-        if (self.cached_images is not None) and (fpath in self.cached_images):
-            image_arr = self.cached_images[fpath]
-        else:
-            image_arr = self._load_image(fpath, load_mode)
-            image_arr = self._preprocess_image(image_arr, load_mode, preprocess_mode)
+    def _compile_dataframe(self):
+        # column-major copies of everything the batch assembly reads, so it does not touch pandas
+        self.image_paths = {col: np.array([os.path.join(self.directory, fname) for fname in self.df[col].values])
+                            for col in self.image_cols}
+
+        value_cols = [col for col in self.x_cols + self.y_cols + self.w_cols
+                      if col not in self.image_cols and col in self.df.columns]
+        self.column_values = {col: self.df[col].values for col in value_cols}
+
+        self.x_slots = {col: index for index, col in enumerate(self.x_cols)}
+        self.y_slots = {col: index for index, col in enumerate(self.y_cols)}
+
+        if self.generate_distribution is not None:
+            self.dofs = self.df_dofs.values.astype(np.float64)
+            self.intrinsics = self.df_intrinsics.values.astype(np.float64)
+
+    def _add_to_cache(self, cache_key, image_arr):
+        self._check_stop_caching()
+        if (self.cached_images is not None) and (not self.stop_caching):
+            self.cached_images[cache_key] = image_arr
+
+    def _get_preprocessed_image(self, fpath, load_mode, preprocess_mode):
+        """Returns the preprocessed frame, a read-only view of the cached array when it is cached.
+
+        Frames are only copied into batch buffers, code that modifies frames works on batch slots or
+        on arrays it allocates itself.
+        """
+        cache_key = self._get_cache_key(fpath, load_mode, preprocess_mode)
+
+        image_arr = None
+        if self.cached_images is not None:
+            with self.profiler.stage('cache_get'):
+                image_arr = self.cached_images.get(cache_key)
+            self.profiler.count('cache_misses' if image_arr is None else 'cache_hits')
+
+        if image_arr is None and self.disk_cache is not None:
+            disk_cache_key = cache_key + self.disk_cache.get_source_key(fpath)
+            with self.profiler.stage('disk_cache_get'):
+                image_arr = self.disk_cache.get(disk_cache_key)
+            self.profiler.count('disk_cache_misses' if image_arr is None else 'disk_cache_hits')
+
+            if image_arr is None:
+                image_arr = self._load_image(fpath, load_mode)
+                with self.profiler.stage('preprocess'):
+                    image_arr = self._preprocess_image(image_arr, load_mode, preprocess_mode)
+                if image_arr is not None:
+                    image_arr = to_storage_dtype(image_arr, self.cache_dtypes.get(load_mode))
+                    image_arr.setflags(write=False)
+                    self.disk_cache.put(disk_cache_key, image_arr)
 
             if image_arr is not None:
-                self._check_stop_caching()
-                if (self.cached_images is not None) and (not self.stop_caching):
-                    self.cached_images[fpath] = image_arr
+                self._add_to_cache(cache_key, image_arr)
 
-        if image_arr is None:
-            return None
+        elif image_arr is None:
+            image_arr = self._load_image(fpath, load_mode)
+            with self.profiler.stage('preprocess'):
+                image_arr = self._preprocess_image(image_arr, load_mode, preprocess_mode)
 
-        return image_arr.copy()
+            if image_arr is not None and self.cached_images is not None:
+                # hits and misses return the same values whether or not the frame is already cached
+                image_arr = to_storage_dtype(image_arr, self.cache_dtypes.get(load_mode))
+                image_arr.setflags(write=False)
+                self._add_to_cache(cache_key, image_arr)
+
+        return image_arr
+
+    def _load_unique_images(self, index_array, generate_flow_by_rt):
+        """Decode and preprocess every distinct (file, load mode, preprocess mode) of a batch once.
+
+        Returns the list of images and, for every image column, the position of each sample's image
+        in that list (None for optical flow that is going to be generated from depth).
+        """
+        keys = dict()
+        positions = dict()
+        for col in self.image_cols:
+            mode = (self.load_mode[col], self.preprocess_mode[col])
+            positions[col] = []
+            for index_in_batch, fpath in enumerate(self.image_paths[col][index_array]):
+                if col == 'path_to_optical_flow' and generate_flow_by_rt[index_in_batch]:
+                    positions[col].append(None)
+                else:
+                    positions[col].append(keys.setdefault((fpath,) + mode, len(keys)))
+
+        images = [self._get_preprocessed_image(*key) for key in keys]
+        return images, positions
 
     def _init_batch(self, cols, index_array, add_placeholder=False):
         batch = []
@@ -337,7 +522,7 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
                 batch.append(
                     np.zeros((len(index_array),) + self.image_shapes[col], dtype=self.dtype))
             else:
-                values = self.df[col].values[index_array]
+                values = self.column_values[col][index_array]
 
                 if add_placeholder:
                     ones = np.ones((len(values), len(self.placeholder)))
@@ -347,7 +532,70 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
 
         return batch
 
+    def _sample_dofs(self, df_row_indices):
+        num_samples = len(df_row_indices)
+        if self.generate_distribution == 'uniform':
+            low, high = self.gt_low_high_bounds
+            dofs = np.random.uniform(low, high, size=(num_samples, len(low)))
+        elif self.generate_distribution in ('normal', 'student'):
+            mean, std = np.array(self.mean_std).T
+            if self.generate_distribution == 'normal':
+                dofs = np.random.normal(loc=mean, scale=std, size=(num_samples, len(mean)))
+            else:
+                dofs = np.random.standard_t(4, size=(num_samples, len(mean))) / 1.4136 * std + mean
+        elif self.generate_distribution == 'same':
+            dofs = self.dofs[df_row_indices]
+        elif self.generate_distribution == 'shuffle':
+            targets_row_indices = np.random.randint(len(self.df), size=num_samples)
+            dofs = self.dofs[targets_row_indices]
+        else:
+            raise RuntimeError(f'{self.generate_distribution} generate_distribution is not supported')
+        return dofs
+
+    def _augment_with_rectangle(self, image_arr):
+        y1, x1 = sample_coordinates(image_arr[..., 0].shape)
+        y2, x2 = sample_coordinates(image_arr[..., 0].shape)
+
+        y_dst, x_dst = min(y1, y2), min(x1, x2)
+        h, w = abs(y1 - y2), abs(x1 - x2)
+
+        y_src, x_src = sample_coordinates((image_arr.shape[0] - h, image_arr.shape[1] - w))
+        rectangle_src = image_arr[y_src:y_src + h, x_src:x_src + w]
+
+        noise = np.random.uniform(-0.1, 0.1)
+        image_arr[y_dst:y_dst + h, x_dst:x_dst + w] = rectangle_src + noise
+        return image_arr
+
+    def _generate_flows(self, depth_arrs, df_row_indices):
+        dofs = self._sample_dofs(df_row_indices)
+        with self.profiler.stage('generate_flow'):
+            flows, valid = create_optical_flow_from_rt_batch(np.stack(depth_arrs)[..., 0],
+                                                             self.intrinsics[df_row_indices],
+                                                             dofs[:, :3],
+                                                             dofs[:, 3:])
+        self.profiler.count('generated_flows', len(flows))
+
+        augment_with_rectangle_proba = self.augment_with_rectangle_proba_fn(self.batches_seen)
+        augment_with_rectangle = augment_with_rectangle_proba > np.random.uniform(size=len(flows))
+        with self.profiler.stage('augment_rectangle'):
+            for flow_arr in flows[valid & augment_with_rectangle]:
+                self._augment_with_rectangle(flow_arr)
+
+        return flows, dofs, valid
+
+    def _set_sample(self, batch_x, batch_y, col, index_in_batch, image_arr):
+        with self.profiler.stage('batch_copy'):
+            if col in self.x_slots:
+                batch_x[self.x_slots[col]][index_in_batch] = image_arr
+
+            if not self.predict_generator and col in self.y_slots:
+                batch_y[self.y_slots[col]][index_in_batch] = image_arr
+
     def _get_batches_of_transformed_samples(self, index_array):
+        with self.profiler.stage('batch'):
+            return self._assemble_batch(index_array)
+
+    def _assemble_batch(self, index_array):
         batch_x = self._init_batch(self.x_cols, index_array)
         if self.predict_generator:
             batch_y = None
@@ -358,75 +606,56 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
         generate_flow_by_rt_proba = self.generate_flow_by_rt_proba_fn(self.batches_seen)
         if generate_flow_by_rt_proba > 0:
             print(f'batch #{self.batches_seen} / {len(self)}: p={generate_flow_by_rt_proba}')
+        generate_flow_by_rt = generate_flow_by_rt_proba > np.random.uniform(size=len(index_array))
+
+        if not self.packed:
+            unique_images, positions = self._load_unique_images(index_array, generate_flow_by_rt)
 
         # build batch of image data
         valid_samples = np.ones(len(index_array)).astype(bool)
-        for index_in_batch, df_row_index in enumerate(index_array):
-            generate_flow_by_rt = generate_flow_by_rt_proba > np.random.uniform()
-
-            for col, fname in self.df_images.iloc[df_row_index].iteritems():
-                if col == 'path_to_optical_flow' and generate_flow_by_rt:
+        for col in self.image_cols:
+            load_mode = self.load_mode[col]
+            preprocess_mode = self.preprocess_mode[col]
+            generate_from_col = col.endswith('depth')
+
+            if self.packed:
+                with self.profiler.stage('load_packed'):
+                    packed_images = self._load_packed_images(col, index_array)
+
+            generated_samples = []
+            depth_arrs = []
+            for index_in_batch, df_row_index in enumerate(index_array):
+                if col == 'path_to_optical_flow' and generate_flow_by_rt[index_in_batch]:
                     continue
 
-                image_arr = self._get_preprocessed_image(fname, self.load_mode[col], self.preprocess_mode[col])
+                if self.packed:
+                    with self.profiler.stage('preprocess'):
+                        image_arr = self._preprocess_image(packed_images[index_in_batch], load_mode, preprocess_mode)
+                else:
+                    image_arr = unique_images[positions[col][index_in_batch]]
+
                 if image_arr is None:
                     valid_samples[index_in_batch] = False
                     continue
 
-                if col.endswith('depth') and generate_flow_by_rt:
-                    col = 'path_to_optical_flow'
-
-                    if self.generate_distribution == 'uniform':
-                        dofs = np.random.uniform(*(self.gt_low_high_bounds))
-                    elif self.generate_distribution == 'normal':
-                        dofs = np.array([np.random.normal(loc=mean, scale=std) for mean, std in self.mean_std])
-                    elif self.generate_distribution == 'student':
-                        dofs = np.array([np.random.standard_t(4) / 1.4136 * std + mean
-                                         for mean, std in self.mean_std])
-                    elif self.generate_distribution == 'same':
-                        dofs = self.df_dofs.iloc[df_row_index].values
-                    elif self.generate_distribution == 'shuffle':
-                        targets_row_index = np.random.randint(len(self.df))
-                        dofs = self.df_dofs.iloc[targets_row_index].values
-                    else:
-                        raise RuntimeError(f'{self.generate_distribution} generate_distribution is not supported')
-
-                    rotation_vector, translation_vector = dofs[:3], dofs[3:]
-
-                    intrinsics_args = dict(self.df_intrinsics.iloc[df_row_index])
-                    intrinsics_args.update({'width': image_arr.shape[1], 'height': image_arr.shape[0]})
-
-                    image_arr = create_optical_flow_from_rt(image_arr[..., 0],
-                                                            Intrinsics(**intrinsics_args),
-                                                            rotation_vector,
-                                                            translation_vector)
-                    if image_arr is None:
-                        valid_samples[index_in_batch] = False
-                        continue
-
-                    augment_with_rectangle_proba = self.augment_with_rectangle_proba_fn(self.batches_seen)
-                    if augment_with_rectangle_proba > np.random.uniform():
-                        y1, x1 = sample_coordinates(image_arr[..., 0].shape)
-                        y2, x2 = sample_coordinates(image_arr[..., 0].shape)
-
-                        y_dst, x_dst = min(y1, y2), min(x1, x2)
-                        h, w = abs(y1 - y2), abs(x1 - x2)
+                if generate_from_col and generate_flow_by_rt[index_in_batch]:
+                    generated_samples.append(index_in_batch)
+                    depth_arrs.append(image_arr)
+                    continue
 
-                        y_src, x_src = sample_coordinates((image_arr.shape[0] - h, image_arr.shape[1] - w))
-                        rectangle_src = image_arr[y_src:y_src + h, x_src:x_src + w]
+                self._set_sample(batch_x, batch_y, col, index_in_batch, image_arr)
 
-                        noise = np.random.uniform(-0.1, 0.1)
-                        image_arr[y_dst:y_dst + h, x_dst:x_dst + w] = rectangle_src + noise
+            if generated_samples:
+                flows, dofs, valid = self._generate_flows(depth_arrs, np.asarray(index_array)[generated_samples])
+                for index_in_batch, flow_arr, sample_dofs, is_valid in zip(generated_samples, flows, dofs, valid):
+                    if not is_valid:
+                        valid_samples[index_in_batch] = False
+                        continue
 
+                    self._set_sample(batch_x, batch_y, 'path_to_optical_flow', index_in_batch, flow_arr)
                     if not self.predict_generator:
-                        for dof_name, dof_value in zip(self.dof_cols, dofs):
-                            batch_y[self.y_cols.index(dof_name)][index_in_batch] = dof_value
-
-                if col in self.x_cols:
-                    batch_x[self.x_cols.index(col)][index_in_batch] = image_arr
-
-                if not self.predict_generator and col in self.y_cols:
-                    batch_y[self.y_cols.index(col)][index_in_batch] = image_arr
+                        for dof_name, dof_value in zip(self.dof_cols, sample_dofs):
+                            batch_y[self.y_slots[dof_name]][index_in_batch] = dof_value
 
         batch_x = [features[valid_samples] for features in batch_x]
 
@@ -436,6 +665,11 @@ class ExtendedDataFrameIterator(keras_image.iterator.BatchFromFilesMixin, keras_
         if np.sum(valid_samples) < 0.5 * len(index_array):
             print('Batch is too small: {} samples'.format(np.sum(valid_samples)))
 
+        self.profiler.count('batches')
+        self.profiler.count('batch_capacity', self.batch_size)
+        self.profiler.count('samples', int(np.sum(valid_samples)))
+        self.profiler.count('invalid_samples', int(len(index_array) - np.sum(valid_samples)))
+
         self.batches_seen += 1
 
         if batch_w:
@@ -1,5 +1,4 @@
 import os
-import re
 import json
 import warnings
 import pickle
@@ -9,9 +8,12 @@ import numpy as np
 import pandas as pd
 from keras_preprocessing.image import ImageDataGenerator
 
-from slam.data_manager.generator import ExtendedDataFrameIterator
+from slam.data_manager.generator import ExtendedDataFrameIterator, get_input_shapes
+from slam.data_manager.image_cache import SharedImageCache
+from slam.data_manager.disk_cache import DiskImageCache
+from slam.data_manager.dataset_index import DatasetIndex, read_trajectory_df
 from slam.linalg import RelativeTrajectory, GlobalTrajectory, convert
-from slam.utils import mlflow_logging
+from slam.utils import mlflow_logging, get_image_size
 
 
 class GeneratorFactory:
@@ -39,6 +41,12 @@ class GeneratorFactory:
                  test_strides=1,
                  batch_size=128,
                  cached_images=None,
+                 packed=False,
+                 disk_cache_dir=None,
+                 conversion_checks=10,
+                 use_dataset_index=True,
+                 rank=0,
+                 world_size=1,
                  *args, **kwargs):
 
         self.dataset_root = dataset_root
@@ -51,6 +59,8 @@ class GeneratorFactory:
         self.y_col = list(y_col)
         self.image_col = list(image_col)
         self.dof_col = ['euler_x', 'euler_y', 'euler_z', 't_x', 't_y', 't_z']
+        # number of rows per trajectory for which conversion to camera coordinates is verified by round-trip
+        self.conversion_checks = conversion_checks
 
         self.weight_fn = weight_fn
         self.weight_col = 'weight' if self.weight_fn is not None else None
@@ -66,10 +76,15 @@ class GeneratorFactory:
         self.val_trajectories = val_trajectories
         self.test_trajectories = test_trajectories
 
+        self.dataset_index = DatasetIndex(self.dataset_root, self.csv_name) if use_dataset_index else None
+
         self.df_train, self.df_train_as_is = self._get_multi_df_dataset(self.train_trajectories, 'train', strides=train_strides)
         self.df_val, self.df_val_as_is = self._get_multi_df_dataset(self.val_trajectories, 'val', strides=val_strides)
         self.df_test, self.df_test_as_is = self._get_multi_df_dataset(self.test_trajectories, 'test', strides=test_strides)
 
+        if self.dataset_index is not None:
+            self.dataset_index.save()
+
         if number_of_folds is not None:
             val_ratio = 1. / number_of_folds
 
@@ -91,14 +106,38 @@ class GeneratorFactory:
         self.args = args
         self.kwargs = kwargs
 
+        # training samples are split between `world_size` ranks, see get_shard_indices
+        self.rank = rank
+        self.world_size = world_size
+
+        # generators are built on first request and shared between callers, see _get_subset_generator
+        self.generators = dict()
+
+        self.packed = packed
+        if self.packed and cached_images is not None:
+            print('Serving frames from packed trajectories, image cache is disabled')
+            cached_images = None
+
+        self.disk_cache = DiskImageCache(disk_cache_dir) if disk_cache_dir else None
+
         self.cached_images = cached_images
         if type(self.cached_images) == str:
             self.load_cache(self.cached_images)
 
     @property
     def input_shapes(self):
-        return (self.get_train_generator().input_shapes if self.train_trajectories
-                else self.get_val_generator().input_shapes)
+        if self.train_trajectories:
+            dataframe, generator_args = self.df_train, self.train_generator_args
+        else:
+            dataframe, generator_args = self.df_val_as_is, self.val_generator_args
+
+        generator_args = {**self.kwargs, **generator_args}
+        shape_args = {arg: generator_args[arg] for arg in ('target_size', 'preprocess_mode') if arg in generator_args}
+        if shape_args.get('target_size') == -1:
+            first_image_path = os.path.join(self.dataset_root, dataframe[self.image_col].iloc[0].values[0])
+            shape_args['target_size'] = get_image_size(first_image_path)
+
+        return get_input_shapes(self.x_col, self.image_col, **shape_args)
 
     def _log_dataset_params(self):
         if mlflow.active_run():
@@ -116,24 +155,21 @@ class GeneratorFactory:
                 mlflow.log_param('optical_flow_checkpoint', None)
 
     def transform_to_camera_coordinate_system(self, current_df):
-        assert current_df['T_body_cam'].nunique() == 1
-
         if not (set(self.dof_col) <= set(current_df.columns)):
             return current_df
 
-        T_body_cam_as_str = current_df['T_body_cam'].values[0]
-        T_body_cam = np.array(re.sub(r'\n|\[|\]', '', T_body_cam_as_str).strip().split(), dtype=float)
-        T_body_cam = T_body_cam.reshape((4, 4))
+        T_body_cam = current_df['T_body_cam'].values[0]
         T_cam_body = np.linalg.inv(T_body_cam)
-
-        current_df['T_body_cam'] = [T_body_cam] * len(current_df)
         current_df['T_cam_body'] = [T_cam_body] * len(current_df)
 
-        for index, row in current_df.iterrows():
-            dofs = row[self.dof_col].values
-            current_df.loc[index, self.dof_col] = convert(dofs, T=T_body_cam)
-            dofs_converted_back = convert(current_df.loc[index, self.dof_col].values, T=T_cam_body)
-            assert np.allclose(np.array(dofs).astype(float), dofs_converted_back)
+        dofs = current_df[self.dof_col].values.astype(float)
+        dofs_converted = convert(dofs, T=T_body_cam)
+        current_df[self.dof_col] = dofs_converted
+
+        if self.conversion_checks:
+            check_indices = np.linspace(0, len(dofs) - 1, min(self.conversion_checks, len(dofs))).astype(int)
+            dofs_converted_back = convert(dofs_converted[check_indices], T=T_cam_body)
+            assert np.allclose(dofs[check_indices], dofs_converted_back)
 
         return current_df
 
@@ -142,21 +178,27 @@ class GeneratorFactory:
         current_df[self.weight_col] /= current_df[self.weight_col].mean()
         return current_df
 
+    def _read_trajectory_df(self, trajectory_name):
+        if self.dataset_index is not None:
+            return self.dataset_index.get(trajectory_name)
+        return read_trajectory_df(os.path.join(self.dataset_root, trajectory_name, self.csv_name))
+
     def _get_multi_df_dataset(self, trajectories, subset, strides=1):
-        df = None
-        df_as_is = None
         if not trajectories:
-            return df, df_as_is
+            return None, None
 
         strides = [strides] * len(trajectories) if isinstance(strides, int) else strides
 
+        dfs = []
+        dfs_as_is = []
         for trajectory_name, stride in tqdm.tqdm(zip(trajectories, strides),
                                                  total=len(trajectories),
                                                  desc=f'Collect {subset} trajectories'):
-            current_df = pd.read_csv(os.path.join(self.dataset_root, trajectory_name, self.csv_name))
+            current_df = self._read_trajectory_df(trajectory_name)
 
             image_col_next = [image_col + '_next' for image_col in self.image_col]
             image_col_all = self.image_col + list(filter(lambda x: x in current_df.columns, image_col_next))
+            image_col_all = list(dict.fromkeys(image_col_all))
             current_df[image_col_all] = trajectory_name + '/' + current_df[image_col_all]
 
             current_df['trajectory_id'] = trajectory_name
@@ -168,13 +210,11 @@ class GeneratorFactory:
             if 'T_body_cam' in current_df.columns:
                 current_df = self.transform_to_camera_coordinate_system(current_df)
 
-            df = current_df if df is None else df.append(current_df, sort=False)
-
-            current_df_as_is = current_df.iloc[::stride]
-            df_as_is = current_df_as_is if df_as_is is None else df_as_is.append(current_df_as_is, sort=False)
+            dfs.append(current_df)
+            dfs_as_is.append(current_df.iloc[::stride])
 
-        df.index = range(len(df))
-        df_as_is.index = range(len(df_as_is))
+        df = pd.concat(dfs, sort=False, ignore_index=True)
+        df_as_is = pd.concat(dfs_as_is, sort=False, ignore_index=True)
         return df, df_as_is
 
     def load_cache(self, cache_file):
@@ -188,6 +228,10 @@ class GeneratorFactory:
             print(f'Successfully loaded cached images from {cache_file}')
 
     def dump_cache(self, cache_file):
+        if isinstance(self.cached_images, SharedImageCache):
+            print(f'Shared cache is kept in {self.cached_images.path}, nothing to dump')
+            return
+
         with open(cache_file, 'wb') as cache_fp:
             pickle.dump(self.cached_images, cache_fp)
         print(f'Saved cached images to {cache_file}')
@@ -222,6 +266,8 @@ class GeneratorFactory:
             seed=42,
             interpolation='nearest',
             cached_images=self.cached_images,
+            packed=self.packed,
+            disk_cache=self.disk_cache,
             filter_invalid=filter_invalid,
             include_last=include_last,
             trajectory_id=trajectory_id,
@@ -263,35 +309,32 @@ class GeneratorFactory:
                                                       trajectory=as_is,
                                                       include_last=include_last)
 
-    def get_train_generator(self, as_is=False, as_list=False, include_last=False, augment=True):
-
-        df_train = self.df_train_as_is if as_is else self.df_train
-
-        return self._get_generator(df_train,
-                                   self.train_generator_args if augment else {},
-                                   self.train_trajectories,
-                                   as_is=as_is,
-                                   as_list=as_list,
-                                   include_last=include_last)
+    def _get_subset_generator(self, subset, as_is, as_list, include_last, augment, shard=False):
+        """Generator of a subset, built on first request and shared by all later callers with the same arguments.
+
+        Generators are stateful iterators: callers sharing one generator also share its position and epoch,
+        so a consumer that needs its own pass should use different arguments or build its own generator.
+        Only `shard=True` restricts samples to this rank, evaluation and prediction must cover the whole subset.
+        """
+        key = (subset, as_is, as_list, include_last, augment, shard)
+        if key not in self.generators:
+            dataframe = getattr(self, f'df_{subset}_as_is' if as_is else f'df_{subset}')
+            generator_args = getattr(self, f'{subset}_generator_args') if augment else {}
+            if shard and not as_is and not as_list:
+                generator_args = {**generator_args, 'rank': self.rank, 'world_size': self.world_size}
+            self.generators[key] = self._get_generator(dataframe,
+                                                       generator_args,
+                                                       getattr(self, f'{subset}_trajectories'),
+                                                       as_is=as_is,
+                                                       as_list=as_list,
+                                                       include_last=include_last)
+        return self.generators[key]
+
+    def get_train_generator(self, as_is=False, as_list=False, include_last=False, augment=True, shard=False):
+        return self._get_subset_generator('train', as_is, as_list, include_last, augment, shard)
 
     def get_val_generator(self, as_is=True, as_list=False, include_last=False, augment=True):
-
-        df_val = self.df_val_as_is if as_is else self.df_val
-
-        return self._get_generator(df_val,
-                                   self.val_generator_args if augment else {},
-                                   self.val_trajectories,
-                                   as_is=as_is,
-                                   as_list=as_list,
-                                   include_last=include_last)
+        return self._get_subset_generator('val', as_is, as_list, include_last, augment)
 
     def get_test_generator(self, as_is=True, as_list=False, include_last=False, augment=True):
-
-        df_test = self.df_test_as_is if as_is else self.df_test
-
-        return self._get_generator(df_test,
-                                   self.test_generator_args if augment else {},
-                                   self.test_trajectories,
-                                   as_is=as_is,
-                                   as_list=as_list,
-                                   include_last=include_last)
+        return self._get_subset_generator('test', as_is, as_list, include_last, augment)
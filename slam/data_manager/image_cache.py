@@ -0,0 +1,411 @@
+import os
+import mmap
+import fcntl
+import hashlib
+import tempfile
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+
+MAGIC = 0x534c414d43414348  # 'SLAMCACH'
+VERSION = 2
+
+HEADER_BYTES = 4096
+ALIGNMENT = 4096
+MAX_NDIM = 4
+DIGEST_WORDS = 4
+
+USED = np.uint8(1)
+REF = np.uint8(2)
+
+DTYPES = ('uint8', 'int8', 'uint16', 'int16', 'float16', 'uint32', 'int32', 'float32', 'int64', 'float64', 'bool')
+
+HEADER_DTYPE = np.dtype([('magic', '<u8'),
+                         ('version', '<u8'),
+                         ('page_bytes', '<u8'),
+                         ('min_slot_bytes', '<u8'),
+                         ('n_pages', '<u8'),
+                         ('index_size', '<u8')])
+
+STATS = ('hits', 'misses', 'insertions', 'evictions', 'rejections')
+
+
+def get_default_cache_path(max_bytes, page_bytes, min_slot_bytes):
+    # arenas of different layouts never share a file, so no process has to resize a live arena
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(root, f'slam_image_cache_v{VERSION}_{max_bytes}_{page_bytes}_{min_slot_bytes}')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _digest_key(key):
+    key_as_bytes = key.encode() if isinstance(key, str) else repr(key).encode()
+    digest = hashlib.blake2b(key_as_bytes, digest_size=8 * DIGEST_WORDS).digest()
+    return np.frombuffer(digest, dtype='<i8')
+
+
+class SharedImageCache:
+    """Host-wide cache of preprocessed frames in a memory-mapped arena.
+
+    The arena is a file (by default in /dev/shm) split into pages of `page_bytes`. Pages are
+    assigned on demand to slab classes of power-of-two slot sizes starting from `min_slot_bytes`.
+    Within a class slots are evicted with CLOCK, pages are moved between classes proportionally
+    to the insertion demand of each class. Index, slot metadata and data all live in the arena,
+    so every process that opens the same path (including forked loader workers and unpickled
+    copies) sees the same entries. Mutations are serialized with flock on a sidecar lock file.
+    The index is probed by the first word of a 256-bit key digest and every hit is confirmed
+    against the full digest stored with the slot.
+    """
+    def __init__(self,
+                 path=None,
+                 max_bytes=2 ** 32,
+                 page_bytes=2 ** 23,
+                 min_slot_bytes=2 ** 16):
+
+        assert page_bytes % min_slot_bytes == 0
+        assert max_bytes >= page_bytes
+
+        self.max_bytes = int(max_bytes)
+        self.page_bytes = int(page_bytes)
+        self.min_slot_bytes = int(min_slot_bytes)
+        self.path = path or get_default_cache_path(self.max_bytes, self.page_bytes, self.min_slot_bytes)
+
+        self.n_pages = self.max_bytes // self.page_bytes
+        self.slots_per_page = self.page_bytes // self.min_slot_bytes
+        self.n_slots = self.n_pages * self.slots_per_page
+        self.n_classes = int(np.log2(self.slots_per_page)) + 1
+        self.index_size = 1 << int(np.ceil(np.log2(2 * self.n_slots)))
+
+        self._thread_lock = threading.RLock()
+        self._lock_fd = None
+        self._pid = None
+        self._file = None
+        self._mm = None
+
+        self._open()
+
+    def _get_layout(self):
+        layout = dict()
+        offset = HEADER_BYTES
+        for name, dtype, shape in (('index', np.int64, (self.index_size, 2)),
+                                   ('page_class', np.int32, (self.n_pages,)),
+                                   ('class_hand', np.int64, (self.n_classes,)),
+                                   ('class_demand', np.int64, (self.n_classes,)),
+                                   ('page_hand', np.int64, (1,)),
+                                   ('stats', np.int64, (len(STATS),)),
+                                   ('slot_digest', np.int64, (self.n_slots, DIGEST_WORDS)),
+                                   ('slot_flags', np.uint8, (self.n_slots,)),
+                                   ('slot_dtype', np.uint8, (self.n_slots,)),
+                                   ('slot_ndim', np.uint8, (self.n_slots,)),
+                                   ('slot_shape', np.uint32, (self.n_slots, MAX_NDIM))):
+            layout[name] = (offset, dtype, shape)
+            offset = _align(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+
+        data_offset = offset
+        total_bytes = data_offset + self.n_pages * self.page_bytes
+        return layout, data_offset, total_bytes
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+
+        layout, self._data_offset, total_bytes = self._get_layout()
+        with self._lock():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._file = os.fdopen(fd, 'r+b')
+            size = os.fstat(fd).st_size
+            created = size == 0
+            # other processes may have the arena mapped, so an arena of another layout is never resized
+            compatible = created or (size == total_bytes and self._is_compatible(fd))
+            if created:
+                os.ftruncate(fd, total_bytes)
+
+            if compatible:
+                self._mm = mmap.mmap(fd, total_bytes)
+                for name, (offset, dtype, shape) in layout.items():
+                    array = np.frombuffer(self._mm, dtype=dtype, count=int(np.prod(shape)), offset=offset)
+                    setattr(self, '_' + name, array.reshape(shape))
+
+            if created:
+                self._index[:, 1] = -1
+                self._page_class[:] = -1
+                header = np.frombuffer(self._mm, dtype=HEADER_DTYPE, count=1)
+                header[0] = (MAGIC, VERSION, self.page_bytes, self.min_slot_bytes, self.n_pages, self.index_size)
+
+        if not compatible:
+            self._file.close()
+            os.close(self._lock_fd)
+            raise ValueError(f'{self.path} holds a cache arena with another layout or version, '
+                             f'unlink it or pass another path')
+
+    def _is_compatible(self, fd):
+        header = np.frombuffer(os.pread(fd, HEADER_DTYPE.itemsize, 0), dtype=HEADER_DTYPE)[0]
+        return tuple(header) == (MAGIC, VERSION, self.page_bytes, self.min_slot_bytes, self.n_pages, self.index_size)
+
+    @contextmanager
+    def _lock(self):
+        with self._thread_lock:
+            if self._pid != os.getpid():
+                # flock is bound to the open file description, which a forked child shares
+                self._pid = os.getpid()
+                self._lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def __getstate__(self):
+        return {'path': self.path,
+                'max_bytes': self.max_bytes,
+                'page_bytes': self.page_bytes,
+                'min_slot_bytes': self.min_slot_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return (f'SharedImageCache(path={self.path}, entries={len(self)}, '
+                f'used={self.nbytes / 2 ** 20:.1f}MB, max={self.max_bytes / 2 ** 20:.1f}MB)')
+
+    # index
+
+    def _home(self, key_hash):
+        return key_hash & (self.index_size - 1)
+
+    def _find(self, digest):
+        key_hash = int(digest[0])
+        position = self._home(key_hash)
+        while self._index[position, 1] != -1:
+            if self._index[position, 0] == key_hash \
+                    and np.array_equal(self._slot_digest[self._index[position, 1]], digest):
+                return position
+            position = (position + 1) & (self.index_size - 1)
+        return None
+
+    def _insert_index(self, digest, slot):
+        key_hash = int(digest[0])
+        position = self._home(key_hash)
+        while self._index[position, 1] != -1:
+            position = (position + 1) & (self.index_size - 1)
+        self._index[position] = (key_hash, slot)
+
+    def _remove_index(self, position):
+        # backward shift deletion keeps linear probing chains intact without tombstones
+        mask = self.index_size - 1
+        next_position = position
+        while True:
+            next_position = (next_position + 1) & mask
+            if self._index[next_position, 1] == -1:
+                break
+            home = self._home(int(self._index[next_position, 0]))
+            if position <= next_position:
+                stays = position < home <= next_position
+            else:
+                stays = home > position or home <= next_position
+            if not stays:
+                self._index[position] = self._index[next_position]
+                position = next_position
+        self._index[position] = (0, -1)
+
+    # slots
+
+    def _get_class(self, nbytes):
+        return max(0, int(np.ceil(np.log2(max(nbytes, 1) / self.min_slot_bytes))))
+
+    def _get_slot_bytes(self, class_index):
+        return self.min_slot_bytes << class_index
+
+    def _get_class_slots(self, class_index, pages=None):
+        pages = np.flatnonzero(self._page_class == class_index) if pages is None else pages
+        slots_in_page = self.page_bytes // self._get_slot_bytes(class_index)
+        return (pages[:, None] * self.slots_per_page + np.arange(slots_in_page)[None]).ravel()
+
+    def _get_slot_view(self, slot):
+        page, index_in_page = divmod(int(slot), self.slots_per_page)
+        slot_bytes = self._get_slot_bytes(int(self._page_class[page]))
+        offset = self._data_offset + page * self.page_bytes + index_in_page * slot_bytes
+        ndim = int(self._slot_ndim[slot])
+        shape = tuple(int(s) for s in self._slot_shape[slot, :ndim])
+        dtype = np.dtype(DTYPES[self._slot_dtype[slot]])
+        return np.ndarray(shape, dtype=dtype, buffer=self._mm, offset=offset)
+
+    def _evict_slot(self, slot):
+        position = self._find(self._slot_digest[slot].copy())
+        if position is not None:
+            self._remove_index(position)
+        self._slot_flags[slot] = 0
+        self._stats[STATS.index('evictions')] += 1
+
+    def _evict_page(self, page):
+        class_index = int(self._page_class[page])
+        slots = self._get_class_slots(class_index, pages=np.array([page]))
+        for slot in slots[(self._slot_flags[slots] & USED) > 0]:
+            self._evict_slot(slot)
+        self._page_class[page] = -1
+
+    def _steal_page(self, class_index):
+        pages_per_class = np.bincount(self._page_class[self._page_class >= 0], minlength=self.n_classes)
+        demand = self._class_demand / max(self._class_demand.sum(), 1)
+        surplus = pages_per_class - demand * self.n_pages
+        surplus[class_index] = -np.inf
+        donor = int(np.argmax(surplus))
+        donor_pages = np.flatnonzero(self._page_class == donor)
+        if len(donor_pages) == 0:
+            return None
+
+        page = donor_pages[self._page_hand[0] % len(donor_pages)]
+        self._page_hand[0] += 1
+        self._evict_page(page)
+        return page
+
+    def _allocate(self, class_index):
+        slots = self._get_class_slots(class_index)
+        free_slots = slots[(self._slot_flags[slots] & USED) == 0]
+        if len(free_slots):
+            return free_slots[0]
+
+        free_pages = np.flatnonzero(self._page_class == -1)
+        if len(free_pages) == 0:
+            pages_count = len(slots) * self._get_slot_bytes(class_index) // self.page_bytes
+            fair_pages_count = self._class_demand[class_index] / max(self._class_demand.sum(), 1) * self.n_pages
+            if len(slots) == 0 or pages_count < fair_pages_count:
+                stolen_page = self._steal_page(class_index)
+                free_pages = np.array([] if stolen_page is None else [stolen_page], dtype=int)
+
+        if len(free_pages):
+            page = free_pages[0]
+            self._page_class[page] = class_index
+            return page * self.slots_per_page
+
+        if len(slots) == 0:
+            return None
+
+        # CLOCK: sweep from the hand, clearing reference bits until an unreferenced slot is found
+        start = np.searchsorted(slots, self._class_hand[class_index]) % len(slots)
+        order = np.roll(slots, -start)
+        unreferenced = np.flatnonzero((self._slot_flags[order] & REF) == 0)
+        if len(unreferenced):
+            victim_index = unreferenced[0]
+            self._slot_flags[order[:victim_index]] &= ~REF
+        else:
+            victim_index = 0
+            self._slot_flags[order] &= ~REF
+
+        victim = order[victim_index]
+        self._class_hand[class_index] = order[(victim_index + 1) % len(order)]
+        self._evict_slot(victim)
+        return victim
+
+    # mapping interface
+
+    def get(self, key, default=None):
+        digest = _digest_key(key)
+        with self._lock():
+            position = self._find(digest)
+            if position is None:
+                self._stats[STATS.index('misses')] += 1
+                return default
+
+            slot = int(self._index[position, 1])
+            self._slot_flags[slot] |= REF
+            self._stats[STATS.index('hits')] += 1
+            return self._get_slot_view(slot).copy()
+
+    def put(self, key, image_arr):
+        """Store a copy of `image_arr`. Returns False if it does not fit into a page."""
+        image_arr = np.ascontiguousarray(image_arr)
+        assert image_arr.ndim <= MAX_NDIM
+
+        if image_arr.nbytes > self.page_bytes:
+            with self._lock():
+                self._stats[STATS.index('rejections')] += 1
+            return False
+
+        digest = _digest_key(key)
+        class_index = self._get_class(image_arr.nbytes)
+        with self._lock():
+            position = self._find(digest)
+            if position is not None:
+                self._evict_slot(int(self._index[position, 1]))
+                self._stats[STATS.index('evictions')] -= 1
+
+            self._class_demand[class_index] += 1
+            slot = self._allocate(class_index)
+            if slot is None:
+                self._stats[STATS.index('rejections')] += 1
+                return False
+
+            self._slot_digest[slot] = digest
+            self._slot_flags[slot] = USED | REF
+            self._slot_dtype[slot] = DTYPES.index(image_arr.dtype.name)
+            self._slot_ndim[slot] = image_arr.ndim
+            self._slot_shape[slot, :image_arr.ndim] = image_arr.shape
+            self._get_slot_view(slot)[...] = image_arr
+            self._insert_index(digest, slot)
+            self._stats[STATS.index('insertions')] += 1
+        return True
+
+    def __getitem__(self, key):
+        image_arr = self.get(key)
+        if image_arr is None:
+            raise KeyError(key)
+        return image_arr
+
+    def __setitem__(self, key, image_arr):
+        self.put(key, image_arr)
+
+    def __contains__(self, key):
+        with self._lock():
+            return self._find(_digest_key(key)) is not None
+
+    def __delitem__(self, key):
+        with self._lock():
+            position = self._find(_digest_key(key))
+            if position is None:
+                raise KeyError(key)
+            self._evict_slot(int(self._index[position, 1]))
+
+    def __len__(self):
+        with self._lock():
+            return int(np.count_nonzero(self._slot_flags & USED))
+
+    @property
+    def nbytes(self):
+        with self._lock():
+            used_pages = self._page_class >= 0
+            slot_bytes = self.min_slot_bytes << self._page_class[used_pages].astype(np.int64)
+            used_slots = (self._slot_flags & USED).reshape(self.n_pages, self.slots_per_page)[used_pages].sum(axis=1)
+            return int((used_slots * slot_bytes).sum())
+
+    @property
+    def stats(self):
+        with self._lock():
+            return dict(zip(STATS, (int(value) for value in self._stats)))
+
+    def clear(self):
+        with self._lock():
+            self._index[:, 1] = -1
+            self._page_class[:] = -1
+            self._slot_flags[:] = 0
+            self._class_hand[:] = 0
+            self._class_demand[:] = 0
+
+    def close(self):
+        if self._mm is not None:
+            for name in self._get_layout()[0]:
+                setattr(self, '_' + name, None)
+            self._mm.close()
+            self._file.close()
+            os.close(self._lock_fd)
+            self._mm = None
+
+    def unlink(self):
+        self.close()
+        for path in (self.path, self.path + '.lock'):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,86 @@
+import time
+from collections import defaultdict
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    __slots__ = ('times', 'stage', 'start_time')
+
+    def __init__(self, times, stage):
+        self.times = times
+        self.stage = stage
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.times[self.stage] += time.perf_counter() - self.start_time
+        return False
+
+
+class LoaderProfiler:
+    """Per-stage timers and counters of ExtendedDataFrameIterator.
+
+    Disabled profiler returns a shared no-op context manager from `stage` and ignores `count`,
+    so instrumented code costs one method call per stage. Stages may be nested, the time of a
+    stage includes the time of stages inside it.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.times = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def __repr__(self):
+        return f'LoaderProfiler(enabled={self.enabled})'
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self.times, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def reset(self):
+        self.times.clear()
+        self.counters.clear()
+
+    def get_state(self):
+        return dict(self.times), dict(self.counters)
+
+    def merge(self, state):
+        """Add timers and counters collected by a copy of the profiler, e.g. in a loader worker."""
+        times, counters = state
+        for name, value in times.items():
+            self.times[name] += value
+        for name, value in counters.items():
+            self.counters[name] += value
+
+    def summary(self):
+        summary = {f'{name}_sec': value for name, value in self.times.items()}
+        summary.update(self.counters)
+
+        samples = self.counters.get('samples', 0)
+        cache_hits = self.counters.get('cache_hits', 0)
+        lookups = cache_hits + self.counters.get('cache_misses', 0)
+        if lookups:
+            summary['cache_hit_ratio'] = cache_hits / lookups
+
+        if self.counters.get('batch_capacity'):
+            summary['batch_fill_ratio'] = samples / self.counters['batch_capacity']
+
+        if self.times.get('batch'):
+            summary['samples_per_sec'] = samples / self.times['batch']
+        return summary
@@ -0,0 +1,142 @@
+import os
+import json
+import shutil
+import tqdm
+import numpy as np
+import pandas as pd
+
+from slam.utils import load_image_by_mode
+
+
+DEFAULT_LOAD_MODES = {'path_to_rgb': 'rgb',
+                      'path_to_optical_flow': 'flow_xy',
+                      'path_to_depth': 'depth',
+                      'path_to_motion_maps': 'motion_maps'}
+
+# load modes that are served from channels of another packed modality
+DERIVED_LOAD_MODES = {'motion_maps_z': ('motion_maps', [2, 5]),
+                      'motion_maps_xy': ('motion_maps', [0, 1, 4, 5])}
+
+INTEGER_LOAD_MODES = ('rgb', 'rgba', 'grayscale')
+
+INDEX_FILENAME = 'index.json'
+
+
+def get_packed_dir(trajectory_dir, target_size):
+    height, width = target_size
+    return os.path.join(trajectory_dir, 'packed', f'{height}x{width}')
+
+
+def pack_trajectory(trajectory_dir,
+                    target_size,
+                    load_modes=None,
+                    csv_name='df.csv',
+                    interpolation='nearest',
+                    overwrite=False):
+    """Pack frames of a trajectory into one memory-mapped array per load mode.
+
+    Args:
+        trajectory_dir: directory with `csv_name` and frames referenced by it
+        target_size: (height, width) to which frames are resized once at packing time
+        load_modes: dict column -> load mode. Columns with `_next` suffix are packed together with
+                    the base column. By default all of rgb, optical_flow, depth and motion_maps columns
+                    present in the csv are packed.
+    """
+    packed_dir = get_packed_dir(trajectory_dir, target_size)
+    if os.path.exists(os.path.join(packed_dir, INDEX_FILENAME)) and not overwrite:
+        print(f'{packed_dir} already exists, skipped')
+        return packed_dir
+
+    df = pd.read_csv(os.path.join(trajectory_dir, csv_name))
+    load_modes = load_modes or {col: mode for col, mode in DEFAULT_LOAD_MODES.items() if col in df.columns}
+
+    frames_by_mode = dict()
+    for col, load_mode in load_modes.items():
+        load_mode = DERIVED_LOAD_MODES.get(load_mode, (load_mode, None))[0]
+        for column in (col, col + '_next'):
+            if column in df.columns:
+                frames_by_mode.setdefault(load_mode, []).extend(df[column].astype(str).values)
+
+    tmp_dir = packed_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    index = {'target_size': list(target_size), 'interpolation': interpolation, 'modalities': dict()}
+    for load_mode, frames in frames_by_mode.items():
+        frames = list(dict.fromkeys(frames))
+        packed_images = None
+        for row, frame in enumerate(tqdm.tqdm(frames, desc=f'Pack {load_mode} of {trajectory_dir}')):
+            image_arr = load_image_by_mode(os.path.join(trajectory_dir, frame),
+                                           load_mode,
+                                           tuple(target_size),
+                                           interpolation=interpolation)
+            if packed_images is None:
+                dtype = np.uint8 if load_mode in INTEGER_LOAD_MODES else image_arr.dtype
+                packed_images = np.lib.format.open_memmap(os.path.join(tmp_dir, f'{load_mode}.npy'),
+                                                          mode='w+',
+                                                          dtype=dtype,
+                                                          shape=(len(frames),) + image_arr.shape)
+            packed_images[row] = image_arr
+
+        packed_images.flush()
+        index['modalities'][load_mode] = {'dtype': packed_images.dtype.name,
+                                          'shape': list(packed_images.shape),
+                                          'frames': {frame: row for row, frame in enumerate(frames)}}
+        del packed_images
+
+    with open(os.path.join(tmp_dir, INDEX_FILENAME), 'w') as f:
+        json.dump(index, f)
+
+    shutil.rmtree(packed_dir, ignore_errors=True)
+    os.rename(tmp_dir, packed_dir)
+    return packed_dir
+
+
+def pack_dataset(dataset_root, trajectories, target_size, **kwargs):
+    for trajectory in trajectories:
+        pack_trajectory(os.path.join(dataset_root, trajectory), target_size, **kwargs)
+
+
+class PackedTrajectory:
+    """Read-only view of a trajectory packed by `pack_trajectory`."""
+    def __init__(self, trajectory_dir, target_size):
+        self.packed_dir = get_packed_dir(trajectory_dir, target_size)
+        index_path = os.path.join(self.packed_dir, INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(f'No packed frames for size {target_size} in {trajectory_dir}. '
+                                    'Run scripts/prepare_dataset/pack_dataset.py first')
+
+        with open(index_path, 'r') as f:
+            self.index = json.load(f)
+
+        self.arrays = dict()
+
+    def _get_array(self, load_mode):
+        if load_mode not in self.arrays:
+            self.arrays[load_mode] = np.load(os.path.join(self.packed_dir, f'{load_mode}.npy'), mmap_mode='r')
+        return self.arrays[load_mode]
+
+    def get_shape(self, load_mode):
+        base_load_mode, channels = DERIVED_LOAD_MODES.get(load_mode, (load_mode, None))
+        shape = self.index['modalities'][base_load_mode]['shape'][1:]
+        if channels is not None:
+            shape[-1] = len(channels)
+        return tuple(shape)
+
+    def get_rows(self, load_mode, frames):
+        base_load_mode = DERIVED_LOAD_MODES.get(load_mode, (load_mode, None))[0]
+        if base_load_mode not in self.index['modalities']:
+            raise KeyError(f'Load mode {base_load_mode} is not packed in {self.packed_dir}')
+
+        rows = self.index['modalities'][base_load_mode]['frames']
+        return np.array([rows[frame] for frame in frames], dtype=np.int64)
+
+    def take(self, load_mode, rows):
+        base_load_mode, channels = DERIVED_LOAD_MODES.get(load_mode, (load_mode, None))
+        images = self._get_array(base_load_mode)[rows]
+        if channels is not None:
+            images = images[..., channels]
+        return images
+
+    def __getstate__(self):
+        return {**self.__dict__, 'arrays': dict()}
@@ -0,0 +1,235 @@
+import os
+import json
+import tqdm
+import fcntl
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from contextlib import contextmanager
+
+
+META_FILENAME = 'meta.json'
+
+
+def _get_tensor_names(batch):
+    names = []
+    for prefix, tensors in zip('xyw', batch):
+        names.extend(f'{prefix}_{index}' for index in range(len(tensors)))
+    return names
+
+
+def _get_bytes_feature(array):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[np.ascontiguousarray(array).tobytes()]))
+
+
+def get_fingerprint(generator):
+    """Hash of the samples of ExtendedDataFrameIterator and of every setting that changes their values."""
+    config = (generator.directory,
+              generator.x_cols,
+              generator.y_cols,
+              generator.w_cols,
+              generator.return_cols,
+              generator.load_mode,
+              generator.preprocess_mode,
+              tuple(generator.target_size),
+              generator.interpolation,
+              generator.dtype,
+              sorted(generator.cache_dtypes.items()),
+              generator.depth_multiplicator,
+              generator.fill_flow_method,
+              generator.fill_depth_method,
+              generator.filter_invalid,
+              generator.rank,
+              generator.world_size)
+    digest = hashlib.sha1(repr(config).encode())
+    digest.update(pd.util.hash_pandas_object(generator.df.astype(str)).values.tobytes())
+    return digest.hexdigest()
+
+
+@contextmanager
+def _lock(output_dir):
+    os.makedirs(os.path.dirname(os.path.abspath(output_dir)), exist_ok=True)
+    with open(output_dir + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_tfrecords(generator, output_dir, num_shards=8):
+    """Write batches of ExtendedDataFrameIterator to sharded TFRecord files.
+
+    Every sample is stored as tf.train.Example with one raw-bytes feature per model input (x_*),
+    target (y_*, including placeholder columns) and weight (w_*). Shapes, dtypes and the fingerprint
+    of the generator are stored in meta.json. Random augmentations are frozen at export time, so
+    export generators built with augment=False. Files are written to a temporary directory that
+    replaces `output_dir` when the export is complete.
+    """
+    tmp_dir = output_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    paths = [os.path.join(tmp_dir, f'{shard:05d}-of-{num_shards:05d}.tfrecord') for shard in range(num_shards)]
+    writers = [tf.python_io.TFRecordWriter(path) for path in paths]
+
+    generator.reset()
+    meta = None
+    num_samples = 0
+    for batch_index in tqdm.tqdm(range(len(generator)), desc=f'Export to {output_dir}'):
+        batch = generator[batch_index]
+        batch = (batch,) if not isinstance(batch, tuple) else batch
+        tensors = [tensor for tensors in batch for tensor in tensors]
+
+        if meta is None:
+            meta = {'tensors': [{'name': name, 'dtype': tensor.dtype.name, 'shape': list(tensor.shape[1:])}
+                                for name, tensor in zip(_get_tensor_names(batch), tensors)],
+                    'structure': [len(tensors) for tensors in batch]}
+
+        for sample_index in range(len(tensors[0])):
+            feature = {spec['name']: _get_bytes_feature(tensor[sample_index])
+                       for spec, tensor in zip(meta['tensors'], tensors)}
+            example = tf.train.Example(features=tf.train.Features(feature=feature))
+            writers[num_samples % num_shards].write(example.SerializeToString())
+            num_samples += 1
+
+    for writer in writers:
+        writer.close()
+
+    meta['num_samples'] = num_samples
+    meta['paths'] = [os.path.basename(path) for path in paths]
+    meta['fingerprint'] = get_fingerprint(generator)
+    with open(os.path.join(tmp_dir, META_FILENAME), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(tmp_dir, output_dir)
+    return output_dir
+
+
+def read_meta(tfrecord_dir):
+    with open(os.path.join(tfrecord_dir, META_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def ensure_tfrecords(generator, output_dir, num_shards=8):
+    """Export `generator` unless `output_dir` already holds an export with the same fingerprint.
+
+    Concurrent calls (e.g. from all ranks of a run) are serialized with flock on a sidecar lock file,
+    so the data is exported once and the other callers reuse it.
+    """
+    with _lock(output_dir):
+        try:
+            fingerprint = read_meta(output_dir).get('fingerprint')
+        except FileNotFoundError:
+            fingerprint = None
+
+        if fingerprint != get_fingerprint(generator):
+            if fingerprint is not None:
+                print(f'{output_dir} was exported from other data, export again')
+            export_tfrecords(generator, output_dir, num_shards=num_shards)
+
+    return output_dir
+
+
+def build_tf_dataset(tfrecord_dir,
+                     batch_size,
+                     shuffle=True,
+                     seed=42,
+                     shuffle_buffer_size=10000,
+                     num_parallel_calls=None,
+                     rank=0,
+                     world_size=1):
+    """tf.data pipeline over files written by `export_tfrecords`.
+
+    Elements are tuples (x, y) or (x, y, w) of tuples of tensors with the same shapes and dtypes
+    as batches of the exported ExtendedDataFrameIterator. Reading, parsing and prefetching run in
+    TensorFlow threads, by default with autotuned parallelism.
+
+    With `world_size` > 1 every rank reads the records in the same order (files are shuffled with
+    the same seed and interleaved deterministically) and keeps every `world_size`-th of them, so
+    ranks read disjoint samples that change from epoch to epoch.
+    """
+    assert 0 <= rank < world_size
+    meta = read_meta(tfrecord_dir)
+    num_parallel_calls = num_parallel_calls or tf.data.experimental.AUTOTUNE
+
+    paths = [os.path.join(tfrecord_dir, path) for path in meta['paths']]
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    if shuffle:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.apply(tf.data.experimental.parallel_interleave(tf.data.TFRecordDataset,
+                                                                     cycle_length=len(paths),
+                                                                     sloppy=shuffle and world_size == 1))
+    if world_size > 1:
+        dataset = dataset.shard(world_size, rank)
+
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer_size, seed=seed, reshuffle_each_iteration=True)
+
+    features = {spec['name']: tf.FixedLenFeature([], tf.string) for spec in meta['tensors']}
+
+    def parse_batch(serialized):
+        parsed = tf.parse_example(serialized, features)
+        tensors = []
+        for spec in meta['tensors']:
+            tensor = tf.decode_raw(parsed[spec['name']], tf.as_dtype(spec['dtype']))
+            tensors.append(tf.reshape(tensor, [-1] + spec['shape']))
+
+        structured = []
+        for size in meta['structure']:
+            structured.append(tuple(tensors[:size]))
+            tensors = tensors[size:]
+        return tuple(structured)
+
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(parse_batch, num_parallel_calls=num_parallel_calls)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+class TFRecordGenerator:
+    """Python iterator over `build_tf_dataset` for Keras fit_generator.
+
+    Only the session call runs in Python, decoding and batching happen in TensorFlow threads.
+    """
+    def __init__(self,
+                 tfrecord_dir,
+                 batch_size,
+                 shuffle=True,
+                 seed=42,
+                 num_parallel_calls=None,
+                 rank=0,
+                 world_size=1,
+                 session=None):
+        self.meta = read_meta(tfrecord_dir)
+        self.batch_size = batch_size
+        self.num_samples = len(range(rank, self.meta['num_samples'], world_size))
+
+        dataset = build_tf_dataset(tfrecord_dir,
+                                   batch_size,
+                                   shuffle=shuffle,
+                                   seed=seed,
+                                   num_parallel_calls=num_parallel_calls,
+                                   rank=rank,
+                                   world_size=world_size).repeat()
+        self.next_batch = dataset.make_one_shot_iterator().get_next()
+
+        if session is None:
+            from keras import backend as K
+            session = K.get_session()
+        self.session = session
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch = self.session.run(self.next_batch)
+        return tuple(list(tensors) for tensors in batch)
+
+    def next(self):
+        return self.__next__()
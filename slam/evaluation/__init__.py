@@ -4,6 +4,7 @@ from .evaluate import normalize_metrics
 from .evaluate import calculate_loops_metrics
 
 from .callbacks import CyclicLR
+from .callbacks import LoaderStats
 from .callbacks import MlflowLogger
 from .callbacks import ModelCheckpoint
 from .callbacks import Predict
@@ -16,6 +17,7 @@ __all__ = [
     'normalize_metrics',
     'calculate_loops_metrics',
     'CyclicLR',
+    'LoaderStats',
     'MlflowLogger',
     'ModelCheckpoint',
     'Predict',
@@ -3,6 +3,8 @@ import keras
 
 from .cyclic_lr_callback import CyclicLR
 
+from .loader_stats_callback import LoaderStats
+
 from .mlflow_logger_callback import MlflowLogger
 
 from .model_checkpoint_callback import ModelCheckpoint
@@ -14,6 +16,7 @@ from .terminate_on_lr_callback import TerminateOnLR
 
 __all__ = [
     'CyclicLR',
+    'LoaderStats',
     'MlflowLogger',
     'ModelCheckpoint',
     'Predict',
@@ -0,0 +1,32 @@
+import keras
+
+
+class LoaderStats(keras.callbacks.Callback):
+    """Adds per-epoch stats of data generator profilers to logs.
+
+    Must be placed before MlflowLogger in the list of callbacks, which then logs the stats
+    with the rest of epoch metrics.
+    """
+    def __init__(self, profilers, prefix='loader', **kwargs):
+
+        super().__init__(**kwargs)
+
+        self.profilers = profilers
+        self.prefix = prefix
+
+    def on_epoch_begin(self, epoch, logs=None):
+        for profiler in self.profilers.values():
+            profiler.reset()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+
+        for name, profiler in self.profilers.items():
+            for key, value in profiler.summary().items():
+                logs[f'{self.prefix}_{name}_{key}'] = value
+            profiler.reset()
+
+        return logs
+
+    def on_train_end(self, logs=None):
+        return logs
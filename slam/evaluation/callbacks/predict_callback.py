@@ -9,7 +9,13 @@ import keras
 from pathlib import Path
 
 from slam.evaluation import calculate_metrics, average_metrics, normalize_metrics, calculate_loops_metrics
-from slam.linalg import RelativeTrajectory, convert
+from slam.evaluation.streaming import (predict_chunks,
+                                       get_strides,
+                                       get_gt_path,
+                                       create_predictions_df,
+                                       TrajectoryPredictionWriter)
+from slam.data_manager import CrossTrajectoryIterator
+from slam.linalg import RelativeTrajectory, GlobalTrajectory, convert
 from slam.utils import (visualize_trajectory_with_gt,
                         visualize_trajectory,
                         create_vis_file_path,
@@ -17,11 +23,37 @@ from slam.utils import (visualize_trajectory_with_gt,
                         chmod)
 
 
+def create_trajectory(df, dof_cols, T=None):
+    if T is not None:
+        df[dof_cols] = convert(df[dof_cols].values.astype(float), T=T)
+
+    df['to_index'] = df['path_to_rgb_next'].apply(lambda x: int(Path(x).stem))
+    df['from_index'] = df['path_to_rgb'].apply(lambda x: int(Path(x).stem))
+    index_difference = df.to_index - df.from_index
+    min_stride = np.min(index_difference.values)
+    consecutive_df = df[index_difference == min_stride].reset_index(drop=True)
+    return RelativeTrajectory.from_dataframe(consecutive_df[dof_cols]).to_global()
+
+
+def load_task(args):
+    """Predictions and trajectories of the task, read from disk for tasks created in streaming mode."""
+    if args.get('prediction_path') is None:
+        return args['predicted_df'], args['gt_df'], args['predicted'], args['gt']
+
+    predicted_df = pd.read_csv(args['prediction_path'], index_col=0)
+    predicted_trajectory = GlobalTrajectory.from_transformation_matrices(np.load(args['poses_path']))
+
+    gt_df = None
+    gt_trajectory = None
+    if args.get('gt_path') is not None:
+        gt_df = pd.read_pickle(args['gt_path'])
+        gt_trajectory = create_trajectory(gt_df, args['dof_cols'], T=args['T'])
+
+    return predicted_df, gt_df, predicted_trajectory, gt_trajectory
+
+
 def process_single_task(args):
-    predicted_df = args['predicted_df']
-    gt_df = args['gt_df']
-    gt_trajectory = args['gt']
-    predicted_trajectory = args['predicted']
+    predicted_df, gt_df, predicted_trajectory, gt_trajectory = load_task(args)
     rpe_indices = args['rpe_indices']
     backend = args['backend']
     cuda = args['cuda']
@@ -52,6 +84,7 @@ class Predict(keras.callbacks.Callback):
                  backend='numpy',
                  cuda=False,
                  workers=8,
+                 chunk_size=None,
                  **kwargs):
 
         super().__init__(**kwargs)
@@ -76,33 +109,38 @@ class Predict(keras.callbacks.Callback):
         self.backend = backend
         self.cuda = cuda
         self.workers = workers if backend == 'numpy' else 0
+        # predict trajectories by chunks of chunk_size rows and write them to disk as they go
+        self.chunk_size = chunk_size
 
         self.last_prediction_id = None
         self.last_logs = None
+        # throughput and batch utilisation of the last predictions, added to logs as {subset}_predict_*
+        self.predict_stats = dict()
 
-        self.train_generator = dataset.get_train_generator(as_is=self.evaluate, augment=False)
-        self.val_generator = dataset.get_val_generator(augment=False)
-        self.test_generator = dataset.get_test_generator(augment=False)
+        self.dataset = dataset
 
         self.df_train = dataset.df_train
         self.df_val = dataset.df_val
         self.df_test = dataset.df_test
 
-        self.y_cols = self.train_generator.y_cols[:]
-        self.dof_cols = self.train_generator.dof_cols[:]
+        self.y_cols = dataset.y_col[:]
+        self.dof_cols = dataset.dof_col[:]
+
+    # generators are built by the dataset on first use, so a callback that never predicts does not build them
+    @property
+    def train_generator(self):
+        return self.dataset.get_train_generator(as_is=self.evaluate, augment=False, shard=False)
+
+    @property
+    def val_generator(self):
+        return self.dataset.get_val_generator(augment=False)
+
+    @property
+    def test_generator(self):
+        return self.dataset.get_test_generator(augment=False)
 
     def _create_trajectory(self, df, T=None):
-        if T is not None:
-            for index, row in df.iterrows():
-                dofs = row[self.dof_cols].values
-                df.loc[index, self.dof_cols] = convert(dofs, T=T)
-
-        df['to_index'] = df['path_to_rgb_next'].apply(lambda x: int(Path(x).stem))
-        df['from_index'] = df['path_to_rgb'].apply(lambda x: int(Path(x).stem))
-        index_difference = df.to_index - df.from_index
-        min_stride = np.min(index_difference.values)
-        consecutive_df = df[index_difference == min_stride].reset_index(drop=True)
-        return RelativeTrajectory.from_dataframe(consecutive_df[self.dof_cols]).to_global()
+        return create_trajectory(df, self.dof_cols, T=T)
 
     def _create_prediction_file_path(self, trajectory_id, subset, prediction_id):
         return create_prediction_file_path(trajectory_id=trajectory_id,
@@ -161,40 +199,102 @@ class Predict(keras.callbacks.Callback):
                                          file_path=file_path)
         chmod(file_path)
 
-    def _predict_generator(self, generator):
-        generator.reset()
+    def _predict_generator(self, generator, subset):
         generator.y_cols = self.y_cols[:]
-        model_output = self.model.predict_generator(generator, steps=len(generator))
-        data = np.stack(model_output).transpose(1, 2, 0)
-        data = data.reshape((len(data), -1))
-
-        print('index', generator.df.index)
-        print('return', generator.return_cols)
-        predictions = pd.DataFrame(data=data,
-                                   index=generator.df.index,
-                                   columns=generator.return_cols).astype(float)
-        predictions['path_to_rgb'] = generator.df.path_to_rgb
-        predictions['path_to_rgb_next'] = generator.df.path_to_rgb_next
+        iterator = CrossTrajectoryIterator(generator)
+        outputs = iterator.predict(self.model)
+        for key, value in iterator.stats.items():
+            self.predict_stats[f'{subset}_predict_{key}'] = value
+
+        predictions = dict()
+        for trajectory_id, (row_indices, model_output) in outputs.items():
+            predictions[trajectory_id] = (row_indices, create_predictions_df(generator, row_indices, model_output))
         return predictions
 
+    @staticmethod
+    def _get_T_cam_body(gt_df):
+        if 'T_cam_body' in gt_df.columns:
+            return gt_df['T_cam_body'].values[0]
+        return None
+
+    def _get_staging_dir(self):
+        return self._get_prediction_dir('.streaming')
+
+    def _remove_staging_dir(self):
+        # streaming tasks are read from here until they are saved (copied) under their prediction id
+        shutil.rmtree(self._get_staging_dir(), ignore_errors=True)
+
+    def _create_streaming_tasks(self, generator, subset):
+        staging_dir = os.path.join(self._get_staging_dir(), subset)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        generator.y_cols = self.y_cols[:]
+
+        tasks = []
+        writer = None
+        for trajectory_id, _, predicted_df in predict_chunks(self.model, generator, self.chunk_size):
+            if writer is None or tasks[-1]['id'] != trajectory_id:
+                if writer is not None:
+                    writer.close()
+
+                gt_df = generator.df[generator.df.trajectory_id == trajectory_id]
+                strides = get_strides(gt_df)
+                min_stride = np.min(strides)
+                num_poses = np.sum(strides == min_stride) + 1
+                T_cam_body = self._get_T_cam_body(gt_df)
+                file_path = self._create_prediction_file_path(trajectory_id, subset, '.streaming')
+                writer = TrajectoryPredictionWriter(file_path,
+                                                    self.dof_cols,
+                                                    min_stride,
+                                                    num_poses,
+                                                    T=T_cam_body)
+
+                # ground truth is staged next to predictions, so tasks sent to workers stay small
+                gt_path = None
+                if self.evaluate:
+                    gt_path = get_gt_path(writer.file_path)
+                    gt_df.to_pickle(gt_path)
+
+                tasks.append({'predicted_df': None,
+                              'gt_df': None,
+                              'predicted': None,
+                              'gt': None,
+                              'prediction_path': writer.file_path,
+                              'poses_path': writer.poses_path,
+                              'gt_path': gt_path,
+                              'dof_cols': self.dof_cols,
+                              'T': T_cam_body,
+                              'id': trajectory_id,
+                              'subset': subset,
+                              'rpe_indices': self.rpe_indices,
+                              'backend': self.backend,
+                              'cuda': self.cuda,
+                              'loop_threshold': 50})
+
+            writer.write(predicted_df)
+
+        if writer is not None:
+            writer.close()
+
+        return tasks
+
     def _create_tasks(self, generator, subset):
         tasks = []
 
         if generator is None:
             return tasks
 
+        if self.chunk_size:
+            return self._create_streaming_tasks(generator, subset)
+
         gt = generator.df
-        predictions = self._predict_generator(generator)
+        predictions = self._predict_generator(generator, subset)
 
-        for trajectory_id, indices in gt.groupby(by='trajectory_id').indices.items():
+        for trajectory_id, (indices, predicted_df) in predictions.items():
 
-            predicted_df = predictions.iloc[indices].copy()
             gt_df = gt.iloc[indices].copy()
 
-            if 'T_cam_body' in gt_df.columns:
-                T_cam_body = gt_df.get('T_cam_body', None).values[0]
-            else:
-                T_cam_body = None
+            T_cam_body = self._get_T_cam_body(gt_df)
 
             predicted_trajectory = self._create_trajectory(predicted_df, T=T_cam_body)
 
@@ -222,18 +322,21 @@ class Predict(keras.callbacks.Callback):
 
         counter = Counter()
         for task in tasks:
-            predicted_df = task['predicted_df']
             trajectory_id = task['id']
             subset = task['subset']
 
-            self._save_predictions(predicted_df,
-                                   trajectory_id,
-                                   subset,
-                                   prediction_id)
+            if task.get('prediction_path') is None:
+                self._save_predictions(task['predicted_df'],
+                                       trajectory_id,
+                                       subset,
+                                       prediction_id)
+            else:
+                file_path = self._create_prediction_file_path(trajectory_id, subset, prediction_id)
+                shutil.copyfile(task['prediction_path'], file_path)
+                chmod(file_path)
 
             if counter[subset] < max_to_visualize:
-                gt_trajectory = task['gt']
-                predicted_trajectory = task['predicted']
+                _, _, predicted_trajectory, gt_trajectory = load_task(task)
                 record = task.get('record', None)
 
                 self._visualize_trajectory(predicted_trajectory,
@@ -286,6 +389,9 @@ class Predict(keras.callbacks.Callback):
             train_tasks = self._create_tasks(self.train_generator, 'train')
             val_tasks = self._create_tasks(self.val_generator, 'val')
 
+            logs.update(self.predict_stats)
+            self.predict_stats.clear()
+
             if self.evaluate:
                 train_tasks, train_metrics = self._evaluate_tasks(train_tasks)
                 val_tasks, val_metrics = self._evaluate_tasks(val_tasks)
@@ -299,6 +405,8 @@ class Predict(keras.callbacks.Callback):
                 self.epochs_since_last_predict = 0
                 self.last_prediction_id = prediction_id
 
+            self._remove_staging_dir()
+
         self.last_logs = logs
         return logs
 
@@ -327,10 +435,13 @@ class Predict(keras.callbacks.Callback):
             logs = self.last_logs
 
         test_tasks = self._create_tasks(self.test_generator, 'test')
+        logs = dict(**logs, **self.predict_stats)
+        self.predict_stats.clear()
         if self.evaluate:
             test_tasks, test_metrics = self._evaluate_tasks(test_tasks)
             logs = dict(**logs, **test_metrics)
 
         self._save_tasks(test_tasks, prediction_id='test')
+        self._remove_staging_dir()
 
         return logs
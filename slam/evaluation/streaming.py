@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+from slam.linalg import PoseAccumulator, convert
+from slam.data_manager.dataset_index import parse_frame_indices
+
+
+def create_predictions_df(generator, row_indices, model_output):
+    """Predictions for rows of generator.df in the format of csv files saved by `Predict`."""
+    data = np.stack(model_output).transpose(1, 2, 0)
+    data = data.reshape((len(data), -1))
+    assert len(data) == len(row_indices), 'Invalid samples are dropped from batch, can not align predictions'
+
+    df = generator.df
+    predictions = pd.DataFrame(data=data,
+                               index=df.index[row_indices],
+                               columns=generator.return_cols).astype(float)
+    predictions['path_to_rgb'] = df.path_to_rgb.values[row_indices]
+    predictions['path_to_rgb_next'] = df.path_to_rgb_next.values[row_indices]
+    return predictions
+
+
+def predict_rows(model, generator, row_indices):
+    """Predict rows of generator.df batch by batch, without running over the whole generator."""
+    outputs = []
+    for start in range(0, len(row_indices), generator.batch_size):
+        batch = generator._get_batches_of_transformed_samples(row_indices[start:start + generator.batch_size])
+        batch_x = batch if generator.predict_generator else batch[0]
+        batch_output = model.predict_on_batch(batch_x)
+        outputs.append(batch_output if isinstance(batch_output, list) else [batch_output])
+
+    model_output = [np.concatenate(output) for output in zip(*outputs)]
+    return create_predictions_df(generator, row_indices, model_output)
+
+
+def predict_chunks(model, generator, chunk_size=1024):
+    """Yield (trajectory_id, row_indices, predictions) for consecutive chunks of every trajectory.
+
+    Trajectories are processed one after another and each is split into chunks of at most
+    `chunk_size` rows, so only one chunk of predictions is kept in memory.
+    """
+    generator.reset()
+    for trajectory_id, indices in generator.df.groupby(by='trajectory_id').indices.items():
+        for start in range(0, len(indices), chunk_size):
+            row_indices = indices[start:start + chunk_size]
+            yield trajectory_id, row_indices, predict_rows(model, generator, row_indices)
+
+
+def get_poses_path(prediction_path):
+    return prediction_path[:-len('.csv')] + '_poses.npy'
+
+
+def get_gt_path(prediction_path):
+    return prediction_path[:-len('.csv')] + '_gt.pkl'
+
+
+def get_strides(df):
+    return parse_frame_indices(df.path_to_rgb_next.values) - parse_frame_indices(df.path_to_rgb.values)
+
+
+class TrajectoryPredictionWriter:
+    """Writes predictions of one trajectory chunk by chunk.
+
+    Predictions are appended to csv in the format of `Predict._save_predictions` and the global
+    poses are integrated from consecutive (min stride) motions into a memory-mapped .npy of
+    (num_poses, 4, 4) transformation matrices next to it.
+    """
+    def __init__(self, file_path, dof_cols, min_stride, num_poses, T=None):
+        self.file_path = file_path
+        self.poses_path = get_poses_path(file_path)
+        self.dof_cols = dof_cols
+        self.min_stride = min_stride
+        self.T = T
+
+        self.accumulator = PoseAccumulator()
+        self.poses = np.lib.format.open_memmap(self.poses_path, mode='w+', dtype=float, shape=(num_poses, 4, 4))
+        self.poses[0] = self.accumulator.pose
+        self.num_rows = 0
+
+    def write(self, predictions):
+        if self.T is not None:
+            predictions[self.dof_cols] = convert(predictions[self.dof_cols].values.astype(float), T=self.T)
+
+        predictions['to_index'] = parse_frame_indices(predictions.path_to_rgb_next.values)
+        predictions['from_index'] = parse_frame_indices(predictions.path_to_rgb.values)
+        predictions.to_csv(self.file_path, mode='a' if self.num_rows else 'w', header=not self.num_rows)
+        self.num_rows += len(predictions)
+
+        consecutive = get_strides(predictions) == self.min_stride
+        start = self.accumulator.num_poses
+        poses = self.accumulator.update(predictions[self.dof_cols].values[consecutive])
+        self.poses[start:start + len(poses)] = poses
+
+    def close(self):
+        assert self.accumulator.num_poses == len(self.poses)
+        self.poses.flush()
+        del self.poses
@@ -1,10 +1,9 @@
 import g2o
 import numpy as np
 import pandas as pd
-from pyquaternion import Quaternion
 
-from slam.linalg import (GlobalTrajectory,
-                         QuaternionWithTranslation,
+from slam.linalg import (SE3,
+                         GlobalTrajectory,
                          get_covariance_matrix_from_euler_uncertainty,
                          convert_euler_uncertainty_to_quaternion_uncertainty,
                          convert_euler_angles_to_rotation_matrix)
@@ -51,39 +50,33 @@ class GraphOptimizer:
         return len(self.optimizer.vertices())
 
     def append(self, df):
+        rotation_matrices, informations = self.get_measurements(df)
 
-        for _, row in df.iterrows():
+        for (_, row), rotation_matrix, information in zip(df.iterrows(), rotation_matrices, informations):
 
             is_adjustment_measurements = (row.to_index - row.from_index) == 1
             if is_adjustment_measurements and row.to_index == len(self):
                 current_pose = self.update_current_pose(row)
                 index = len(self.optimizer.vertices())
-                vertex = self.create_vertex(current_pose.quaternion.rotation_matrix, current_pose.translation, index)
+                vertex = self.create_vertex(current_pose.rotation_matrices[0], current_pose.translations[0], index)
                 self.optimizer.add_vertex(vertex)
 
-            edge = self.create_edge(row)
+            edge = self.create_edge(row, rotation_matrix, information)
             self.optimizer.add_edge(edge)
 
         if self.online:
             self.optimize()
 
-    def get_previous_pose(self) -> np.ndarray:
-        previous_vertex = self.optimizer.vertex(len(self) - 1)
-        previous_estimate = previous_vertex.estimate()
-        position = previous_estimate.position()
-        quaternion_g2o = previous_estimate.Quaternion()
-        quaternion = Quaternion(matrix=quaternion_g2o.rotation_matrix())
-        transformation_matrix = QuaternionWithTranslation(quaternion, position).to_transformation_matrix()
-        return transformation_matrix
+    def get_previous_pose(self) -> SE3:
+        previous_estimate = self.optimizer.vertex(len(self) - 1).estimate()
+        return SE3(previous_estimate.R, previous_estimate.t)
 
     def update_current_pose(self, row):
-        previous_transformation_matrix = self.get_previous_pose()
-
-        relative_pose = QuaternionWithTranslation.from_euler_angles(row.to_dict())
-        relative_transformation_matrix = relative_pose.to_transformation_matrix()
-        current_transformation_matrix = previous_transformation_matrix @ relative_transformation_matrix
-        current_pose = QuaternionWithTranslation().from_transformation_matrix(current_transformation_matrix)
-        return current_pose
+        previous_pose = self.get_previous_pose()
+        euler_angles = row[['euler_x', 'euler_y', 'euler_z']].values.astype(np.float64)
+        translation = row[['t_x', 't_y', 't_z']].values.astype(np.float64)
+        relative_pose = SE3(convert_euler_angles_to_rotation_matrix(euler_angles), translation)
+        return previous_pose @ relative_pose
 
     def create_pose(self, orientation: np.ndarray, translation: np.ndarray) -> g2o.Isometry3d:
         pose = g2o.Isometry3d()
@@ -100,26 +93,28 @@ class GraphOptimizer:
         vertex.set_fixed(index == 0)
         return vertex
 
-    def create_edge(self, row: pd.Series) -> g2o.EdgeSE3:
-        euler_angles = row[['euler_x', 'euler_y', 'euler_z']].values
-        translation = row[['t_x', 't_y', 't_z']].values
-        rotation_matrix = convert_euler_angles_to_rotation_matrix(euler_angles)
-
-        measurement = self.create_pose(rotation_matrix, translation)
+    def get_measurements(self, df: pd.DataFrame):
+        """Rotation matrices and information matrices of all measurements, computed at once."""
+        euler_angles = df[['euler_x', 'euler_y', 'euler_z']].values.astype(np.float64)
+        rotation_matrices = convert_euler_angles_to_rotation_matrix(euler_angles)
 
-        edge = g2o.EdgeSE3()
-        edge.set_measurement(measurement)
+        euler_angles_std = df[['euler_x_confidence', 'euler_y_confidence', 'euler_z_confidence']].values
+        translation_std = df[['t_x_confidence', 't_y_confidence', 't_z_confidence']].values
 
-        euler_angles_std = row[['euler_x_confidence', 'euler_y_confidence', 'euler_z_confidence']].values
-        translation_std = row[['t_x_confidence', 't_y_confidence', 't_z_confidence']].values
+        covariances = get_covariance_matrix_from_euler_uncertainty(translation_std, euler_angles_std)
+        covariances = convert_euler_uncertainty_to_quaternion_uncertainty(euler_angles, covariances)
 
-        covariance = get_covariance_matrix_from_euler_uncertainty(translation_std, euler_angles_std)
-        covariance = convert_euler_uncertainty_to_quaternion_uncertainty(euler_angles, covariance)
+        informations = np.linalg.pinv(covariances)
+        informations = np.delete(informations, 3, axis=1)
+        informations = np.delete(informations, 3, axis=2)
+        return rotation_matrices, informations
 
-        information = np.linalg.pinv(covariance)
-        information = np.delete(information, 3, axis=0)
-        information = np.delete(information, 3, axis=1)
+    def create_edge(self, row: pd.Series, rotation_matrix: np.ndarray, information: np.ndarray) -> g2o.EdgeSE3:
+        translation = row[['t_x', 't_y', 't_z']].values.astype(np.float64)
+        measurement = self.create_pose(rotation_matrix, translation)
 
+        edge = g2o.EdgeSE3()
+        edge.set_measurement(measurement)
         edge.set_information(information)
         edge.set_vertex(0, self.optimizer.vertex(int(row['from_index'])))
         edge.set_vertex(1, self.optimizer.vertex(int(row['to_index'])))
@@ -134,10 +129,6 @@ class GraphOptimizer:
         if not raw or not self.online:
             self.optimize()
 
-        optimized_trajectory = GlobalTrajectory()
-        for index in range(len(self)):
-            estimate = self.optimizer.vertex(index).estimate()
-            qt = QuaternionWithTranslation.from_rotation_matrix((estimate.R, estimate.t))
-            optimized_trajectory.append(qt)
-
-        return optimized_trajectory
+        estimates = [self.optimizer.vertex(index).estimate() for index in range(len(self))]
+        poses = SE3([estimate.R for estimate in estimates], [estimate.t for estimate in estimates])
+        return GlobalTrajectory.from_transformation_matrices(poses.as_matrices())
@@ -1,36 +1,68 @@
 from .linalg_utils import convert_rotation_matrix_to_euler_angles
 from .linalg_utils import convert_euler_angles_to_rotation_matrix
+from .linalg_utils import convert_rotation_matrix_to_quaternion
+from .linalg_utils import convert_quaternion_to_rotation_matrix
 from .linalg_utils import get_relative_se3_matrix
 from .linalg_utils import form_se3
 from .linalg_utils import split_se3
 from .linalg_utils import convert_euler_uncertainty_to_quaternion_uncertainty
 from .linalg_utils import get_covariance_matrix_from_euler_uncertainty
 from .linalg_utils import euler_to_quaternion
+from .linalg_utils import quaternion_to_euler
+from .linalg_utils import get_quaternion_distance
 from .linalg_utils import shortest_path_with_normalization
 from .linalg_utils import create_optical_flow_from_rt
+from .linalg_utils import create_optical_flow_from_rt_batch
 from .linalg_utils import convert
 
 from .trajectory import GlobalTrajectory
 from .trajectory import RelativeTrajectory
+from .trajectory import PoseAccumulator
+from .trajectory import ArrayTrajectory
 
 from .quaternion import QuaternionWithTranslation
 
+from .align import align
+from .align import IncrementalAligner
+
+from .lie import SE3
+from .lie import Sim3
+from .lie import slerp
+from .lie import interpolate_poses
+
 from .intrinsics import Intrinsics
+from .intrinsics import get_intrinsics
+from .intrinsics import get_ray_grids
 
 __all__ = [
     'convert_rotation_matrix_to_euler_angles',
     'convert_euler_angles_to_rotation_matrix',
+    'convert_rotation_matrix_to_quaternion',
+    'convert_quaternion_to_rotation_matrix',
     'get_relative_se3_matrix',
     'form_se3',
     'split_se3',
     'GlobalTrajectory',
     'RelativeTrajectory',
+    'PoseAccumulator',
+    'ArrayTrajectory',
     'convert_euler_uncertainty_to_quaternion_uncertainty',
     'get_covariance_matrix_from_euler_uncertainty',
     'euler_to_quaternion',
+    'quaternion_to_euler',
+    'get_quaternion_distance',
     'shortest_path_with_normalization',
     'QuaternionWithTranslation',
+    'align',
+    'IncrementalAligner',
+    'SE3',
+    'Sim3',
+    'slerp',
+    'interpolate_poses',
     'Intrinsics',
+    'get_intrinsics',
+    'get_ray_grids',
     'create_optical_flow_from_rt',
+    'create_optical_flow_from_rt_batch',
     'convert'
 ]
@@ -1,6 +1,31 @@
 import numpy as np
 
 
+def _get_similarity_transform(W, norms, align_point, reference_align_point):
+    '''
+    Closed-form similarity transform from sufficient statistics of shifted points.
+
+    Args:
+        W:                     3x3, sum of outer products of shifted points and shifted reference points
+        norms:                 float, sum of squared norms of shifted points
+        align_point:           3
+        reference_align_point: 3
+    '''
+    U, d, Vh = np.linalg.svd(W.T)
+
+    S = np.identity(3)
+    if np.linalg.det(U) * np.linalg.det(Vh) < 0:
+        S[2, 2] = -1
+
+    rotation_matrix = U @ S @ Vh
+    # sum of dot products of shifted reference points and rotated shifted points
+    dots = np.trace(rotation_matrix @ W)
+
+    scale = float(dots / norms)
+    translation = reference_align_point - scale * (rotation_matrix @ align_point)
+    return rotation_matrix, translation, scale
+
+
 def align(trajectory_points, reference_trajectory_points, by='mean'):
     '''
     Align two trajectories using the method of Horn (closed-form).
@@ -14,8 +39,6 @@ def align(trajectory_points, reference_trajectory_points, by='mean'):
         translation:     3x1
         scale:           float
     '''
-    np.set_printoptions(precision=3, suppress=True)
-
     n = len(trajectory_points)
     if n < len(reference_trajectory_points):
         by = 'start'
@@ -29,30 +52,89 @@ def align(trajectory_points, reference_trajectory_points, by='mean'):
         align_point = trajectory_points[0]
         reference_align_point = reference_trajectory_points[0]
 
-    align_point = align_point[None]
-    reference_align_point = reference_align_point[None]
     trajectory_points_shifted = trajectory_points - align_point
     reference_trajectory_points_shifted = reference_trajectory_points - reference_align_point
 
-    W = np.zeros((3, 3))
-    for index in range(n):
-        W += np.outer(trajectory_points_shifted[index], reference_trajectory_points_shifted[index])
-    
-    U, d, Vh = np.linalg.linalg.svd(W.transpose())
-    
-    S = np.identity(3)
-    if np.linalg.det(U) * np.linalg.det(Vh) < 0:
-        S[2, 2] = -1
+    W = trajectory_points_shifted.T @ reference_trajectory_points_shifted
+    norms = np.sum(trajectory_points_shifted ** 2)
+    return _get_similarity_transform(W, norms, align_point, reference_align_point)
 
-    rotation_matrix = U @ S @ Vh
-    trajectory_points_rotated = trajectory_points_shifted @ rotation_matrix.T
-    
-    dots = 0.0
-    norms = 0.0
-    for index in range(n):
-        dots += np.dot(reference_trajectory_points_shifted[index], trajectory_points_rotated[index])
-        norms += np.inner(trajectory_points_shifted[index], trajectory_points_shifted[index])
 
-    scale = float(dots / norms)
-    translation = (reference_align_point - scale * (align_point @ rotation_matrix.T))[0]
-    return rotation_matrix, translation, scale
+class IncrementalAligner:
+    '''
+    Alignment of a growing trajectory with `align` from running sufficient statistics.
+
+    Points are accumulated relative to the first pair of points (sums, cross-covariance and
+    squared norms), so adding a pose costs O(1) and the transform is found from 3x3 matrices
+    without revisiting earlier poses.
+    '''
+    def __init__(self, by='mean'):
+        assert by in ('mean', 'start'), by
+        self.by = by
+        self.num_points = 0
+        self.origin = None
+        self.reference_origin = None
+        self.sum = np.zeros(3)
+        self.reference_sum = np.zeros(3)
+        self.cross_covariance = np.zeros((3, 3))
+        self.norms = 0.
+        self.reference_norms = 0.
+
+    def __len__(self):
+        return self.num_points
+
+    def update(self, points, reference_points):
+        '''
+        Args:
+            points:           3 or kx3
+            reference_points: 3 or kx3
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        reference_points = np.asarray(reference_points, dtype=np.float64).reshape(-1, 3)
+        assert len(points) == len(reference_points)
+        if not len(points):
+            return self
+
+        if self.origin is None:
+            self.origin = points[0].copy()
+            self.reference_origin = reference_points[0].copy()
+
+        points_shifted = points - self.origin
+        reference_points_shifted = reference_points - self.reference_origin
+
+        self.num_points += len(points)
+        self.sum += points_shifted.sum(0)
+        self.reference_sum += reference_points_shifted.sum(0)
+        self.cross_covariance += points_shifted.T @ reference_points_shifted
+        self.norms += np.sum(points_shifted ** 2)
+        self.reference_norms += np.sum(reference_points_shifted ** 2)
+        return self
+
+    def _get_statistics(self):
+        if self.by == 'start':
+            return (self.cross_covariance, self.norms, self.reference_norms,
+                    self.origin, self.reference_origin)
+
+        mean = self.sum / self.num_points
+        reference_mean = self.reference_sum / self.num_points
+        W = self.cross_covariance - self.num_points * np.outer(mean, reference_mean)
+        norms = self.norms - self.num_points * mean @ mean
+        reference_norms = self.reference_norms - self.num_points * reference_mean @ reference_mean
+        return W, norms, reference_norms, self.origin + mean, self.reference_origin + reference_mean
+
+    def get_transform(self):
+        '''
+        Returns:
+            rotation_matrix: 3x3
+            translation:     3x1
+            scale:           float
+        '''
+        W, norms, _, align_point, reference_align_point = self._get_statistics()
+        return _get_similarity_transform(W, norms, align_point, reference_align_point)
+
+    def get_absolute_trajectory_error(self):
+        '''RMSE of aligned points, same as ATE of `align`-ed trajectory, without the points.'''
+        W, norms, reference_norms, align_point, reference_align_point = self._get_statistics()
+        rotation_matrix, _, scale = _get_similarity_transform(W, norms, align_point, reference_align_point)
+        squared_errors = scale ** 2 * norms - 2 * scale * np.trace(rotation_matrix @ W) + reference_norms
+        return max(squared_errors / self.num_points, 0.) ** 0.5
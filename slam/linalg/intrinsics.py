@@ -1,4 +1,40 @@
 import numpy as np
+from functools import lru_cache
+
+
+@lru_cache(maxsize=16)
+def get_pixel_grid(height, width):
+    """Read-only grid of pixel coordinates (x, y) of shape (2, height, width), shared per image size."""
+    pixels = np.stack(np.meshgrid(np.arange(0., width), np.arange(0., height)))
+    pixels.setflags(write=False)
+    return pixels
+
+
+@lru_cache(maxsize=64)
+def get_ray_grid(f_x, f_y, c_x, c_y, height, width):
+    """Read-only grid of normalized rays (x / z, y / z) of shape (2, height, width), shared per camera."""
+    pixels = get_pixel_grid(height, width)
+    rays = np.stack([(pixels[0] - c_x * width) / (f_x * width),
+                     (pixels[1] - c_y * height) / (f_y * height)])
+    rays.setflags(write=False)
+    return rays
+
+
+def get_ray_grids(intrinsics, height, width):
+    """Ray grids of shape (N, 2, height, width) for normalized f_x, f_y, c_x, c_y of shape (N, 4).
+
+    Grids are computed once per distinct camera.
+    """
+    intrinsics = np.asarray(intrinsics, dtype=np.float64).reshape(-1, 4)
+    unique_intrinsics, intrinsics_index = np.unique(intrinsics, axis=0, return_inverse=True)
+    rays = np.stack([get_ray_grid(*params, height, width) for params in unique_intrinsics])
+    return rays[intrinsics_index.reshape(-1)]
+
+
+@lru_cache(maxsize=64)
+def get_intrinsics(f_x, f_y, c_x, c_y, width, height):
+    """Shared Intrinsics instance per camera and image size."""
+    return Intrinsics(f_x=f_x, f_y=f_y, c_x=c_x, c_y=c_y, width=width, height=height)
 
 
 class Intrinsics:
@@ -16,7 +52,13 @@ class Intrinsics:
         self.width = width
         self.height = height
 
-        self.pixels = np.c_[np.meshgrid(np.arange(0., self.width), np.arange(0., self.height))]
+    @property
+    def pixels(self):
+        return get_pixel_grid(self.height, self.width)
+
+    @property
+    def rays(self):
+        return get_ray_grid(self.f_x, self.f_y, self.c_x, self.c_y, self.height, self.width)
 
     def forward(self, xy):
         xy_processed = xy.copy()
@@ -31,14 +73,25 @@ class Intrinsics:
         return xy_processed
 
     def to_pixels(self, points):
+        """Project points of shape (3, ...) or a stack of point grids (N, 3, height, width)."""
+        points = np.asarray(points)
+        if points.ndim == 4:
+            focal = np.array([self.f_x_scaled, self.f_y_scaled])[:, None, None]
+            center = np.array([self.c_x_scaled, self.c_y_scaled])[:, None, None]
+            return points[:, :2] / points[:, 2:] * focal + center
+
         xy_points = points[:2]
         z_points = points[2]
         return self.backward(xy_points / z_points)
 
     def to_points(self, depth):
-        xy_points = self.forward(self.pixels) * depth
-        z_points = depth[None]
-        return np.concatenate([xy_points, z_points])
+        """Unproject depth of shape (height, width) or a stack of depths (N, height, width) into
+        points of shape (3, height, width) or (N, 3, height, width).
+        """
+        depth = np.asarray(depth)
+        xy_points = self.rays * depth[..., None, :, :]
+        z_points = depth[..., None, :, :]
+        return np.concatenate([xy_points, z_points], axis=-3)
 
     def __repr__(self):
         s = [f'f_x={self.f_x}, f_y={self.f_y}',
@@ -0,0 +1,320 @@
+import math
+import numpy as np
+
+from slam.linalg.linalg_utils import (convert_rotation_matrix_to_quaternion,
+                                      convert_quaternion_to_rotation_matrix)
+
+
+# below this angle (or log-scale) closed forms lose precision and series expansions are used
+_SMALL_ANGLE = 1e-2
+_SMALL_SCALE = 1e-4
+
+
+def skew(vectors):
+    """Skew-symmetric matrices of shape (..., 3, 3) such that skew(a) @ b = cross(a, b)."""
+    vectors = np.asarray(vectors, dtype=np.float64)
+    x, y, z = vectors[..., 0], vectors[..., 1], vectors[..., 2]
+    zeros = np.zeros_like(x)
+    return np.stack([np.stack([zeros, -z, y], axis=-1),
+                     np.stack([z, zeros, -x], axis=-1),
+                     np.stack([-y, x, zeros], axis=-1)], axis=-2)
+
+
+def vee(matrices):
+    """Inverse of `skew` for matrices of shape (..., 3, 3)."""
+    return np.stack([matrices[..., 2, 1], matrices[..., 0, 2], matrices[..., 1, 0]], axis=-1)
+
+
+def so3_exp(rotation_vectors):
+    """Rodrigues formula for rotation vectors of shape (..., 3), returns rotation matrices (..., 3, 3)."""
+    rotation_vectors = np.asarray(rotation_vectors, dtype=np.float64)
+    theta = np.linalg.norm(rotation_vectors, axis=-1)
+    theta2 = theta ** 2
+    small = theta < _SMALL_ANGLE
+    safe_theta = np.where(small, 1, theta)
+
+    A = np.where(small, 1 - theta2 / 6 + theta2 ** 2 / 120, np.sin(safe_theta) / safe_theta)
+    B = np.where(small, 0.5 - theta2 / 24 + theta2 ** 2 / 720, (1 - np.cos(safe_theta)) / safe_theta ** 2)
+
+    K = skew(rotation_vectors)
+    return np.eye(3) + A[..., None, None] * K + B[..., None, None] * (K @ K)
+
+
+def so3_log(rotation_matrices):
+    """Rotation vectors of shape (..., 3) with norm in [0, pi] of rotation matrices (..., 3, 3)."""
+    rotation_matrices = np.asarray(rotation_matrices, dtype=np.float64)
+    antisymmetric = vee(rotation_matrices - np.swapaxes(rotation_matrices, -1, -2))
+    cos = np.clip((np.trace(rotation_matrices, axis1=-2, axis2=-1) - 1) / 2, -1, 1)
+    sin = np.linalg.norm(antisymmetric, axis=-1) / 2
+    # better conditioned than arccos near 0 and pi
+    theta = np.arctan2(sin, cos)
+
+    small = theta < _SMALL_ANGLE
+    near_pi = np.pi - theta < _SMALL_ANGLE
+    safe_sin = np.where(small | near_pi, 1, sin)
+    factor = np.where(small, 0.5 + theta ** 2 / 12 + 7 * theta ** 4 / 720, theta / (2 * safe_sin))
+    rotation_vectors = factor[..., None] * antisymmetric
+
+    if near_pi.any():
+        # sin(theta) -> 0, recover the axis from the symmetric part: (R + R^T) / 2 = cos I + (1 - cos) n n^T
+        R = rotation_matrices[near_pi]
+        outer = ((R + np.swapaxes(R, -1, -2)) / 2 - cos[near_pi][..., None, None] * np.eye(3))
+        outer /= (1 - cos[near_pi])[..., None, None]
+        column = np.argmax(np.diagonal(outer, axis1=-2, axis2=-1), axis=-1)
+        axis = np.take_along_axis(outer, column[..., None, None], axis=-1)[..., 0]
+        axis /= np.linalg.norm(axis, axis=-1, keepdims=True)
+        sign = np.where(np.sum(axis * antisymmetric[near_pi], axis=-1) < 0, -1, 1)
+        rotation_vectors[near_pi] = (sign * theta[near_pi])[..., None] * axis
+
+    return rotation_vectors
+
+
+def _get_exp_moments(sigma, k_max):
+    """Integrals I_k = int_0^1 t^k exp(sigma t) dt for k = 0..k_max, shape (k_max + 1, ...)."""
+    sigma = np.asarray(sigma, dtype=np.float64)
+    small = np.abs(sigma) < 2
+    safe_sigma = np.where(small, 1, sigma)
+
+    moments = []
+    moment = np.expm1(safe_sigma) / safe_sigma
+    for k in range(k_max + 1):
+        if k > 0:
+            moment = (np.exp(safe_sigma) - k * moment) / safe_sigma
+        series = sum(sigma ** j / (float(math.factorial(j)) * (k + j + 1)) for j in range(30))
+        moments.append(np.where(small, series, moment))
+    return np.stack(moments)
+
+
+def _get_sim3_V(rotation_vectors, sigma):
+    """V = int_0^1 exp(sigma t) exp(t skew(w)) dt, maps translational part of sim(3) to translation.
+
+    With sigma = 0 this is the left Jacobian of SO(3), the V matrix of SE(3).
+    """
+    theta = np.linalg.norm(rotation_vectors, axis=-1)
+    sigma = np.broadcast_to(sigma, theta.shape)
+    theta2 = theta ** 2
+    small = theta < _SMALL_ANGLE
+    safe_theta = np.where(small, 1, theta)
+
+    # closed form of the integrals of exp(sigma t) with sin(theta t) and cos(theta t)
+    exp_sigma = np.exp(sigma)
+    small_sigma = np.abs(sigma) < _SMALL_SCALE
+    a = np.where(small_sigma, 1 + sigma / 2 + sigma ** 2 / 6, np.expm1(sigma) / np.where(small_sigma, 1, sigma))
+    denominator = sigma ** 2 + safe_theta ** 2
+    sin_integral = (exp_sigma * (sigma * np.sin(safe_theta) - safe_theta * np.cos(safe_theta)) + safe_theta) / denominator
+    cos_integral = (exp_sigma * (sigma * np.cos(safe_theta) + safe_theta * np.sin(safe_theta)) - sigma) / denominator
+    b = sin_integral / safe_theta
+    c = (a - cos_integral) / safe_theta ** 2
+
+    # series of sin(theta t) / theta and (1 - cos(theta t)) / theta^2 in theta
+    I = _get_exp_moments(sigma, 6)
+    b_series = I[1] - theta2 / 6 * I[3] + theta2 ** 2 / 120 * I[5]
+    c_series = I[2] / 2 - theta2 / 24 * I[4] + theta2 ** 2 / 720 * I[6]
+    b = np.where(small, b_series, b)
+    c = np.where(small, c_series, c)
+
+    K = skew(rotation_vectors)
+    return a[..., None, None] * np.eye(3) + b[..., None, None] * K + c[..., None, None] * (K @ K)
+
+
+def slerp(quaternions, other_quaternions, alphas):
+    """Spherical linear interpolation of unit quaternions (..., 4) with weights alphas (...) in [0, 1]."""
+    quaternions = np.asarray(quaternions, dtype=np.float64)
+    other_quaternions = np.asarray(other_quaternions, dtype=np.float64)
+    alphas = np.asarray(alphas, dtype=np.float64)[..., None]
+
+    dots = np.sum(quaternions * other_quaternions, axis=-1, keepdims=True)
+    # q and -q are the same rotation, interpolate along the shorter arc
+    other_quaternions = np.where(dots < 0, -other_quaternions, other_quaternions)
+    dots = np.abs(dots)
+
+    theta = np.arccos(np.clip(dots, -1, 1))
+    sin = np.sin(theta)
+    small = sin < 1e-6
+    safe_sin = np.where(small, 1, sin)
+    weights = np.where(small, 1 - alphas, np.sin((1 - alphas) * theta) / safe_sin)
+    other_weights = np.where(small, alphas, np.sin(alphas * theta) / safe_sin)
+
+    interpolated = weights * quaternions + other_weights * other_quaternions
+    return interpolated / np.linalg.norm(interpolated, axis=-1, keepdims=True)
+
+
+def interpolate_poses(quaternions, translations, timestamps, query_timestamps):
+    """Poses at query timestamps: SLERP of quaternions (N, 4) and linear interpolation of translations
+    (N, 3) between the neighbouring poses. Queries outside of timestamps are clamped to the ends.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    query_timestamps = np.asarray(query_timestamps, dtype=np.float64)
+    assert len(timestamps) > 1 and np.all(np.diff(timestamps) > 0), 'Timestamps must be increasing'
+
+    indices = np.clip(np.searchsorted(timestamps, query_timestamps, side='right') - 1, 0, len(timestamps) - 2)
+    alphas = (query_timestamps - timestamps[indices]) / (timestamps[indices + 1] - timestamps[indices])
+    alphas = np.clip(alphas, 0, 1)
+
+    interpolated_quaternions = slerp(quaternions[indices], quaternions[indices + 1], alphas)
+    interpolated_translations = (1 - alphas[:, None]) * translations[indices] + alphas[:, None] * translations[indices + 1]
+    return interpolated_quaternions, interpolated_translations
+
+
+class SE3:
+    """Batch of rigid transforms x -> R @ x + t.
+
+    Rotations are stored as matrices (N, 3, 3), translations as (N, 3). Tangent vectors are (N, 6)
+    with the rotational part first, (w_x, w_y, w_z, v_x, v_y, v_z), as dof columns. Operations
+    broadcast, so a single transform can be composed with a batch.
+    """
+    def __init__(self, rotation_matrices, translations):
+        self.rotation_matrices = np.asarray(rotation_matrices, dtype=np.float64).reshape(-1, 3, 3)
+        self.translations = np.asarray(translations, dtype=np.float64).reshape(-1, 3)
+        assert len(self.rotation_matrices) == len(self.translations)
+
+    def __len__(self):
+        return len(self.rotation_matrices)
+
+    def __getitem__(self, index):
+        return SE3(self.rotation_matrices[index], self.translations[index])
+
+    def __matmul__(self, other):
+        return self.compose(other)
+
+    @classmethod
+    def identity(cls, n=1):
+        return cls(np.tile(np.eye(3), (n, 1, 1)), np.zeros((n, 3)))
+
+    @classmethod
+    def from_matrices(cls, matrices):
+        matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+        return cls(matrices[:, :3, :3], matrices[:, :3, 3])
+
+    def as_matrices(self):
+        matrices = np.tile(np.eye(4), (len(self), 1, 1))
+        matrices[:, :3, :3] = self.rotation_matrices
+        matrices[:, :3, 3] = self.translations
+        return matrices
+
+    @classmethod
+    def exp(cls, twists):
+        twists = np.asarray(twists, dtype=np.float64).reshape(-1, 6)
+        rotation_vectors = twists[:, :3]
+        V = _get_sim3_V(rotation_vectors, 0.)
+        return cls(so3_exp(rotation_vectors), (V @ twists[:, 3:, None])[..., 0])
+
+    def log(self):
+        rotation_vectors = so3_log(self.rotation_matrices)
+        V = _get_sim3_V(rotation_vectors, 0.)
+        return np.concatenate([rotation_vectors, np.linalg.solve(V, self.translations[..., None])[..., 0]], axis=1)
+
+    def compose(self, other):
+        return SE3(self.rotation_matrices @ other.rotation_matrices,
+                   (self.rotation_matrices @ other.translations[..., None])[..., 0] + self.translations)
+
+    def inverse(self):
+        rotation_matrices_inv = np.swapaxes(self.rotation_matrices, -1, -2)
+        return SE3(rotation_matrices_inv, -(rotation_matrices_inv @ self.translations[..., None])[..., 0])
+
+    def adjoint(self):
+        """Matrices (N, 6, 6) such that exp(adjoint @ xi) = T @ exp(xi) @ T^-1."""
+        adjoint = np.zeros((len(self), 6, 6))
+        adjoint[:, :3, :3] = self.rotation_matrices
+        adjoint[:, 3:, 3:] = self.rotation_matrices
+        adjoint[:, 3:, :3] = skew(self.translations) @ self.rotation_matrices
+        return adjoint
+
+    def transform_points(self, points):
+        """Apply transforms to points of shape (N, 3) or (N, M, 3)."""
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim == 2:
+            return (self.rotation_matrices @ points[..., None])[..., 0] + self.translations
+        return points @ np.swapaxes(self.rotation_matrices, -1, -2) + self.translations[:, None]
+
+    def interpolate(self, timestamps, query_timestamps):
+        """Resample poses given at timestamps to query timestamps, see `interpolate_poses`."""
+        quaternions = convert_rotation_matrix_to_quaternion(self.rotation_matrices)
+        quaternions, translations = interpolate_poses(quaternions, self.translations, timestamps, query_timestamps)
+        return SE3(convert_quaternion_to_rotation_matrix(quaternions), translations)
+
+
+class Sim3:
+    """Batch of similarity transforms x -> s * R @ x + t.
+
+    Tangent vectors are (N, 7): rotational part, translational part and log-scale,
+    (w_x, w_y, w_z, v_x, v_y, v_z, sigma).
+    """
+    def __init__(self, rotation_matrices, translations, scales):
+        self.rotation_matrices = np.asarray(rotation_matrices, dtype=np.float64).reshape(-1, 3, 3)
+        self.translations = np.asarray(translations, dtype=np.float64).reshape(-1, 3)
+        self.scales = np.broadcast_to(np.asarray(scales, dtype=np.float64), (len(self.rotation_matrices),)).copy()
+        assert len(self.rotation_matrices) == len(self.translations)
+
+    def __len__(self):
+        return len(self.rotation_matrices)
+
+    def __getitem__(self, index):
+        return Sim3(self.rotation_matrices[index], self.translations[index], self.scales[index])
+
+    def __matmul__(self, other):
+        return self.compose(other)
+
+    @classmethod
+    def identity(cls, n=1):
+        return cls(np.tile(np.eye(3), (n, 1, 1)), np.zeros((n, 3)), np.ones(n))
+
+    @classmethod
+    def from_se3(cls, se3, scales=1.):
+        return cls(se3.rotation_matrices, se3.translations, scales)
+
+    @classmethod
+    def from_matrices(cls, matrices):
+        matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+        scales = np.cbrt(np.linalg.det(matrices[:, :3, :3]))
+        return cls(matrices[:, :3, :3] / scales[:, None, None], matrices[:, :3, 3], scales)
+
+    def as_matrices(self):
+        matrices = np.tile(np.eye(4), (len(self), 1, 1))
+        matrices[:, :3, :3] = self.scales[:, None, None] * self.rotation_matrices
+        matrices[:, :3, 3] = self.translations
+        return matrices
+
+    @classmethod
+    def exp(cls, twists):
+        twists = np.asarray(twists, dtype=np.float64).reshape(-1, 7)
+        rotation_vectors, sigma = twists[:, :3], twists[:, 6]
+        V = _get_sim3_V(rotation_vectors, sigma)
+        return cls(so3_exp(rotation_vectors), (V @ twists[:, 3:6, None])[..., 0], np.exp(sigma))
+
+    def log(self):
+        rotation_vectors = so3_log(self.rotation_matrices)
+        sigma = np.log(self.scales)
+        V = _get_sim3_V(rotation_vectors, sigma)
+        translations = np.linalg.solve(V, self.translations[..., None])[..., 0]
+        return np.concatenate([rotation_vectors, translations, sigma[:, None]], axis=1)
+
+    def compose(self, other):
+        translations = self.scales[:, None] * (self.rotation_matrices @ other.translations[..., None])[..., 0]
+        return Sim3(self.rotation_matrices @ other.rotation_matrices,
+                    translations + self.translations,
+                    self.scales * other.scales)
+
+    def inverse(self):
+        rotation_matrices_inv = np.swapaxes(self.rotation_matrices, -1, -2)
+        translations = -(rotation_matrices_inv @ self.translations[..., None])[..., 0] / self.scales[:, None]
+        return Sim3(rotation_matrices_inv, translations, 1 / self.scales)
+
+    def adjoint(self):
+        """Matrices (N, 7, 7) such that exp(adjoint @ xi) = T @ exp(xi) @ T^-1."""
+        adjoint = np.zeros((len(self), 7, 7))
+        adjoint[:, :3, :3] = self.rotation_matrices
+        adjoint[:, 3:6, 3:6] = self.scales[:, None, None] * self.rotation_matrices
+        adjoint[:, 3:6, :3] = skew(self.translations) @ self.rotation_matrices
+        adjoint[:, 3:6, 6] = -self.translations
+        adjoint[:, 6, 6] = 1
+        return adjoint
+
+    def transform_points(self, points):
+        """Apply transforms to points of shape (N, 3) or (N, M, 3)."""
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim == 2:
+            rotated = (self.rotation_matrices @ points[..., None])[..., 0]
+            return self.scales[:, None] * rotated + self.translations
+        rotated = points @ np.swapaxes(self.rotation_matrices, -1, -2)
+        return self.scales[:, None, None] * rotated + self.translations[:, None]
@@ -1,23 +1,27 @@
 import numpy as np
 
+from slam.linalg.intrinsics import get_pixel_grid, get_ray_grids
 
-def convert_rotation_matrix_to_euler_angles(R):
-    assert np.allclose(np.dot(R.T, R), np.eye(3), atol=1e-6), R
 
-    sin_y = np.sqrt(R[0,0] * R[0,0] + R[1,0] * R[1,0])
+def convert_rotation_matrix_to_euler_angles(R, check=True):
+    """Convert rotation matrix of shape (3, 3) or a stack of them of shape (..., 3, 3) into euler angles.
+
+    With `check` asserts that all matrices are orthogonal.
+    """
+    R = np.asarray(R)
+    if check:
+        identity = np.broadcast_to(np.eye(3), R.shape)
+        assert np.allclose(np.swapaxes(R, -1, -2) @ R, identity, atol=1e-6), R
+
+    sin_y = np.sqrt(R[..., 0, 0] * R[..., 0, 0] + R[..., 1, 0] * R[..., 1, 0])
 
     singular = sin_y < 1e-6
 
-    if not singular:
-        x = np.arctan2( R[2,1], R[2,2])
-        y = np.arctan2(-R[2,0], sin_y )
-        z = np.arctan2( R[1,0], R[0,0])
-    else:
-        x = np.arctan2(-R[1,2], R[1,1])
-        y = np.arctan2(-R[2,0], sin_y )
-        z = 0
+    x = np.where(singular, np.arctan2(-R[..., 1, 2], R[..., 1, 1]), np.arctan2(R[..., 2, 1], R[..., 2, 2]))
+    y = np.arctan2(-R[..., 2, 0], sin_y)
+    z = np.where(singular, 0, np.arctan2(R[..., 1, 0], R[..., 0, 0]))
 
-    return np.array([x, y, z])
+    return np.stack([x, y, z], axis=-1)
 
 
 def shortest_path_with_normalization(angle1, angle2):
@@ -27,9 +31,11 @@ def shortest_path_with_normalization(angle1, angle2):
 
 
 def convert_euler_angles_to_rotation_matrix(euler_angles_xyz):
-    yaw   = euler_angles_xyz[2]
-    pitch = euler_angles_xyz[1]
-    roll  = euler_angles_xyz[0]
+    """Convert euler angles of shape (3,) or (..., 3) into rotation matrices R = R_z @ R_y @ R_x."""
+    euler_angles_xyz = np.asarray(euler_angles_xyz, dtype=np.float64)
+    yaw   = euler_angles_xyz[..., 2]
+    pitch = euler_angles_xyz[..., 1]
+    roll  = euler_angles_xyz[..., 0]
 
     cos_r = np.cos(roll)
     sin_r = np.sin(roll)
@@ -38,17 +44,58 @@ def convert_euler_angles_to_rotation_matrix(euler_angles_xyz):
     cos_y = np.cos(yaw)
     sin_y = np.sin(yaw)
 
-    R_x = np.array([[ 1,      0,      0    ],
-                    [ 0,      cos_r, -sin_r],
-                    [ 0,      sin_r,  cos_r]])
-    R_y = np.array([[ cos_p,  0,      sin_p],
-                    [ 0,      1,      0    ],
-                    [-sin_p,  0,      cos_p]])
-    R_z = np.array([[ cos_y, -sin_y,  0    ],
-                    [ sin_y,  cos_y,  0    ],
-                    [ 0,      0,      1    ]])
-
-    R = np.dot(R_z, np.dot(R_y, R_x))
+    R = np.empty(euler_angles_xyz.shape[:-1] + (3, 3))
+    R[..., 0, 0] = cos_y * cos_p
+    R[..., 0, 1] = cos_y * sin_p * sin_r - sin_y * cos_r
+    R[..., 0, 2] = cos_y * sin_p * cos_r + sin_y * sin_r
+    R[..., 1, 0] = sin_y * cos_p
+    R[..., 1, 1] = sin_y * sin_p * sin_r + cos_y * cos_r
+    R[..., 1, 2] = sin_y * sin_p * cos_r - cos_y * sin_r
+    R[..., 2, 0] = -sin_p
+    R[..., 2, 1] = cos_p * sin_r
+    R[..., 2, 2] = cos_p * cos_r
+    return R
+
+
+def convert_rotation_matrix_to_quaternion(R):
+    """Convert rotation matrices of shape (..., 3, 3) into unit quaternions (..., 4) as (w, x, y, z).
+
+    Uses the same branches of the trace method as pyquaternion, so signs of quaternions match
+    `Quaternion(matrix=R).normalised`.
+    """
+    R = np.asarray(R, dtype=np.float64)
+    m = np.swapaxes(R, -1, -2)
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+    candidates = np.stack([
+        np.stack([m12 - m21, 1 + m00 - m11 - m22, m01 + m10, m20 + m02], axis=-1),
+        np.stack([m20 - m02, m01 + m10, 1 - m00 + m11 - m22, m12 + m21], axis=-1),
+        np.stack([m01 - m10, m20 + m02, m12 + m21, 1 - m00 - m11 + m22], axis=-1),
+        np.stack([1 + m00 + m11 + m22, m12 - m21, m20 - m02, m01 - m10], axis=-1),
+    ])
+    branch = np.where(m22 < 0, np.where(m00 > m11, 0, 1), np.where(m00 < -m11, 2, 3))
+    q = np.take_along_axis(candidates, branch[None, ..., None], axis=0)[0]
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def convert_quaternion_to_rotation_matrix(q):
+    """Convert quaternions of shape (..., 4) as (w, x, y, z) into rotation matrices (..., 3, 3)."""
+    q = np.asarray(q, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    R = np.empty(q.shape[:-1] + (3, 3))
+    R[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    R[..., 0, 1] = 2 * (x * y - w * z)
+    R[..., 0, 2] = 2 * (x * z + w * y)
+    R[..., 1, 0] = 2 * (x * y + w * z)
+    R[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    R[..., 1, 2] = 2 * (y * z - w * x)
+    R[..., 2, 0] = 2 * (x * z - w * y)
+    R[..., 2, 1] = 2 * (y * z + w * x)
+    R[..., 2, 2] = 1 - 2 * (x * x + y * y)
     return R
 
 
@@ -71,32 +118,41 @@ def split_se3(se3):
     return rotation_matrix, translation
 
 
+def _get_half_angle_terms(euler_angles_xyz):
+    half_angles = np.asarray(euler_angles_xyz, dtype=np.float64) / 2
+    cos = np.cos(half_angles)
+    sin = np.sin(half_angles)
+    # cos_r, sin_r, cos_p, sin_p, cos_y, sin_y
+    return cos[..., 0], sin[..., 0], cos[..., 1], sin[..., 1], cos[..., 2], sin[..., 2]
+
+
 def euler_to_quaternion(euler_angles_xyz):
     """euler_x,euler_y,euler_z in
-       q_w, q_x, q_y, q_z out"""
-    yaw   = euler_angles_xyz[2]
-    pitch = euler_angles_xyz[1]
-    roll  = euler_angles_xyz[0]
-
-    cos_r = np.cos(roll/2)
-    sin_r = np.sin(roll/2)
-    cos_p = np.cos(pitch/2)
-    sin_p = np.sin(pitch/2)
-    cos_y = np.cos(yaw/2)
-    sin_y = np.sin(yaw/2)
+       q_w, q_x, q_y, q_z out
+
+    Accepts shape (3,) or (..., 3), returns array of shape (..., 4).
+    """
+    cos_r, sin_r, cos_p, sin_p, cos_y, sin_y = _get_half_angle_terms(euler_angles_xyz)
 
     q_x = sin_r * cos_p * cos_y - cos_r * sin_p * sin_y
     q_y = cos_r * sin_p * cos_y + sin_r * cos_p * sin_y
     q_z = cos_r * cos_p * sin_y - sin_r * sin_p * cos_y
     q_w = cos_r * cos_p * cos_y + sin_r * sin_p * sin_y
 
-    return q_w, q_x, q_y, q_z
+    return np.stack([q_w, q_x, q_y, q_z], axis=-1)
 
 
-def quaternion_to_euler(quaternion):
+def quaternion_to_euler(quaternion, check=True):
     """q_w, q_x, q_y, q_z in,
-       euler_x,euler_y,euler_z out"""
-    q_w, q_x, q_y, q_z = quaternion
+       euler_x,euler_y,euler_z out
+
+    Accepts shape (4,) or (..., 4), returns array of shape (..., 3). With `check` asserts that
+    quaternions are unit.
+    """
+    quaternion = np.asarray(quaternion, dtype=np.float64)
+    if check:
+        assert np.allclose(np.linalg.norm(quaternion, axis=-1), 1, atol=1e-6), quaternion
+    q_w, q_x, q_y, q_z = quaternion[..., 0], quaternion[..., 1], quaternion[..., 2], quaternion[..., 3]
 
     t0 = 2.0 * (q_w * q_x + q_y * q_z)
     t1 = 1.0 - 2.0 * (q_x * q_x + q_y * q_y)
@@ -110,28 +166,36 @@ def quaternion_to_euler(quaternion):
     t4 = 1.0 - 2.0 * (q_y * q_y + q_z * q_z)
     yaw = np.arctan2(t3, t4)
 
-    return roll, pitch, yaw
+    return np.stack([roll, pitch, yaw], axis=-1)
+
+
+def get_quaternion_distance(quaternion, other_quaternion):
+    """Geodesic distance between unit quaternions of shape (..., 4), same as `Quaternion.distance`."""
+    cos = np.sum(np.asarray(quaternion) * np.asarray(other_quaternion), axis=-1)
+    return np.arccos(np.clip(cos, -1, 1))
 
 
 def get_covariance_matrix_from_euler_uncertainty(translation_xyz, euler_angles_xyz):
     """get euler_x,euler_y,euler_z,
-        output matrix 6x6 with t_x, t_y, t_z, euler_z (yaw), euler_y (pitch), euler_x (roll)"""
-    return np.diag(np.hstack([translation_xyz, euler_angles_xyz[::-1]]))
+        output matrix 6x6 with t_x, t_y, t_z, euler_z (yaw), euler_y (pitch), euler_x (roll)
+
+    Accepts shapes (3,) or (..., 3), returns array of shape (..., 6, 6).
+    """
+    variances = np.concatenate([translation_xyz, np.asarray(euler_angles_xyz)[..., ::-1]], axis=-1)
+    covariance_matrix = np.zeros(variances.shape + (6,))
+    diagonal = np.arange(6)
+    covariance_matrix[..., diagonal, diagonal] = variances
+    return covariance_matrix
 
 
 def convert_euler_uncertainty_to_quaternion_uncertainty(euler_angles_xyz, covariance_matrix_euler=np.eye(6)):
     """get  matrix 6x6 with t_x, t_y, t_z, euler_z, euler_y, euler_x (yaw, pitch, roll),
-        output matrix 7x7 with t_x, t_y, t_z, q_w, q_x, q_y, q_z"""
-    yaw   = euler_angles_xyz[2]
-    pitch = euler_angles_xyz[1]
-    roll  = euler_angles_xyz[0]
-
-    cos_r = np.cos(roll/2)
-    sin_r = np.sin(roll/2)
-    cos_p = np.cos(pitch/2)
-    sin_p = np.sin(pitch/2)
-    cos_y = np.cos(yaw/2)
-    sin_y = np.sin(yaw/2)
+        output matrix 7x7 with t_x, t_y, t_z, q_w, q_x, q_y, q_z
+
+    Accepts euler angles of shape (3,) or (..., 3) and covariance matrices broadcastable to
+    (..., 6, 6), returns array of shape (..., 7, 7).
+    """
+    cos_r, sin_r, cos_p, sin_p, cos_y, sin_y = _get_half_angle_terms(euler_angles_xyz)
 
     ccc = cos_r * cos_p * cos_y
     ccs = cos_r * cos_p * sin_y
@@ -142,14 +206,15 @@ def convert_euler_uncertainty_to_quaternion_uncertainty(euler_angles_xyz, covari
     ssc = sin_r * sin_p * cos_y
     sss = sin_r * sin_p * sin_y
 
-    derivatives = 0.5 * np.array([[ scc-ccs,  scs-csc,  css-scc],
-                                  [-csc-scs, -ssc-ccs,  ccc+sss],
-                                  [ scc-css,  ccc-sss,  ccs-ssc],
-                                  [ ccc+sss, -css-scc, -csc-scs]])
+    derivatives = 0.5 * np.stack([np.stack([ scc-ccs,  scs-csc,  css-scc], axis=-1),
+                                  np.stack([-csc-scs, -ssc-ccs,  ccc+sss], axis=-1),
+                                  np.stack([ scc-css,  ccc-sss,  ccs-ssc], axis=-1),
+                                  np.stack([ ccc+sss, -css-scc, -csc-scs], axis=-1)], axis=-2)
 
-    jacobian = np.eye(7, 6)
-    jacobian[3:, 3:] = derivatives
-    covariance_matrix_quaternion = jacobian @ covariance_matrix_euler @ jacobian.T
+    jacobian = np.zeros(derivatives.shape[:-2] + (7, 6))
+    jacobian[..., :3, :3] = np.eye(3)
+    jacobian[..., 3:, 3:] = derivatives
+    covariance_matrix_quaternion = jacobian @ covariance_matrix_euler @ np.swapaxes(jacobian, -1, -2)
 
     return covariance_matrix_quaternion
 
@@ -178,16 +243,67 @@ def create_optical_flow_from_rt(depth, intrinsics, rotation_vector, translation_
     return flow
 
 
-def convert(dofs, T):
-    rotation_vector, translation_vector = dofs[:3], dofs[3:]
+def create_optical_flow_from_rt_batch(depths, intrinsics, rotation_vectors, translation_vectors):
+    """Vectorized `create_optical_flow_from_rt` for a stack of samples.
 
-    rotation_vector = np.array(rotation_vector, dtype=np.float64).copy()
-    translation_vector = np.array(translation_vector, dtype=np.float64).copy()
+    Args:
+        depths: array of shape (N, height, width)
+        intrinsics: array of shape (N, 4) with normalized f_x, f_y, c_x, c_y of every sample
+        rotation_vectors: array of shape (N, 3) with euler angles
+        translation_vectors: array of shape (N, 3)
+
+    Returns:
+        flows of shape (N, height, width, 2) and boolean mask of shape (N,). Samples with points
+        behind the camera after the transform are marked invalid and their flows are zeroed.
+    """
+    depths = np.asarray(depths, dtype=np.float64)
+    intrinsics = np.asarray(intrinsics, dtype=np.float64).reshape(-1, 4)
+    rotation_vectors = np.asarray(rotation_vectors, dtype=np.float64).reshape(-1, 3)
+    translation_vectors = np.asarray(translation_vectors, dtype=np.float64).reshape(-1, 3)
+    num_samples, height, width = depths.shape
+
+    rays = get_ray_grids(intrinsics, height, width).reshape(num_samples, 2, -1)
+
+    depths = depths.reshape(num_samples, 1, -1)
+    xyz_points = np.concatenate([rays * depths, depths], axis=1)
+
+    R = convert_euler_angles_to_rotation_matrix(rotation_vectors)
+    xyz_points_after_transform = np.einsum('nji,njk->nik', R, xyz_points - translation_vectors[..., None])
+
+    z_points = xyz_points_after_transform[:, 2:]
+    valid = (z_points > 0).all(axis=(1, 2))
+    z_points = np.where(valid[:, None, None], z_points, 1)
+
+    scale = np.array([width, height], dtype=np.float64)
+    focal = intrinsics[:, :2, None] * scale[:, None]
+    center = intrinsics[:, 2:, None] * scale[:, None]
+    xy_pixels_after_transform = xyz_points_after_transform[:, :2] / z_points * focal + center
+
+    flows = (xy_pixels_after_transform - get_pixel_grid(height, width).reshape(1, 2, -1)) / scale[:, None]
+    flows[~valid] = 0
+    flows = np.transpose(flows.reshape(num_samples, 2, height, width), (0, 2, 3, 1))
+    return flows, valid
+
+
+def convert(dofs, T, check=True):
+    """Conjugate motion given by dofs (euler angles and translation) with SE3 matrix T: T^-1 @ M @ T.
+
+    Args:
+        dofs: array of shape (6,) or a stack of shape (N, 6)
+        T: SE3 matrix of shape (4, 4)
+        check: assert that rotations of conjugated motions are orthogonal
+    """
+    dofs = np.asarray(dofs, dtype=np.float64)
+    rotation_vector, translation_vector = dofs[..., :3], dofs[..., 3:]
+
+    se3 = np.zeros(dofs.shape[:-1] + (4, 4))
+    se3[..., :3, :3] = convert_euler_angles_to_rotation_matrix(rotation_vector)
+    se3[..., :3, 3] = translation_vector
+    se3[..., 3, 3] = 1
 
-    rotation_matrix = convert_euler_angles_to_rotation_matrix(rotation_vector)
-    se3 = form_se3(rotation_matrix, translation_vector)
-    rotation_matrix_T, translation_vector_T = split_se3(np.linalg.inv(T) @ se3 @ T)
-    rotation_vector_T = convert_rotation_matrix_to_euler_angles(rotation_matrix_T)
+    se3_T = np.linalg.inv(T) @ se3 @ T
+    rotation_vector_T = convert_rotation_matrix_to_euler_angles(se3_T[..., :3, :3], check=check)
+    translation_vector_T = se3_T[..., :3, 3]
 
-    dofs_T = np.concatenate([rotation_vector_T, translation_vector_T])
+    dofs_T = np.concatenate([rotation_vector_T, translation_vector_T], axis=-1)
     return dofs_T
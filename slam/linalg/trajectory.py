@@ -6,12 +6,136 @@ from pyquaternion import Quaternion
 
 from slam.linalg.quaternion import QuaternionWithTranslation
 from slam.linalg.align import align
+from slam.linalg.lie import interpolate_poses
 from slam.linalg.linalg_utils import (convert_euler_angles_to_rotation_matrix,
-                                      convert_rotation_matrix_to_euler_angles)
+                                      convert_rotation_matrix_to_euler_angles,
+                                      convert_rotation_matrix_to_quaternion,
+                                      convert_quaternion_to_rotation_matrix)
+
+EULER_COLUMNS = ['euler_x', 'euler_y', 'euler_z', 't_x', 't_y', 't_z']
+QUATERNION_COLUMNS = ['q_w', 'q_x', 'q_y', 'q_z', 't_x', 't_y', 't_z']
+
+
+def form_se3_batch(rotation_matrices, translations):
+    se3 = np.tile(np.eye(4), (len(rotation_matrices), 1, 1))
+    se3[:, :3, :3] = rotation_matrices
+    se3[:, :3, 3] = translations
+    return se3
+
+
+def invert_se3_batch(se3):
+    rotation_matrices_inv = np.swapaxes(se3[:, :3, :3], -1, -2)
+    translations_inv = -(rotation_matrices_inv @ se3[:, :3, 3:])[..., 0]
+    return form_se3_batch(rotation_matrices_inv, translations_inv)
+
+
+def cumulative_compose(se3):
+    """Prefix products se3[0] @ se3[1] @ ... @ se3[i] for all i, in log2(N) batched matmuls."""
+    result = np.array(se3, dtype=np.float64)
+    shift = 1
+    while shift < len(result):
+        result[shift:] = result[:-shift] @ result[shift:]
+        shift *= 2
+    return result
+
+
+class ArrayTrajectory:
+    """Sequence of poses stored as contiguous arrays.
+
+    Rotations are unit quaternions (N, 4) as (w, x, y, z), translations are (N, 3). All
+    conversions and transformations work on the whole trajectory at once.
+    """
+    def __init__(self, quaternions=None, translations=None):
+        quaternions = np.zeros((0, 4)) if quaternions is None else quaternions
+        translations = np.zeros((0, 3)) if translations is None else translations
+        self.quaternions = np.ascontiguousarray(quaternions, dtype=np.float64).reshape(-1, 4)
+        self.translations = np.ascontiguousarray(translations, dtype=np.float64).reshape(-1, 3)
+        assert len(self.quaternions) == len(self.translations)
+
+    def __len__(self):
+        return len(self.quaternions)
+
+    def __getitem__(self, index):
+        return ArrayTrajectory(self.quaternions[index], self.translations[index])
+
+    def concatenate(self, other):
+        return ArrayTrajectory(np.concatenate([self.quaternions, other.quaternions]),
+                               np.concatenate([self.translations, other.translations]))
+
+    @property
+    def rotation_matrices(self):
+        return convert_quaternion_to_rotation_matrix(self.quaternions)
+
+    @classmethod
+    def from_rotation_matrices(cls, rotation_matrices, translations):
+        rotation_matrices = np.asarray(rotation_matrices, dtype=np.float64).reshape(-1, 3, 3)
+        return cls(convert_rotation_matrix_to_quaternion(rotation_matrices), translations)
+
+    @classmethod
+    def from_transformation_matrices(cls, transformations):
+        transformations = np.asarray(transformations, dtype=np.float64).reshape(-1, 4, 4)
+        return cls.from_rotation_matrices(transformations[:, :3, :3], transformations[:, :3, 3])
+
+    def to_transformation_matrices(self):
+        return form_se3_batch(self.rotation_matrices, self.translations)
+
+    @classmethod
+    def from_euler_angles(cls, euler_angles_with_translation):
+        euler_angles_with_translation = np.asarray(euler_angles_with_translation, dtype=np.float64).reshape(-1, 6)
+        rotation_matrices = convert_euler_angles_to_rotation_matrix(euler_angles_with_translation[:, :3])
+        return cls.from_rotation_matrices(rotation_matrices, euler_angles_with_translation[:, 3:])
+
+    def to_euler_angles(self):
+        euler_angles = convert_rotation_matrix_to_euler_angles(self.rotation_matrices, check=False).reshape(-1, 3)
+        return np.concatenate([euler_angles, self.translations], axis=1)
+
+    @classmethod
+    def from_quaternion_array(cls, quaternions_with_translation):
+        quaternions_with_translation = np.asarray(quaternions_with_translation, dtype=np.float64).reshape(-1, 7)
+        quaternions = quaternions_with_translation[:, :4]
+        return cls(quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True), quaternions_with_translation[:, 4:])
+
+    def to_quaternion_array(self):
+        return np.concatenate([self.quaternions, self.translations], axis=1)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        return cls.from_euler_angles(df[EULER_COLUMNS].values)
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.to_euler_angles(), columns=EULER_COLUMNS)
+
+    def to_global(self):
+        """Compose relative motions into global poses, starting from the identity pose (N + 1 poses)."""
+        transformations = np.concatenate([np.eye(4)[None], self.to_transformation_matrices()])
+        return ArrayTrajectory.from_transformation_matrices(cumulative_compose(transformations))
+
+    def to_relative(self):
+        transformations = self.to_transformation_matrices()
+        relative = invert_se3_batch(transformations[:-1]) @ transformations[1:]
+        return ArrayTrajectory.from_transformation_matrices(relative)
+
+    def to_semi_global(self):
+        transformations = self.to_transformation_matrices()
+        semi_global = invert_se3_batch(transformations[:1]) @ transformations
+        return ArrayTrajectory.from_transformation_matrices(semi_global)
+
+    def interpolate(self, timestamps, query_timestamps):
+        """Resample poses given at timestamps to query timestamps, see `interpolate_poses`."""
+        return ArrayTrajectory(*interpolate_poses(self.quaternions, self.translations, timestamps, query_timestamps))
+
+    def align_with(self, reference_trajectory, by='mean'):
+        rotation_matrix, translation, scale = align(self.translations, reference_trajectory.translations, by=by)
+        translations_aligned = scale * self.translations @ rotation_matrix.T + translation
+        rotation_matrices_aligned = self.rotation_matrices @ rotation_matrix.T
+        return ArrayTrajectory.from_rotation_matrices(rotation_matrices_aligned, translations_aligned)
+
 
 class AbstractTrajectory:
-    def __init__(self):
-        self.positions = []
+    """List-like view of ArrayTrajectory with poses as QuaternionWithTranslation."""
+    def __init__(self, poses=None):
+        self._poses = poses if poses is not None else ArrayTrajectory()
+        self._appended = []
         self.id = None
 
     def __repr__(self):
@@ -22,61 +146,54 @@ class AbstractTrajectory:
         return s
 
     def __len__(self):
-        return len(self.positions)
+        return len(self.poses)
+
+    @property
+    def poses(self):
+        if self._appended:
+            quaternions, translations = zip(*self._appended)
+            self._poses = self._poses.concatenate(ArrayTrajectory(quaternions, translations))
+            self._appended = []
+        return self._poses
+
+    @property
+    def positions(self):
+        return [QuaternionWithTranslation(Quaternion(quaternion), translation)
+                for quaternion, translation in zip(self.poses.quaternions, self.poses.translations)]
 
     def append(self, qt):
-        self.positions.append(qt)
+        self._appended.append((qt.quaternion.normalised.elements, qt.translation))
 
     @classmethod
     def from_quaternions(cls, quaternions_with_translation):
-        trajectory = cls()
-        for quat in quaternions_with_translation:
-            qt = QuaternionWithTranslation.from_quaternion(quat)
-            trajectory.append(qt)
-        return trajectory
+        df = pd.DataFrame(list(quaternions_with_translation), columns=QUATERNION_COLUMNS)
+        return cls(ArrayTrajectory.from_quaternion_array(df.values))
 
     def to_quaternions(self):
-        result = []
-        for pos in self.positions:
-            result.append(pos.to_quaternion())
-        return result
+        df = pd.DataFrame(self.poses.to_quaternion_array(), columns=QUATERNION_COLUMNS)
+        return df.to_dict(orient='records')
 
     @classmethod
     def from_transformation_matrices(cls, transformations):
-        trajectory = cls()
-        for m in transformations:
-            qt = QuaternionWithTranslation.from_transformation_matrix(m)
-            trajectory.append(qt)
-        return trajectory
+        return cls(ArrayTrajectory.from_transformation_matrices(np.asarray(transformations)))
 
     def to_transformation_matrices(self):
-        result = []
-        for pos in self.positions:
-            result.append(pos.to_transformation_matrix())
-        return result
+        return self.poses.to_transformation_matrices()
 
     @classmethod
     def from_euler_angles(cls, euler_angles_with_translation):
-        trajectory = cls()
-        for angle in euler_angles_with_translation:
-            qt = QuaternionWithTranslation.from_euler_angles(angle)
-            trajectory.append(qt)
-        return trajectory
+        df = pd.DataFrame(list(euler_angles_with_translation), columns=EULER_COLUMNS)
+        return cls(ArrayTrajectory.from_euler_angles(df.values))
 
     def to_euler_angles(self):
-        result = []
-        for pos in self.positions:
-            result.append(pos.to_euler_angles())
-        return result
+        return self.to_dataframe().to_dict(orient='records')
 
     @classmethod
     def from_dataframe(cls, df):
-        euler_angles_with_translation = df.to_dict(orient='records')
-        return cls.from_euler_angles(euler_angles_with_translation)
+        return cls(ArrayTrajectory.from_dataframe(df))
 
     def to_dataframe(self):
-        euler_angles_with_translation = self.to_euler_angles()
-        return pd.DataFrame(euler_angles_with_translation)
+        return self.poses.to_dataframe()
 
     def to_global(self):
         return self
@@ -87,52 +204,23 @@ class AbstractTrajectory:
 
 class GlobalTrajectory(AbstractTrajectory):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, poses=None):
+        super().__init__(poses)
         self.id = 'global'
 
-    @classmethod
-    def from_quaternions(cls, quaternions_with_translation):
-        return super(GlobalTrajectory, cls).from_quaternions(quaternions_with_translation)
-
-    @classmethod
-    def from_transformation_matrices(cls, transformations):
-        return super(GlobalTrajectory, cls).from_transformation_matrices(transformations)
-
-    @classmethod
-    def from_euler_angles(cls, euler_angles_with_translation):
-        return super(GlobalTrajectory, cls).from_euler_angles(euler_angles_with_translation)
-
-    @classmethod
-    def from_dataframe(cls, df):
-        return super(GlobalTrajectory, cls).from_dataframe(df)
-
     def to_semi_global(self):
-        origin = self.positions[0].copy()
-        semi_global = GlobalTrajectory()
-        for pos in self.positions:
-            semi_global.append(pos.to_semi_global(origin))
-        return semi_global
+        return GlobalTrajectory(self.poses.to_semi_global())
 
     def to_relative(self):
-        relative_trajectory = RelativeTrajectory()
-        for pos_previous, pos_current in zip(self.positions[:-1], self.positions[1:]):
-            relative_trajectory.append(pos_current.to_semi_global(pos_previous))
-        return relative_trajectory
+        return RelativeTrajectory(self.poses.to_relative())
 
     @property
     def points(self):
-        points = np.zeros((len(self), 3))
-        for i, pos in enumerate(self.positions):
-            points[i, :] = pos.translation[:]
-        return points
+        return self.poses.translations.copy()
 
     @property
     def rotation_matrices(self):
-        rotation_matrices = np.zeros((len(self), 3, 3))
-        for i, pos in enumerate(self.positions):
-            rotation_matrices[i, :] = pos.rotation_matrix[:]
-        return rotation_matrices
+        return self.poses.rotation_matrices
 
     def plot(self, file_name):
         line = go.Scatter3d(x=self.points[:, 0],
@@ -153,50 +241,42 @@ class GlobalTrajectory(AbstractTrajectory):
         fig = go.Figure(data=data, layout=layout)
         ply.plot(fig, filename=file_name)
 
-    def align_with(self, reference_trajectory, by='mean'):
-        rotation_matrix, translation, scale = align(self.points, reference_trajectory.points, by=by)
-        trajectory_aligned = GlobalTrajectory()
-        for pos in self.positions:
-            t_current = pos.translation
-            rotation_matrix_current = pos.rotation_matrix
-            t_aligned = scale * (t_current[None] @ rotation_matrix.T)[0] + translation
-            rotation_matrix_aligned = rotation_matrix_current @ rotation_matrix.T
-            qt_aligned = QuaternionWithTranslation.from_rotation_matrix((rotation_matrix_aligned, t_aligned))
-            trajectory_aligned.append(qt_aligned)
+    def interpolate(self, timestamps, query_timestamps):
+        return GlobalTrajectory(self.poses.interpolate(timestamps, query_timestamps))
 
-        return trajectory_aligned
+    def align_with(self, reference_trajectory, by='mean'):
+        return GlobalTrajectory(self.poses.align_with(reference_trajectory.poses, by=by))
 
 
 class RelativeTrajectory(AbstractTrajectory):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, poses=None):
+        super().__init__(poses)
         self.id = 'relative'
 
-    @classmethod
-    def from_quaternions(cls, quaternions_with_translation):
-        return super(RelativeTrajectory, cls).from_quaternions(quaternions_with_translation)
+    def to_global(self):
+        return GlobalTrajectory(self.poses.to_global())
 
-    @classmethod
-    def from_transformation_matrices(cls, transformations):
-        return super(RelativeTrajectory, cls).from_transformation_matrices(transformations)
 
-    @classmethod
-    def from_euler_angles(cls, euler_angles_with_translation):
-        return super(RelativeTrajectory, cls).from_euler_angles(euler_angles_with_translation)
+class PoseAccumulator:
+    """Composes relative motions into global poses chunk by chunk.
 
-    @classmethod
-    def from_dataframe(cls, df):
-        return super(RelativeTrajectory, cls).from_dataframe(df)
+    Keeps only the last global pose, so a trajectory of any length is integrated with memory
+    proportional to the chunk. Poses are the same as `RelativeTrajectory.to_global` gives
+    (without the leading identity pose).
+    """
+    def __init__(self):
+        self.pose = np.eye(4)
+        self.num_poses = 1
 
-    def to_global(self):
-        global_trajectory = GlobalTrajectory()
-        global_trajectory.append(QuaternionWithTranslation())
-        transformation_cumulative = QuaternionWithTranslation().to_transformation_matrix()
-        for pos in self.positions:
-            transformation_current = pos.to_transformation_matrix()
-            transformation_cumulative = transformation_cumulative @ transformation_current
-            qt_cumulative = QuaternionWithTranslation.from_transformation_matrix(transformation_cumulative)
-            global_trajectory.append(qt_cumulative)
+    def update(self, euler_angles_with_translation):
+        euler_angles_with_translation = np.asarray(euler_angles_with_translation, dtype=float).reshape(-1, 6)
+        motions = form_se3_batch(convert_euler_angles_to_rotation_matrix(euler_angles_with_translation[:, :3]),
+                                 euler_angles_with_translation[:, 3:])
+
+        poses = cumulative_compose(np.concatenate([self.pose[None], motions]))[1:]
+        if len(poses):
+            self.pose = poses[-1]
 
-        return global_trajectory
+        self.num_poses += len(poses)
+        return poses
@@ -154,13 +154,9 @@ class FlowComposer(Layer):
         self.depth = np.ones((intrinsics.height, intrinsics.width), dtype=np.float32)
         self.intrinsics = intrinsics
 
-        self.pixels_grid = np.c_[np.meshgrid(np.arange(0, self.intrinsics.width),
-                                 np.arange(0, self.intrinsics.height))]
-        self.pixels_grid = self.pixels_grid.astype(np.float32)
-
-        self.pixels_normalized = self.intrinsics.forward(self.pixels_grid)
-        ones = np.ones((1, ) + self.pixels_normalized.shape[1:])
-        self.pixels_normalized = np.concatenate([self.pixels_normalized, ones], 0).astype(np.float32)
+        # pixel and ray grids are shared by all users of the camera
+        self.pixels_grid = self.intrinsics.pixels.astype(np.float32)
+        self.pixels_normalized = self.intrinsics.to_points(np.ones_like(self.depth)).astype(np.float32)
         super().__init__(**kwargs)
 
     def _create_gt_optical_flow_pair(self, depth, rotation_vector, gt_translation):
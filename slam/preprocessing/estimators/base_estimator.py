@@ -1,8 +1,8 @@
+import tqdm
 import pandas as pd
 
 
 class BaseEstimator:
-
     def __init__(self,
                  input_col,
                  output_col,
@@ -23,8 +23,24 @@ class BaseEstimator:
             del row[key]
         return row
 
+    def _add_output_df(self, df, values):
+        for key, value in zip(self.output_col, values.T):
+            df[key] = value
+        return df
+
+    def _drop_input_df(self, df):
+        return df.drop(columns=self.input_col)
+
     def run(self, row: pd.Series, dataset_root: str):
         pass
 
+    def run_df(self, df: pd.DataFrame, dataset_root: str):
+        # row by row, estimators that can process the whole dataframe at once override it
+        enriched_rows = []
+        for index, row in tqdm.tqdm(df.iterrows(), total=len(df), desc='{:<20}'.format(self.name)):
+            enriched_rows.append(self.run(row, dataset_root))
+        enriched_df = pd.DataFrame(enriched_rows)
+        return enriched_df
+
     def __repr__(self):
         return f'{self.name}Estimator(input_col={self.input_col}, output_col={self.output_col})'
@@ -2,40 +2,49 @@ import numpy as np
 import pandas as pd
 
 from .base_estimator import BaseEstimator
-from slam.linalg import (form_se3,
-                         split_se3,
-                         get_relative_se3_matrix,
-                         convert_euler_angles_to_rotation_matrix,
+from slam.linalg import (convert_euler_angles_to_rotation_matrix,
                          convert_rotation_matrix_to_euler_angles)
 
 
 class Global2RelativeEstimator(BaseEstimator):
-
     def __init__(self, *args, **kwargs):
         super(Global2RelativeEstimator, self).__init__(name='Global2Relative',
                                                        *args,
                                                        **kwargs)
 
+    @staticmethod
+    def _get_relative_dofs(dofs, next_dofs):
+        rotation_matrices = convert_euler_angles_to_rotation_matrix(dofs[:, :3])
+        next_rotation_matrices = convert_euler_angles_to_rotation_matrix(next_dofs[:, :3])
+
+        # inv(form_se3(R, t)) @ form_se3(R_next, t_next) without forming SE3 matrices
+        rotation_matrices_inv = np.swapaxes(rotation_matrices, -1, -2)
+        relative_rotation_matrices = rotation_matrices_inv @ next_rotation_matrices
+        relative_translations = (rotation_matrices_inv @ (next_dofs[:, 3:] - dofs[:, 3:])[..., None])[..., 0]
+        relative_euler_angles = convert_rotation_matrix_to_euler_angles(relative_rotation_matrices)
+
+        return np.concatenate([relative_euler_angles, relative_translations], axis=1)
+
     def run(self, row: pd.Series, dataset_root: str):
 
         if not set(self.input_col) <= set(dict(row).keys()):
             return row
 
-        dof = row[self.input_col[:6]].values
-        next_dof = row[self.input_col[6:]].values
+        dof = row[self.input_col[:6]].values.astype(np.float64)
+        next_dof = row[self.input_col[6:]].values.astype(np.float64)
 
-        euler_angles, translation = dof[:3], dof[3:]
-        next_euler_angles, next_translation = next_dof[:3], next_dof[3:]
+        relative_dof = self._get_relative_dofs(dof[None], next_dof[None])[0]
+        row = self._drop_input(row)
+        return self._add_output(row, relative_dof)
 
-        rotation_matrix = convert_euler_angles_to_rotation_matrix(euler_angles)
-        next_rotation_matrix = convert_euler_angles_to_rotation_matrix(next_euler_angles)
+    def run_df(self, df: pd.DataFrame, dataset_root: str):
 
-        global_se3_matrix = form_se3(rotation_matrix, translation)
-        next_global_se3_matrix = form_se3(next_rotation_matrix, next_translation)
-        relative_se3_matrix = get_relative_se3_matrix(global_se3_matrix, next_global_se3_matrix)
-        relative_rotation_matrix, relative_translation = split_se3(relative_se3_matrix)
-        relative_euler_angles = convert_rotation_matrix_to_euler_angles(relative_rotation_matrix)
+        if not set(self.input_col) <= set(df.columns):
+            return df
 
-        relative_dof = np.concatenate([relative_euler_angles, relative_translation])
-        row = self._drop_input(row)
-        return self._add_output(row, relative_dof)
+        dofs = df[self.input_col[:6]].values.astype(np.float64)
+        next_dofs = df[self.input_col[6:]].values.astype(np.float64)
+
+        relative_dofs = self._get_relative_dofs(dofs, next_dofs)
+        df = self._drop_input_df(df)
+        return self._add_output_df(df, relative_dofs)
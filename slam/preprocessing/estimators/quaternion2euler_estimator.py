@@ -1,21 +1,32 @@
+import numpy as np
 import pandas as pd
-from pyquaternion import Quaternion
 
 from .base_estimator import BaseEstimator
-from slam.linalg import convert_rotation_matrix_to_euler_angles
+from slam.linalg import (convert_quaternion_to_rotation_matrix,
+                         convert_rotation_matrix_to_euler_angles)
 
 
 class Quaternion2EulerEstimator(BaseEstimator):
-
     def __init__(self, *args, **kwargs):
         super(Quaternion2EulerEstimator, self).__init__(name='Quaternion2Euler',
                                                         *args,
                                                         **kwargs)
 
+    @staticmethod
+    def _get_euler_angles(quaternions):
+        rotation_matrices = convert_quaternion_to_rotation_matrix(quaternions)
+        return convert_rotation_matrix_to_euler_angles(rotation_matrices, check=False)
+
     def run(self, row: pd.Series, dataset_root: str):
         if not set(self.input_col) <= set(dict(row).keys()):
             return row
-        quaternion = Quaternion(row[self.input_col].values)
-        euler_angles = convert_rotation_matrix_to_euler_angles(quaternion.rotation_matrix)
+        euler_angles = self._get_euler_angles(row[self.input_col].values.astype(np.float64))
         row = self._drop_input(row)
         return self._add_output(row, euler_angles)
+
+    def run_df(self, df: pd.DataFrame, dataset_root: str):
+        if not set(self.input_col) <= set(df.columns):
+            return df
+        euler_angles = self._get_euler_angles(df[self.input_col].values.astype(np.float64))
+        df = self._drop_input_df(df)
+        return self._add_output_df(df, euler_angles)
@@ -1,6 +1,5 @@
 import os
 import shutil
-import tqdm
 import pandas as pd
 from pathlib import Path
 
@@ -32,11 +31,7 @@ def work_with_parser(root, parser):
 
 
 def work_with_estimator(root, df, estimator):
-    enriched_rows = []
-    for index, row in tqdm.tqdm(df.iterrows(), total=len(df), desc='{:<20}'.format(estimator.name)):
-        enriched_rows.append(estimator.run(row, root))
-    enriched_df = pd.DataFrame(enriched_rows)
-    return enriched_df
+    return estimator.run_df(df, root)
 
 
 def create_pair_indices(single_frame_df, stride):
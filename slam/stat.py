@@ -4,13 +4,13 @@ from tqdm import tqdm
 from pathlib import Path
 import matplotlib.pyplot as plt
 from collections import defaultdict
-from pyquaternion import Quaternion
 from statistics import mean, median
 
 from slam.linalg import (convert_euler_angles_to_rotation_matrix,
                          GlobalTrajectory,
                          RelativeTrajectory,
-                         euler_to_quaternion)
+                         euler_to_quaternion,
+                         get_quaternion_distance)
 
 
 class DatasetStat:
@@ -37,10 +37,9 @@ class DatasetStat:
     def append_rotation_stat(self, relative_df, global_df):
         to_rotation = global_df[self.rotation_columns].values[relative_df.to_index.values.astype('int')]
         from_rotation = global_df[self.rotation_columns].values[relative_df.from_index.values.astype('int')]
-        quaternions_from = [Quaternion(euler_to_quaternion(euler)).unit for euler in from_rotation]
-        quaternions_to = [Quaternion(euler_to_quaternion(euler)).unit for euler in to_rotation]
-        quaternions_pairs = zip(quaternions_to, quaternions_from)
-        relative_df['rotation_distance'] = [Quaternion.distance(*pair) for pair in quaternions_pairs]
+        quaternions_from = euler_to_quaternion(from_rotation)
+        quaternions_to = euler_to_quaternion(to_rotation)
+        relative_df['rotation_distance'] = get_quaternion_distance(quaternions_to, quaternions_from)
         return relative_df
 
     def get_pair_frame_stat(self, relative_df):
@@ -12,6 +12,8 @@ from .image_utils import load_image
 from .image_utils import undistort_image
 from .image_utils import resize_image_arr
 from .image_utils import load_image_arr
+from .image_utils import get_image_size
+from .image_utils import load_image_by_mode
 from .image_utils import convert_hwc_to_chw
 from .image_utils import convert_chw_to_hwc
 from .image_utils import get_channels_num
@@ -41,6 +43,8 @@ __all__ = [
     'undistort_image',
     'resize_image_arr',
     'load_image_arr',
+    'get_image_size',
+    'load_image_by_mode',
     'convert_hwc_to_chw',
     'convert_chw_to_hwc',
     'get_channels_num',
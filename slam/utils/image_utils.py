@@ -1,13 +1,13 @@
-from functools import partial
+import os
+from functools import partial, lru_cache
 
 import cv2
 import PIL
-import scipy
+import scipy.ndimage
 import numpy as np
 
-import torch
-import torch.nn.functional as F
 
+PIL_8BIT_MODES = ('L', 'P', 'RGB', 'RGBA')
 
 def warp2d(image, flow):
     assert (image[...,0].shape == flow[...,0].shape), 'shape mismatch'
@@ -62,30 +62,104 @@ def undistort_image(image, K, D, R, P):
     return undistorted_image
 
 
+CV2_INTERPOLATIONS = {'bilinear': cv2.INTER_LINEAR,
+                      'bicubic': cv2.INTER_CUBIC,
+                      'area': cv2.INTER_AREA}
+
+CV2_MAX_CHANNELS = 512
+
+
+def get_nearest_indices(input_size, output_size):
+    # same source indices as F.interpolate(mode='nearest')
+    scale = np.float32(input_size) / np.float32(output_size)
+    indices = np.floor(np.arange(output_size, dtype=np.float32) * scale).astype(np.int64)
+    return np.minimum(indices, input_size - 1)
+
+
+@lru_cache(maxsize=32)
+def get_nearest_map(input_size, output_size):
+    # integer map for cv2.remap, cv2.INTER_NEAREST in cv2.resize rounds indices differently
+    rows = get_nearest_indices(input_size[0], output_size[0])
+    cols = get_nearest_indices(input_size[1], output_size[1])
+    return np.stack(np.meshgrid(cols, rows), axis=-1).astype(np.int16)
+
+
+def _resize_with_cv2(image_arr, target_size, resize_fn):
+    images = image_arr.reshape((-1,) + image_arr.shape[-3:])
+    resized_images = np.empty((len(images),) + target_size + image_arr.shape[-1:], dtype=image_arr.dtype)
+    for image, resized_image in zip(images, resized_images):
+        resized_image[:] = resize_fn(image).reshape(resized_image.shape)
+    return resized_images.reshape(image_arr.shape[:-3] + resized_images.shape[1:])
+
+
 def resize_image_arr(image_arr, target_size, data_format, mode):
-    if image_arr.shape[:-1] == target_size:
+    """Resize image of shape (..., height, width, channels) for channels_last or
+    (..., channels, height, width) for channels_first. Leading dimensions are treated as a batch.
+    """
+    spatial_axes = (-3, -2) if data_format == 'channels_last' else (-2, -1)
+    input_size = tuple(image_arr.shape[axis] for axis in spatial_axes)
+    target_size = tuple(target_size)
+    if input_size == target_size:
         return image_arr
 
+    use_cv2 = (data_format == 'channels_last'
+               and image_arr.shape[-1] <= CV2_MAX_CHANNELS
+               and image_arr.dtype in (np.uint8, np.float32))
+
+    if mode == 'nearest':
+        if use_cv2:
+            nearest_map = get_nearest_map(input_size, target_size)
+            return _resize_with_cv2(image_arr,
+                                    target_size,
+                                    lambda image: cv2.remap(image, nearest_map, None, cv2.INTER_NEAREST))
+
+        rows = get_nearest_indices(input_size[0], target_size[0])
+        cols = get_nearest_indices(input_size[1], target_size[1])
+        image_arr = np.take(image_arr, rows, axis=spatial_axes[0])
+        return np.take(image_arr, cols, axis=spatial_axes[1])
+
+    if mode in CV2_INTERPOLATIONS and use_cv2:
+        dsize = (target_size[1], target_size[0])
+        return _resize_with_cv2(image_arr,
+                                target_size,
+                                lambda image: cv2.resize(image, dsize, interpolation=CV2_INTERPOLATIONS[mode]))
+
+    batch_shape = image_arr.shape[:-3]
+    image_arr = image_arr.reshape((-1,) + image_arr.shape[-3:])
     if data_format == 'channels_last':
-        image_arr = image_arr.transpose(2, 0, 1)
+        image_arr = image_arr.transpose(0, 3, 1, 2)
 
-    image_arr = F.interpolate(torch.Tensor(image_arr).unsqueeze_(0),
-                              target_size,
-                              mode=mode).numpy()[0]
+    # modes and layouts cv2 does not cover, torch is imported only for them
+    import torch
+    import torch.nn.functional as F
+    image_arr = F.interpolate(torch.Tensor(image_arr), target_size, mode=mode).numpy()
 
     if data_format == 'channels_last':
-        image_arr = image_arr.transpose(1, 2, 0)
-    return image_arr
+        image_arr = image_arr.transpose(0, 2, 3, 1)
+    return image_arr.reshape(batch_shape + image_arr.shape[1:])
+
 
+def load_image_arr(fpath, mode=None, dtype='float32', target_size=None, keep_8bit=False):
+    """Decode image into an array.
 
-def load_image_arr(fpath, mode=None):
+    Args:
+        target_size: (height, width) the image will be resized to. Codecs that can decode at reduced
+                     scale (JPEG) skip resolution beyond it, otherwise the image is decoded as is.
+        keep_8bit: decode 8-bit images as uint8 instead of `dtype`. Images with wider pixels
+                   (e.g. 16-bit depth) are always decoded as `dtype`.
+    """
     image = PIL.Image.open(fpath)
+    if target_size is not None:
+        image.draft(mode, (target_size[1], target_size[0]))
     image.load()
 
     if mode and image.mode != mode:
         image = image.convert(mode)
 
-    image_arr = np.asarray(image, dtype='float32')
+    if keep_8bit and image.mode in PIL_8BIT_MODES:
+        dtype = 'uint8'
+
+    image_arr = np.asarray(image, dtype=dtype)
 
     if hasattr(image, 'close'):
         image.close()
@@ -93,6 +167,58 @@ def load_image_arr(fpath, mode=None):
     return image_arr
 
 
+def get_image_size(fpath):
+    """(height, width) of an image or .npy frame read from its header, pixel data is not decoded."""
+    if fpath.endswith('.npy'):
+        return np.load(fpath, mmap_mode='r').shape[:2]
+
+    with PIL.Image.open(fpath) as image:
+        return image.height, image.width
+
+
+def get_pil_mode(load_mode):
+    if load_mode == 'grayscale':
+        return 'L'
+    elif load_mode == 'rgba':
+        return 'RGBA'
+    elif load_mode == 'rgb':
+        return 'RGB'
+    return None
+
+
+def load_image_by_mode(fpath, load_mode, target_size, data_format='channels_last', interpolation='nearest'):
+    if os.path.islink(fpath):
+        fpath = os.readlink(fpath)
+
+    if fpath.endswith('.npy'):
+        image_arr = np.load(fpath)
+    else:
+        # 8-bit frames are resized by index selection before the float conversion
+        image_arr = load_image_arr(fpath,
+                                   mode=get_pil_mode(load_mode),
+                                   dtype='float32',
+                                   target_size=target_size,
+                                   keep_8bit=interpolation == 'nearest')
+
+    if len(image_arr.shape) == 2:
+        image_arr = np.expand_dims(image_arr, -1)
+
+    if load_mode == 'motion_maps':
+        image_arr = image_arr.transpose((1, 2, 0))
+
+    if load_mode == 'motion_maps_z':
+        image_arr = image_arr[[2, 5]].transpose((1, 2, 0))
+
+    if load_mode == 'motion_maps_xy':
+        image_arr = image_arr[[0, 1, 4, 5]].transpose((1, 2, 0))
+
+    image_arr = resize_image_arr(image_arr,
+                                 target_size,
+                                 data_format=data_format,
+                                 mode=interpolation)
+    return image_arr.astype(np.float32, copy=False)
+
+
 def convert_hwc_to_chw(image_arr):
     return image_arr.transpose((2, 0, 1))
 
@@ -126,58 +252,119 @@ def get_channels_num(preprocess_mode):
         raise ValueError(f'Unknown preprocess mode: {preprocess_mode}')
 
 
-def fill_with_median(x):
-    assert x.ndim == 2
-    mask = np.isnan(x)
-    if mask.all():
-        return np.zeros_like(x)
-    return np.where(mask, np.nanmedian(x), x)
-
+def get_nan_mask(x, nan_value=np.nan):
+    if nan_value is None or np.isnan(nan_value):
+        return np.isnan(x)
+    return x == nan_value
 
-def fill_with_zeros(x):
-    assert x.ndim == 2
-    mask = np.isnan(x)
-    return np.where(mask, 0, x)
 
+def _split_frames(x, mask):
+    frame_shape = x.shape[-2:]
+    return x.reshape((-1,) + frame_shape), mask.reshape((-1,) + frame_shape)
 
-def fill_with_random(x, nan_value, mean=None, std=None):
-    mask = [x == nan_value] if nan_value else np.isnan(x)
 
-    if mask.all():
-        return np.zeros_like(x)
+# All fill functions accept a single frame of shape (height, width) or a stack of frames of shape
+# (..., height, width) and replace only the pixels equal to `nan_value`. Fully invalid frames are zeroed.
 
+def fill_with_median(x, nan_value=np.nan):
+    mask = get_nan_mask(x, nan_value)
     if not mask.any():
         return x
 
-    if mean is not None and std is not None:
-        mean, std = np.nanmean(x), np.nanstd(x)
+    x = x.copy()
+    for frame, frame_mask in zip(*_split_frames(x, mask)):
+        if frame_mask.all():
+            frame[:] = 0
+        elif frame_mask.any():
+            frame[frame_mask] = np.median(frame[~frame_mask])
+    return x
+
+
+def fill_with_zeros(x, nan_value=np.nan):
+    mask = get_nan_mask(x, nan_value)
+    return np.where(mask, 0, x).astype(x.dtype)
+
+
+def fill_with_random(x, nan_value=np.nan, mean=None, std=None):
+    mask = get_nan_mask(x, nan_value)
+    if not mask.any():
+        return x
 
-    x_min, x_max = np.nanmin(x), np.nanmax(x)
-    x = np.where(mask, np.random.randn(*x.shape) * std + mean, x)
-    x = np.clip(x, a_min=x_min, a_max=x_max)
+    x = x.copy()
+    for frame, frame_mask in zip(*_split_frames(x, mask)):
+        if frame_mask.all():
+            frame[:] = 0
+            continue
+
+        num_masked = frame_mask.sum()
+        if num_masked == 0:
+            continue
+
+        valid = frame[~frame_mask]
+        frame_mean = valid.mean() if mean is None else mean
+        frame_std = valid.std() if std is None else std
+        noise = np.random.randn(num_masked) * frame_std + frame_mean
+        frame[frame_mask] = np.clip(noise, a_min=valid.min(), a_max=valid.max())
     return x
 
 
-def fill_with_interpolation(x):
-    mask = np.isnan(x)
+def _push_pull(values, weights):
+    height, width = values.shape[-2:]
+    if (height == 1 and width == 1) or weights.min() > 0:
+        return values
+
+    padding = [(0, 0)] * (values.ndim - 2) + [(0, height % 2), (0, width % 2)]
+    weighted_values = np.pad(values * weights, padding)
+    padded_weights = np.pad(weights, padding)
+
+    blocks_shape = values.shape[:-2] + (padded_weights.shape[-2] // 2, 2, padded_weights.shape[-1] // 2, 2)
+    values_sum = weighted_values.reshape(blocks_shape).sum(axis=(-3, -1))
+    weights_sum = padded_weights.reshape(blocks_shape).sum(axis=(-3, -1))
+
+    coarse_values = np.divide(values_sum, weights_sum, out=np.zeros_like(values_sum), where=weights_sum > 0)
+    coarse_values = _push_pull(coarse_values, np.minimum(weights_sum, 1))
+
+    upsampled_values = coarse_values.repeat(2, axis=-2).repeat(2, axis=-1)[..., :height, :width]
+    return values * weights + upsampled_values * (1 - weights)
+
+
+def fill_with_interpolation(x, nan_value=np.nan):
+    """Fill holes with a multi-scale push-pull: valid pixels are averaged down an image pyramid
+    until every hole is covered, then coarse levels are blended back into the holes only.
+    """
+    mask = get_nan_mask(x, nan_value)
+    if not mask.any():
+        return x
+
+    dtype = np.result_type(x.dtype, np.float32)
+    values = np.where(mask, 0, x).astype(dtype)
+    filled = _push_pull(values, (~mask).astype(dtype))
+    return np.where(mask, filled, x).astype(x.dtype)
+
+
+def fill_with_nearest(x, nan_value=np.nan):
+    mask = get_nan_mask(x, nan_value)
     if not mask.any():
         return x
 
-    height, width = x.shape
-    hh, ww = np.meshgrid(np.arange(0, width), np.arange(0, height))
-    grid = (hh, ww)
-    grid_valid = (hh[~mask], ww[~mask])
-    x_valid = x[~mask]
-    x = scipy.interpolate.griddata(grid_valid, x_valid.ravel(), grid)
+    x = x.copy()
+    for frame, frame_mask in zip(*_split_frames(x, mask)):
+        if frame_mask.all():
+            frame[:] = 0
+        elif frame_mask.any():
+            indices = scipy.ndimage.distance_transform_edt(frame_mask, return_distances=False, return_indices=True)
+            frame[:] = frame[tuple(indices)]
     return x
 
 
-def get_fill_fn(method='random', **kwargs):
+def get_fill_fn(method='random', nan_value=np.nan, **kwargs):
     if method == 'random':
-        return partial(fill_with_random, **kwargs)
+        return partial(fill_with_random, nan_value=nan_value, **kwargs)
     if method == 'interpolate':
-        return fill_with_interpolation
+        return partial(fill_with_interpolation, nan_value=nan_value)
+    if method == 'nearest':
+        return partial(fill_with_nearest, nan_value=nan_value)
     if method == 'median':
-        return fill_with_median
+        return partial(fill_with_median, nan_value=nan_value)
     else:
-        return fill_with_zeros
+        return partial(fill_with_zeros, nan_value=nan_value)
@@ -1,5 +1,4 @@
 import numpy as np
-import torch
 
 
 class Toolbox:
@@ -9,18 +8,23 @@ class Toolbox:
 
         self.backend = backend
         self.cuda = cuda
+        # torch is only imported by the torch backend
+        self.torch = None
+        if self.backend == 'torch':
+            import torch
+            self.torch = torch
 
     def bmm(self, first_matrix, second_matrix):
         if self.backend == 'torch':
-            return torch.bmm(first_matrix, second_matrix)
+            return self.torch.bmm(first_matrix, second_matrix)
         elif self.backend == 'numpy':
             return first_matrix @ second_matrix
 
     def clip(self, x, amin=-np.inf, amax=np.inf):
-        return torch.clamp(x, amin, amax) if self.backend == 'torch' else np.clip(x, amin, amax)
+        return self.torch.clamp(x, amin, amax) if self.backend == 'torch' else np.clip(x, amin, amax)
 
     def acos(self, x):
-        return torch.acos(x) if self.backend == 'torch' else np.arccos(x)
+        return self.torch.acos(x) if self.backend == 'torch' else np.arccos(x)
 
     def btrace(self, x):
         if self.backend == 'torch':
@@ -32,7 +36,7 @@ class Toolbox:
         return x.transpose(2, 1) if self.backend == 'torch' else x.transpose((0, 2, 1))
 
     def from_numpy(self, x):
-        return self.to_gpu(torch.from_numpy(x)) if self.backend == 'torch' else x
+        return self.to_gpu(self.torch.from_numpy(x)) if self.backend == 'torch' else x
 
     def item(self, x):
         return self.to_cpu(x).item() if self.backend == 'torch' else x
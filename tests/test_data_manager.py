@@ -0,0 +1,665 @@
+import env
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+from PIL import Image
+from multiprocessing import Pool
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+from slam.data_manager import GeneratorFactory, SharedImageCache, BatchProducer, CrossTrajectoryIterator
+from slam.linalg import (Intrinsics,
+                         create_optical_flow_from_rt,
+                         convert,
+                         form_se3,
+                         convert_euler_angles_to_rotation_matrix)
+from slam.data_manager.packed_dataset import pack_trajectory
+from slam.data_manager.dataset_index import DatasetIndex
+from slam.data_manager.generator import get_shard_indices
+
+
+def create_trajectory(trajectory_dir, length=10, height=40, width=60):
+    for subdir in ('rgb', 'depth', 'optical_flow'):
+        os.makedirs(os.path.join(trajectory_dir, subdir), exist_ok=True)
+
+    rows = []
+    for index in range(length):
+        image = (np.random.rand(height, width, 3) * 255).astype('uint8')
+        Image.fromarray(image).save(os.path.join(trajectory_dir, 'rgb', f'{index}.png'))
+        depth = np.random.uniform(1, 10, (height, width, 1)).astype('float32')
+        np.save(os.path.join(trajectory_dir, 'depth', f'{index}.npy'), depth)
+
+    for index in range(length - 1):
+        flow = np.random.uniform(-0.1, 0.1, (height, width, 2)).astype('float32')
+        np.save(os.path.join(trajectory_dir, 'optical_flow', f'{index}_{index + 1}.npy'), flow)
+        rows.append({'path_to_rgb': f'rgb/{index}.png',
+                     'path_to_rgb_next': f'rgb/{index + 1}.png',
+                     'path_to_depth': f'depth/{index}.npy',
+                     'path_to_depth_next': f'depth/{index + 1}.npy',
+                     'path_to_optical_flow': f'optical_flow/{index}_{index + 1}.npy',
+                     'euler_x': 0.01, 'euler_y': 0.02, 'euler_z': -0.01,
+                     't_x': 0.1, 't_y': -0.05, 't_z': 0.5,
+                     'f_x': 0.6, 'f_y': 0.8, 'c_x': 0.5, 'c_y': 0.5})
+
+    pd.DataFrame(rows).to_csv(os.path.join(trajectory_dir, 'df.csv'), index=False)
+
+
+def read_shard(args):
+    dataset_root, rank, world_size, epochs = args
+    dataset = GeneratorFactory(dataset_root,
+                               train_trajectories=['trajectory'],
+                               x_col=['path_to_optical_flow', 'from_index'],
+                               image_col=['path_to_optical_flow'],
+                               load_mode='flow_xy',
+                               preprocess_mode='flow_xy',
+                               target_size=(20, 30),
+                               batch_size=2,
+                               rank=rank,
+                               world_size=world_size)
+    generator = dataset.get_train_generator(shard=True)
+    producer = BatchProducer(generator, workers=2, max_queue_size=2)
+    frames = [[batch_x[1] for batch_x, _ in (next(producer) for _ in range(len(generator)))]
+              for _ in range(epochs)]
+    producer.close()
+    return [np.concatenate(epoch_frames).tolist() for epoch_frames in frames]
+
+
+def read_from_cache(args):
+    cache, key = args
+    return cache.get(key)
+
+
+class TestSharedImageCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = SharedImageCache(path=os.path.join(self.tmp_dir, 'cache'),
+                                      max_bytes=2 ** 20,
+                                      page_bytes=2 ** 16,
+                                      min_slot_bytes=2 ** 12)
+
+    def tearDown(self) -> None:
+        self.cache.unlink()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_get(self) -> None:
+        image_arr = np.random.rand(10, 20, 3).astype('float32')
+        self.cache['a'] = image_arr
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertTrue(np.array_equal(self.cache['a'], image_arr))
+        self.assertEqual(len(self.cache), 1)
+
+    def test_budget(self) -> None:
+        for index in range(100):
+            self.cache[index] = np.full((40, 50, 3), index, dtype='float32')
+
+        self.assertLessEqual(self.cache.nbytes, self.cache.max_bytes)
+        self.assertGreater(self.cache.stats['evictions'], 0)
+        self.assertTrue(np.all(self.cache[99] == 99))
+
+    def test_layout_mismatch(self) -> None:
+        image_arr = np.random.rand(10, 20, 1)
+        self.cache['a'] = image_arr
+        with self.assertRaises(ValueError):
+            SharedImageCache(path=self.cache.path, max_bytes=2 ** 21, page_bytes=2 ** 16, min_slot_bytes=2 ** 12)
+
+        # the arena is left as it is for processes that have it mapped
+        self.assertTrue(np.array_equal(self.cache['a'], image_arr))
+
+    def test_hash_collision(self) -> None:
+        def digest_key(key):
+            # every key lands on the same index word, only the tail of the digest differs
+            return np.array([7, 0, 0, ord(key)], dtype='<i8')
+
+        with mock.patch('slam.data_manager.image_cache._digest_key', digest_key):
+            self.cache['a'] = np.zeros((10, 20, 1))
+            self.assertNotIn('b', self.cache)
+            self.assertIsNone(self.cache.get('b'))
+
+            self.cache['b'] = np.ones((10, 20, 1))
+            self.assertTrue(np.all(self.cache['a'] == 0))
+            self.assertTrue(np.all(self.cache['b'] == 1))
+
+            del self.cache['a']
+            self.assertNotIn('a', self.cache)
+            self.assertTrue(np.all(self.cache['b'] == 1))
+
+    def test_shared_between_processes(self) -> None:
+        image_arr = np.random.rand(10, 20, 1)
+        self.cache['a'] = image_arr
+        with Pool(2) as pool:
+            results = pool.map(read_from_cache, [(self.cache, 'a')] * 2)
+
+        for result in results:
+            self.assertTrue(np.array_equal(result, image_arr))
+
+    def test_generator(self) -> None:
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   val_trajectories=['trajectory'],
+                                   x_col=['path_to_optical_flow'],
+                                   image_col=['path_to_optical_flow'],
+                                   load_mode='flow_xy',
+                                   preprocess_mode='flow_xy',
+                                   target_size=(20, 30),
+                                   batch_size=4,
+                                   cached_images=self.cache)
+
+        generator = dataset.get_val_generator()
+        batch_x, batch_y = generator[0]
+        self.assertEqual(batch_x[0].shape, (4, 20, 30, 2))
+        self.assertEqual(len(self.cache), 4)
+
+        batch_x_cached, _ = generator[0]
+        self.assertTrue(np.array_equal(batch_x[0], batch_x_cached[0]))
+        self.assertEqual(self.cache.stats['hits'], 4)
+
+
+class TestPackedDataset(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def get_generator(self, packed, include_last=False):
+        # the row appended by include_last has no optical flow
+        image_col = ['path_to_rgb', 'path_to_depth'] if include_last else \
+            ['path_to_rgb', 'path_to_optical_flow', 'path_to_depth']
+        load_mode = ['rgb', 'depth'] if include_last else ['rgb', 'flow_xy', 'depth']
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   val_trajectories=['trajectory'],
+                                   x_col=image_col,
+                                   image_col=image_col,
+                                   load_mode=load_mode,
+                                   preprocess_mode=load_mode,
+                                   target_size=(20, 30),
+                                   batch_size=4,
+                                   packed=packed)
+        return dataset.get_val_generator(include_last=include_last)
+
+    def test_packed_generator(self) -> None:
+        pack_trajectory(os.path.join(self.tmp_dir, 'trajectory'), (20, 30))
+
+        batch_x, batch_y = self.get_generator(packed=False)[1]
+        batch_x_packed, batch_y_packed = self.get_generator(packed=True)[1]
+
+        for features, features_packed in zip(batch_x, batch_x_packed):
+            self.assertTrue(np.allclose(features, features_packed))
+        for target, target_packed in zip(batch_y, batch_y_packed):
+            self.assertTrue(np.allclose(target, target_packed))
+
+    def test_packed_include_last(self) -> None:
+        pack_trajectory(os.path.join(self.tmp_dir, 'trajectory'), (20, 30))
+
+        # real datasets carry the camera transform as an array-valued column
+        T_body_cam = form_se3(convert_euler_angles_to_rotation_matrix([0.1, -0.2, 1.5]), [0.1, 0.5, -0.3])
+        csv_path = os.path.join(self.tmp_dir, 'trajectory', 'df.csv')
+        df = pd.read_csv(csv_path)
+        df['T_body_cam'] = str(T_body_cam)
+        df.to_csv(csv_path, index=False)
+
+        generator = self.get_generator(packed=False, include_last=True)
+        generator_packed = self.get_generator(packed=True, include_last=True)
+        self.assertEqual(generator_packed.samples, 10)
+        self.assertEqual(generator_packed.df['trajectory_id'].iloc[-1], 'trajectory')
+        self.assertEqual(generator_packed.df['path_to_rgb'].iloc[-1], 'trajectory/rgb/9.png')
+        self.assertEqual(generator_packed.df['f_x'].iloc[-1], 0.6)
+        self.assertTrue(np.allclose(generator_packed.df['T_body_cam'].iloc[-1], T_body_cam))
+        self.assertTrue(np.allclose(generator_packed.df['T_cam_body'].iloc[-1], np.linalg.inv(T_body_cam)))
+
+        batch_x, _ = generator[len(generator) - 1]
+        batch_x_packed, _ = generator_packed[len(generator_packed) - 1]
+        for features, features_packed in zip(batch_x, batch_x_packed):
+            self.assertTrue(np.allclose(features, features_packed))
+
+
+class TestBatchProducer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def get_batches(self, workers, steps=6):
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   x_col=['path_to_optical_flow'],
+                                   image_col=['path_to_optical_flow'],
+                                   load_mode='flow_xy',
+                                   preprocess_mode='flow_xy',
+                                   target_size=(20, 30),
+                                   batch_size=4)
+        producer = BatchProducer(dataset.get_train_generator(), workers=workers, max_queue_size=3)
+        batches = [next(producer) for _ in range(steps)]
+        producer.close()
+        return batches
+
+    def test_deterministic_order(self) -> None:
+        batches = self.get_batches(workers=1)
+        batches_parallel = self.get_batches(workers=3)
+
+        for (batch_x, _), (batch_x_parallel, _) in zip(batches, batches_parallel):
+            self.assertTrue(np.array_equal(batch_x[0], batch_x_parallel[0]))
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ranks(self) -> None:
+        world_size = 3
+        shards = [read_shard((self.tmp_dir, rank, world_size, 2)) for rank in range(world_size)]
+
+        for epoch in range(2):
+            self.assertTrue(all(len(shard[epoch]) == 3 for shard in shards))
+            self.assertEqual(sorted(sum([shard[epoch] for shard in shards], [])), list(range(9)))
+
+        self.assertNotEqual([sorted(shard[0]) for shard in shards], [sorted(shard[1]) for shard in shards])
+
+    def test_unsharded_by_default(self) -> None:
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   x_col=['path_to_optical_flow'],
+                                   image_col=['path_to_optical_flow'],
+                                   load_mode='flow_xy',
+                                   preprocess_mode='flow_xy',
+                                   target_size=(20, 30),
+                                   batch_size=2,
+                                   rank=1,
+                                   world_size=3)
+        # evaluation and prediction read every sample on every rank
+        self.assertEqual(len(dataset.get_train_generator(augment=False).shard_indices), 9)
+        self.assertEqual(len(dataset.get_train_generator(augment=False, shard=True).shard_indices), 3)
+
+    def test_uneven_shards(self) -> None:
+        for seed in (None, 42):
+            shards = [get_shard_indices(9, rank, 4, seed=seed) for rank in range(4)]
+            self.assertTrue(all(len(shard) == 3 for shard in shards))
+            self.assertEqual(set(np.concatenate(shards)), set(range(9)))
+
+    def test_epochs(self) -> None:
+        shards = [[get_shard_indices(100, rank, 4, seed=42, epoch=epoch) for rank in range(4)] for epoch in range(2)]
+        for epoch_shards in shards:
+            self.assertEqual(sorted(np.concatenate(epoch_shards)), list(range(100)))
+
+        # a rank does not keep reading the same block of samples
+        self.assertLess(len(set(shards[0][0]) & set(shards[1][0])), 25)
+
+
+@unittest.skipUnless(tf, 'tensorflow is not installed')
+class TestTFRecord(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+        self.tfrecord_dir = os.path.join(self.tmp_dir, 'tfrecords', 'val')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def get_generator(self, target_size=(20, 30)):
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   val_trajectories=['trajectory'],
+                                   x_col=['path_to_optical_flow', 'path_to_depth'],
+                                   image_col=['path_to_optical_flow', 'path_to_depth'],
+                                   load_mode=['flow_xy', 'depth'],
+                                   preprocess_mode=['flow_xy', 'depth'],
+                                   target_size=target_size,
+                                   batch_size=4)
+        return dataset.get_val_generator()
+
+    def test_round_trip(self) -> None:
+        from slam.data_manager.tfrecord import ensure_tfrecords, TFRecordGenerator
+
+        generator = self.get_generator()
+        ensure_tfrecords(generator, self.tfrecord_dir, num_shards=3)
+
+        with tf.Graph().as_default(), tf.Session() as session:
+            tfrecord_generator = TFRecordGenerator(self.tfrecord_dir, batch_size=4, shuffle=False, session=session)
+            self.assertEqual(len(tfrecord_generator), len(generator))
+
+            for batch_index in range(len(generator)):
+                batch_x, batch_y = generator[batch_index]
+                batch_x_tfrecord, batch_y_tfrecord = next(tfrecord_generator)
+                for features, features_tfrecord in zip(batch_x + batch_y, batch_x_tfrecord + batch_y_tfrecord):
+                    self.assertTrue(np.allclose(features, features_tfrecord))
+
+    def test_fingerprint(self) -> None:
+        from slam.data_manager.tfrecord import ensure_tfrecords, read_meta
+
+        ensure_tfrecords(self.get_generator(), self.tfrecord_dir, num_shards=3)
+        meta_path = os.path.join(self.tfrecord_dir, 'meta.json')
+        mtime = os.stat(meta_path).st_mtime_ns
+
+        ensure_tfrecords(self.get_generator(), self.tfrecord_dir, num_shards=3)
+        self.assertEqual(os.stat(meta_path).st_mtime_ns, mtime)
+
+        ensure_tfrecords(self.get_generator(target_size=(10, 15)), self.tfrecord_dir, num_shards=3)
+        self.assertEqual(read_meta(self.tfrecord_dir)['tensors'][0]['shape'], [10, 15, 2])
+
+
+class TestBatchAssembly(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def get_generator(self, **kwargs):
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   val_trajectories=['trajectory'],
+                                   x_col=['path_to_depth', 'path_to_depth_next'],
+                                   image_col=['path_to_depth', 'path_to_depth_next'],
+                                   load_mode='depth',
+                                   preprocess_mode='depth',
+                                   target_size=(20, 30),
+                                   batch_size=8,
+                                   **kwargs)
+        return dataset.get_val_generator()
+
+    def test_frames_decoded_once(self) -> None:
+        generator = self.get_generator()
+        decoded = []
+        load_image = generator._load_image
+        generator._load_image = lambda fpath, load_mode: decoded.append(fpath) or load_image(fpath, load_mode)
+
+        batch_x, _ = generator[0]
+        self.assertEqual(len(decoded), len(set(decoded)))
+        self.assertEqual(len(decoded), 9)
+        self.assertTrue(np.array_equal(batch_x[0][1:], batch_x[1][:-1]))
+
+    def test_compact_cache(self) -> None:
+        cached_images = {}
+        generator = self.get_generator(cached_images=cached_images)
+        batch_x, _ = generator[0]
+        batch_x_cached, _ = generator[0]
+
+        self.assertTrue(all(image_arr.dtype == np.float16 for image_arr in cached_images.values()))
+        self.assertEqual(batch_x_cached[0].dtype, np.float32)
+        self.assertTrue(np.array_equal(batch_x[0], batch_x_cached[0]))
+
+    def test_read_only_cache_views(self) -> None:
+        cached_images = {}
+        generator = self.get_generator(cached_images=cached_images, cache_dtypes={'depth': 'float32'})
+        batch_x, _ = generator[0]
+        batch_x[0][:] = -1
+
+        fpath = generator.image_paths['path_to_depth'][0]
+        image_arr = generator._get_preprocessed_image(fpath, 'depth', 'depth')
+        self.assertTrue(any(cached_arr is image_arr for cached_arr in cached_images.values()))
+        self.assertFalse(image_arr.flags.writeable)
+        self.assertTrue(np.all(image_arr > 0))
+
+        batch_x_cached, _ = generator[0]
+        self.assertTrue(np.all(batch_x_cached[0] > 0))
+
+    def test_disk_cache(self) -> None:
+        disk_cache_dir = os.path.join(self.tmp_dir, 'disk_cache')
+        batch_x, _ = self.get_generator(disk_cache_dir=disk_cache_dir)[0]
+
+        generator = self.get_generator(disk_cache_dir=disk_cache_dir)
+        generator._load_image = None
+        batch_x_cached, _ = generator[0]
+        self.assertTrue(np.array_equal(batch_x[0], batch_x_cached[0]))
+
+    def test_disk_cache_hits_in_memory(self) -> None:
+        disk_cache_dir = os.path.join(self.tmp_dir, 'disk_cache')
+        self.get_generator(disk_cache_dir=disk_cache_dir)[0]
+
+        cached_images = {}
+        self.get_generator(cached_images=cached_images, disk_cache_dir=disk_cache_dir)[0]
+        self.assertGreater(len(cached_images), 0)
+        self.assertFalse(any(isinstance(image_arr, np.memmap) for image_arr in cached_images.values()))
+        self.assertFalse(any(image_arr.flags.writeable for image_arr in cached_images.values()))
+
+    def test_generate_flow_by_rt(self) -> None:
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   val_trajectories=['trajectory'],
+                                   x_col=['path_to_optical_flow', 'path_to_depth'],
+                                   image_col=['path_to_optical_flow', 'path_to_depth'],
+                                   load_mode=['flow_xy', 'depth'],
+                                   preprocess_mode=['flow_xy', 'depth'],
+                                   target_size=(20, 30),
+                                   batch_size=8,
+                                   generate_flow_by_rt_proba=1,
+                                   generate_distribution='same')
+        generator = dataset.get_val_generator()
+        batch_x, batch_y = generator[0]
+
+        intrinsics = Intrinsics(f_x=0.6, f_y=0.8, c_x=0.5, c_y=0.5, width=30, height=20)
+        depth_arr = generator._get_preprocessed_image(generator.image_paths['path_to_depth'][0],
+                                                      'depth',
+                                                      'depth')
+        expected_flow = create_optical_flow_from_rt(depth_arr[..., 0],
+                                                    intrinsics,
+                                                    [0.01, 0.02, -0.01],
+                                                    [0.1, -0.05, 0.5])
+        self.assertTrue(np.allclose(batch_x[0][0], expected_flow, atol=1e-5))
+        self.assertTrue(np.allclose(batch_y[0], 0.01))
+
+
+class TestCameraCoordinates(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def test_transform_to_camera_coordinate_system(self) -> None:
+        T_body_cam = form_se3(convert_euler_angles_to_rotation_matrix([0.1, -0.2, 1.5]), [0.1, 0.5, -0.3])
+        csv_path = os.path.join(self.tmp_dir, 'trajectory', 'df.csv')
+        df = pd.read_csv(csv_path)
+        df['euler_x'] = np.linspace(-0.1, 0.1, len(df))
+        df['t_z'] = np.linspace(0.2, 1, len(df))
+        df['T_body_cam'] = str(T_body_cam)
+        df.to_csv(csv_path, index=False)
+
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   x_col=['path_to_optical_flow'],
+                                   image_col=['path_to_optical_flow'],
+                                   load_mode='flow_xy',
+                                   preprocess_mode='flow_xy',
+                                   target_size=(20, 30),
+                                   batch_size=4)
+
+        dof_col = ['euler_x', 'euler_y', 'euler_z', 't_x', 't_y', 't_z']
+        for dofs, dofs_converted in zip(df[dof_col].values, dataset.df_train[dof_col].values):
+            self.assertTrue(np.allclose(convert(dofs, T=T_body_cam), dofs_converted, atol=1e-6))
+
+
+class TestDatasetIndex(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def get_dataset(self, **kwargs):
+        return GeneratorFactory(self.tmp_dir,
+                                train_trajectories=['trajectory'],
+                                x_col=['path_to_optical_flow'],
+                                image_col=['path_to_optical_flow'],
+                                load_mode='flow_xy',
+                                preprocess_mode='flow_xy',
+                                target_size=(20, 30),
+                                batch_size=4,
+                                **kwargs)
+
+    def test_index(self) -> None:
+        df_train = self.get_dataset(use_dataset_index=False).df_train
+        self.assertEqual(len(self.get_dataset().dataset_index.entries), 1)
+
+        dataset = self.get_dataset()
+        self.assertFalse(dataset.dataset_index.modified)
+        self.assertTrue(df_train.equals(dataset.df_train))
+        self.assertTrue(np.array_equal(dataset.df_train['to_index'], np.arange(1, 10)))
+
+    def test_lazy_generators(self) -> None:
+        dataset = self.get_dataset(val_trajectories=['trajectory'])
+        self.assertEqual(dataset.input_shapes, [(20, 30, 2)])
+        self.assertEqual(len(dataset.generators), 0)
+
+        generator = dataset.get_train_generator()
+        self.assertIs(dataset.get_train_generator(), generator)
+        self.assertIsNot(dataset.get_train_generator(augment=False), generator)
+        self.assertEqual(generator.input_shapes, dataset.input_shapes)
+        self.assertEqual(len(dataset.generators), 2)
+
+    def test_invalidation(self) -> None:
+        self.get_dataset()
+
+        csv_path = os.path.join(self.tmp_dir, 'trajectory', 'df.csv')
+        df = pd.read_csv(csv_path)
+        df['t_z'] = 1.25
+        df.to_csv(csv_path, index=False)
+
+        dataset_index = DatasetIndex(self.tmp_dir)
+        self.assertTrue(np.all(dataset_index.get('trajectory')['t_z'] == 1.25))
+        self.assertTrue(dataset_index.modified)
+
+
+class TestCrossTrajectoryIterator(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        for trajectory, length in (('a', 6), ('b', 4), ('c', 7)):
+            create_trajectory(os.path.join(self.tmp_dir, trajectory), length=length)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def test_predict(self) -> None:
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   val_trajectories=['a', 'b', 'c'],
+                                   x_col=['path_to_optical_flow', 'from_index'],
+                                   image_col=['path_to_optical_flow'],
+                                   load_mode='flow_xy',
+                                   preprocess_mode='flow_xy',
+                                   target_size=(20, 30),
+                                   batch_size=4)
+        iterator = CrossTrajectoryIterator(dataset.get_val_generator())
+        self.assertEqual(len(iterator), 4)
+
+        class Model:
+            def predict_on_batch(self, batch_x):
+                return [batch_x[1].reshape(-1, 1).astype(float), -batch_x[1].reshape(-1, 1).astype(float)]
+
+        outputs = iterator.predict(Model())
+        self.assertEqual(list(outputs), ['a', 'b', 'c'])
+        self.assertEqual(iterator.stats['trajectory_batches'], 5)
+        self.assertEqual(iterator.stats['batch_utilisation'], 14 / 16)
+
+        df = dataset.df_val_as_is
+        for trajectory_id, (row_indices, model_output) in outputs.items():
+            self.assertTrue(np.all(df.trajectory_id.values[row_indices] == trajectory_id))
+            self.assertTrue(np.array_equal(model_output[0][:, 0], df.from_index.values[row_indices]))
+            self.assertTrue(np.array_equal(model_output[1], -model_output[0]))
+
+    def test_prefetch(self) -> None:
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   val_trajectories=['a', 'b', 'c'],
+                                   x_col=['path_to_optical_flow', 'from_index'],
+                                   image_col=['path_to_optical_flow'],
+                                   load_mode='flow_xy',
+                                   preprocess_mode='flow_xy',
+                                   target_size=(20, 30),
+                                   batch_size=2)
+        generator = dataset.get_val_generator()
+        batches = list(CrossTrajectoryIterator(generator, max_queue_size=0))
+        batches_prefetched = list(CrossTrajectoryIterator(generator, max_queue_size=2))
+        self.assertEqual(len(batches_prefetched), len(batches))
+        for (batch, index_array, _), (batch_prefetched, index_array_prefetched, _) in zip(batches, batches_prefetched):
+            self.assertTrue(np.array_equal(index_array, index_array_prefetched))
+            self.assertTrue(np.array_equal(batch[0][0], batch_prefetched[0][0]))
+
+        # the producer thread is stopped when the consumer stops early
+        for _ in CrossTrajectoryIterator(generator, max_queue_size=1):
+            break
+
+        generator.image_paths['path_to_optical_flow'] = generator.image_paths['path_to_optical_flow'] + '.missing'
+        with self.assertRaises(FileNotFoundError):
+            list(CrossTrajectoryIterator(generator, max_queue_size=2))
+
+
+class TestLoaderProfiler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        create_trajectory(os.path.join(self.tmp_dir, 'trajectory'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def get_generator(self):
+        dataset = GeneratorFactory(self.tmp_dir,
+                                   train_trajectories=['trajectory'],
+                                   x_col=['path_to_depth', 'path_to_depth_next'],
+                                   image_col=['path_to_depth', 'path_to_depth_next'],
+                                   load_mode='depth',
+                                   preprocess_mode='depth',
+                                   target_size=(20, 30),
+                                   batch_size=4,
+                                   cached_images={})
+        return dataset.get_train_generator()
+
+    def test_disabled(self) -> None:
+        generator = self.get_generator()
+        generator[0]
+        self.assertEqual(generator.profiler.summary(), {})
+
+    def test_epoch(self) -> None:
+        generator = self.get_generator()
+        generator.profiler.enabled = True
+        for _ in range(2 * len(generator)):
+            next(generator)
+
+        summary = generator.profiler.summary()
+        self.assertEqual(summary['batches'], 6)
+        self.assertEqual(summary['samples'], 18)
+        self.assertEqual(summary['batch_fill_ratio'], 18 / 24)
+        self.assertEqual(summary['cache_misses'], 10)
+        self.assertEqual(summary['bytes_decoded'], 10 * 20 * 30 * 4)
+        self.assertGreater(summary['cache_hit_ratio'], 0.5)
+        self.assertGreaterEqual(summary['batch_sec'], summary['load_sec'])
+
+    def test_batch_producer(self) -> None:
+        generator = self.get_generator()
+        generator.profiler.enabled = True
+        producer = BatchProducer(generator, workers=2, max_queue_size=2)
+        for _ in range(len(generator)):
+            next(producer)
+        producer.close()
+
+        self.assertEqual(generator.profiler.counters['batches'], 3)
+        self.assertEqual(generator.profiler.counters['samples'], 9)
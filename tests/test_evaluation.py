@@ -0,0 +1,67 @@
+import env
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from slam.evaluation.streaming import TrajectoryPredictionWriter, get_gt_path
+from slam.evaluation.callbacks.predict_callback import create_trajectory, load_task
+
+
+class TestTrajectoryPredictionWriter(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dof_cols = ['euler_x', 'euler_y', 'euler_z', 't_x', 't_y', 't_z']
+
+        # consecutive pairs with a stride 2 pair after every 5 frames, which is not integrated
+        from_indices = np.arange(30)
+        to_indices = from_indices + np.where(from_indices % 5 == 4, 2, 1)
+        self.df = pd.DataFrame(np.random.uniform(-0.3, 0.3, (30, 6)), columns=self.dof_cols)
+        self.df['path_to_rgb'] = [f'rgb/{index}.png' for index in from_indices]
+        self.df['path_to_rgb_next'] = [f'rgb/{index}.png' for index in to_indices]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, T=None, chunk_size=7):
+        file_path = os.path.join(self.tmp_dir, 'trajectory.csv')
+        writer = TrajectoryPredictionWriter(file_path, self.dof_cols, min_stride=1, num_poses=25, T=T)
+        for start in range(0, len(self.df), chunk_size):
+            writer.write(self.df.iloc[start:start + chunk_size].copy())
+        writer.close()
+        return pd.read_csv(writer.file_path, index_col=0), np.load(writer.poses_path)
+
+    def test_matches_create_trajectory(self) -> None:
+        for T in (None, np.diag([1., -1., -1., 1.])):
+            predictions, poses = self.write(T=T)
+
+            expected_df = self.df.copy()
+            expected_trajectory = create_trajectory(expected_df, self.dof_cols, T=T)
+
+            pd.testing.assert_frame_equal(predictions, expected_df, check_dtype=False)
+            self.assertTrue(np.allclose(poses, expected_trajectory.to_transformation_matrices(), atol=1e-9))
+
+    def test_load_staged_task(self) -> None:
+        T = np.diag([1., -1., -1., 1.])
+        _, poses = self.write(T=T)
+        prediction_path = os.path.join(self.tmp_dir, 'trajectory.csv')
+        gt_path = get_gt_path(prediction_path)
+        self.df.to_pickle(gt_path)
+
+        task = {'prediction_path': prediction_path,
+                'poses_path': os.path.join(self.tmp_dir, 'trajectory_poses.npy'),
+                'gt_path': gt_path,
+                'dof_cols': self.dof_cols,
+                'T': T}
+        _, gt_df, predicted_trajectory, gt_trajectory = load_task(task)
+
+        self.assertTrue(np.allclose(predicted_trajectory.to_transformation_matrices(), poses))
+        self.assertTrue(np.allclose(gt_trajectory.to_transformation_matrices(), poses, atol=1e-9))
+        self.assertEqual(len(gt_df), len(self.df))
+
+        task['gt_path'] = None
+        self.assertIsNone(load_task(task)[1])
@@ -0,0 +1,102 @@
+import env
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from slam.utils import get_fill_fn, resize_image_arr, load_image_by_mode
+
+
+class TestFillFunctions(unittest.TestCase):
+
+    def setUp(self) -> None:
+        y, x = np.mgrid[0:20, 0:30]
+        self.frames = np.stack([x + y + 100, x - y + 100]).astype('float32')
+        self.mask = np.zeros_like(self.frames, dtype=bool)
+        self.mask[:, 5:9, 10:15] = True
+        self.mask[1, :, :2] = True
+
+    def get_holes(self, nan_value=np.nan):
+        return np.where(self.mask, nan_value, self.frames).astype('float32')
+
+    def test_only_holes_are_filled(self) -> None:
+        for method in ('random', 'interpolate', 'nearest', 'median', 'zeros'):
+            filled = get_fill_fn(method)(self.get_holes())
+            self.assertEqual(filled.shape, self.frames.shape)
+            self.assertEqual(filled.dtype, self.frames.dtype)
+            self.assertFalse(np.isnan(filled).any())
+            self.assertTrue(np.array_equal(filled[~self.mask], self.frames[~self.mask]))
+
+    def test_batch_matches_single_frames(self) -> None:
+        for method in ('interpolate', 'nearest', 'median'):
+            fill_fn = get_fill_fn(method)
+            filled = fill_fn(self.get_holes())
+            for frame, filled_frame in zip(self.get_holes(), filled):
+                self.assertTrue(np.allclose(fill_fn(frame), filled_frame))
+
+    def test_interpolation(self) -> None:
+        filled = get_fill_fn('interpolate', nan_value=0)(self.get_holes(nan_value=0))
+        self.assertLess(np.abs(filled - self.frames)[self.mask].mean(), 3)
+
+    def test_invalid_frame(self) -> None:
+        frames = self.get_holes()
+        frames[0] = np.nan
+        for method in ('random', 'interpolate', 'nearest', 'median'):
+            filled = get_fill_fn(method)(frames)
+            self.assertTrue(np.all(filled[0] == 0))
+
+
+class TestResize(unittest.TestCase):
+
+    def test_nearest(self) -> None:
+        for input_size, target_size in (((376, 1241), (120, 188)), ((37, 53), (50, 71)), ((40, 60), (20, 30))):
+            image_arr = np.random.rand(*input_size, 6).astype('float32')
+            expected = F.interpolate(torch.Tensor(image_arr.transpose(2, 0, 1)).unsqueeze_(0),
+                                     target_size,
+                                     mode='nearest').numpy()[0].transpose(1, 2, 0)
+            resized = resize_image_arr(image_arr, target_size, data_format='channels_last', mode='nearest')
+            self.assertTrue(np.array_equal(resized, expected))
+
+            resized = resize_image_arr(image_arr.transpose(2, 0, 1),
+                                       target_size,
+                                       data_format='channels_first',
+                                       mode='nearest')
+            self.assertTrue(np.array_equal(resized, expected.transpose(2, 0, 1)))
+
+    def test_batch(self) -> None:
+        images = np.random.rand(4, 40, 60, 3).astype('float32')
+        for mode in ('nearest', 'bilinear', 'area'):
+            resized = resize_image_arr(images, (20, 30), data_format='channels_last', mode=mode)
+            self.assertEqual(resized.shape, (4, 20, 30, 3))
+            self.assertTrue(np.allclose(resized[2], resize_image_arr(images[2], (20, 30), 'channels_last', mode)))
+
+    def test_reduced_decode(self) -> None:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fpath = os.path.join(tmp_dir, 'image.jpg')
+            Image.fromarray(np.full((480, 640, 3), 128, dtype='uint8')).save(fpath)
+            image_arr = load_image_by_mode(fpath, 'rgb', (120, 160))
+            self.assertEqual(image_arr.shape, (120, 160, 3))
+            self.assertEqual(image_arr.dtype, np.float32)
+            self.assertTrue(np.allclose(image_arr, 128, atol=2))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_16bit_depth(self) -> None:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fpath = os.path.join(tmp_dir, 'depth.png')
+            depth = np.tile(np.repeat(np.array([0, 1000, 2000, 65535], dtype='uint16'), 2), (20, 5))
+            Image.fromarray(depth).save(fpath)
+            for target_size in ((20, 40), (10, 20)):
+                image_arr = load_image_by_mode(fpath, 'depth', target_size)
+                self.assertEqual(image_arr.shape, target_size + (1,))
+                self.assertEqual(image_arr.dtype, np.float32)
+                self.assertTrue(np.array_equal(np.unique(image_arr), [0, 1000, 2000, 65535]))
+        finally:
+            shutil.rmtree(tmp_dir)
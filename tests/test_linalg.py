@@ -1,6 +1,9 @@
 from slam import linalg
 import unittest
 import numpy as np
+import scipy.linalg
+import pandas as pd
+from pyquaternion import Quaternion
 
 
 class TestCovarianceConverter(unittest.TestCase):
@@ -36,3 +39,237 @@ class TestCovarianceConverter(unittest.TestCase):
     def test_3(self):
         covariance_matrix, answer = self.generate_data(2)
         self.assertTrue(np.allclose(covariance_matrix, answer))
+
+
+class TestOpticalFlowFromRt(unittest.TestCase):
+
+    def test_batch(self):
+        height, width = 20, 30
+        depths = np.random.uniform(1, 10, (4, height, width))
+        intrinsics = np.array([[0.6, 0.8, 0.5, 0.5]] * 2 + [[0.7, 0.9, 0.45, 0.55]] * 2)
+        rotation_vectors = np.random.uniform(-0.05, 0.05, (4, 3))
+        translation_vectors = np.random.uniform(-0.2, 0.2, (4, 3))
+        translation_vectors[-1, 2] = 20
+
+        flows, valid = linalg.create_optical_flow_from_rt_batch(depths,
+                                                                intrinsics,
+                                                                rotation_vectors,
+                                                                translation_vectors)
+        self.assertEqual(flows.shape, (4, height, width, 2))
+        self.assertTrue(np.array_equal(valid, [True, True, True, False]))
+
+        for depth, (f_x, f_y, c_x, c_y), rotation_vector, translation_vector, flow, is_valid in zip(
+                depths, intrinsics, rotation_vectors, translation_vectors, flows, valid):
+            intrinsics = linalg.Intrinsics(f_x=f_x, f_y=f_y, c_x=c_x, c_y=c_y, width=width, height=height)
+            expected_flow = linalg.create_optical_flow_from_rt(depth, intrinsics, rotation_vector, translation_vector)
+            if is_valid:
+                self.assertTrue(np.allclose(flow, expected_flow))
+            else:
+                self.assertIsNone(expected_flow)
+
+
+class TestPoseAccumulator(unittest.TestCase):
+
+    def test_chunks(self):
+        dofs = np.random.uniform(-0.3, 0.3, (25, 6))
+        df = pd.DataFrame(dofs, columns=['euler_x', 'euler_y', 'euler_z', 't_x', 't_y', 't_z'])
+        expected = linalg.RelativeTrajectory.from_dataframe(df).to_global().to_transformation_matrices()
+
+        accumulator = linalg.PoseAccumulator()
+        poses = np.concatenate([accumulator.update(chunk) for chunk in np.array_split(dofs, [7, 8, 20])])
+        self.assertEqual(accumulator.num_poses, 26)
+        self.assertTrue(np.allclose(poses, expected[1:], atol=1e-9))
+
+
+class TestArrayTrajectory(unittest.TestCase):
+
+    def setUp(self):
+        dofs = np.random.uniform(-0.3, 0.3, (30, 6))
+        self.df = pd.DataFrame(dofs, columns=['euler_x', 'euler_y', 'euler_z', 't_x', 't_y', 't_z'])
+
+    def test_to_global(self):
+        global_trajectory = linalg.ArrayTrajectory.from_dataframe(self.df).to_global()
+
+        pose = np.eye(4)
+        expected = [pose]
+        for motion in linalg.ArrayTrajectory.from_dataframe(self.df).to_transformation_matrices():
+            pose = pose @ motion
+            expected.append(pose)
+
+        self.assertEqual(len(global_trajectory), 31)
+        self.assertTrue(np.allclose(global_trajectory.to_transformation_matrices(), expected, atol=1e-9))
+
+    def test_relative_round_trip(self):
+        relative_trajectory = linalg.ArrayTrajectory.from_dataframe(self.df).to_global().to_relative()
+        self.assertTrue(np.allclose(relative_trajectory.to_dataframe().values, self.df.values, atol=1e-9))
+
+    def test_quaternions(self):
+        trajectory = linalg.ArrayTrajectory.from_dataframe(self.df)
+        for quaternion, rotation_matrix in zip(trajectory.quaternions, trajectory.rotation_matrices):
+            expected = Quaternion(matrix=rotation_matrix)
+            self.assertTrue(np.allclose(quaternion, expected.elements, atol=1e-9))
+
+    def test_align(self):
+        global_trajectory = linalg.RelativeTrajectory.from_dataframe(self.df).to_global()
+        rotation_matrix = linalg.convert_euler_angles_to_rotation_matrix([0.1, -0.2, 0.3])
+        reference_points = 2 * global_trajectory.points @ rotation_matrix.T + [1, 2, 3]
+        reference_trajectory = linalg.GlobalTrajectory.from_transformation_matrices(
+            [linalg.form_se3(rotation_matrix, point) for point in reference_points])
+
+        aligned_trajectory = global_trajectory.align_with(reference_trajectory)
+        self.assertTrue(np.allclose(aligned_trajectory.points, reference_points, atol=1e-6))
+
+    def test_append(self):
+        global_trajectory = linalg.RelativeTrajectory.from_dataframe(self.df).to_global()
+
+        trajectory = linalg.GlobalTrajectory()
+        for position in global_trajectory.positions:
+            trajectory.append(position)
+
+        self.assertEqual(len(trajectory), len(global_trajectory))
+        self.assertTrue(np.allclose(trajectory.to_transformation_matrices(),
+                                    global_trajectory.to_transformation_matrices(), atol=1e-9))
+
+
+class TestBatchedRotations(unittest.TestCase):
+
+    def setUp(self):
+        self.euler_angles = np.random.uniform(-1, 1, (20, 3))
+
+    def test_quaternions(self):
+        quaternions = linalg.euler_to_quaternion(self.euler_angles)
+        self.assertEqual(quaternions.shape, (20, 4))
+        self.assertTrue(np.allclose(linalg.quaternion_to_euler(quaternions), self.euler_angles))
+
+        rotation_matrices = linalg.convert_euler_angles_to_rotation_matrix(self.euler_angles)
+        for quaternion, rotation_matrix in zip(quaternions, rotation_matrices):
+            self.assertTrue(np.allclose(Quaternion(quaternion).rotation_matrix, rotation_matrix))
+
+        other_quaternions = linalg.euler_to_quaternion(self.euler_angles[::-1])
+        distances = linalg.get_quaternion_distance(quaternions, other_quaternions)
+        expected = [Quaternion.distance(Quaternion(q), Quaternion(other_q))
+                    for q, other_q in zip(quaternions, other_quaternions)]
+        self.assertTrue(np.allclose(distances, expected))
+
+    def test_checks(self):
+        with self.assertRaises(AssertionError):
+            linalg.quaternion_to_euler([2, 0, 0, 0])
+        with self.assertRaises(AssertionError):
+            linalg.convert_rotation_matrix_to_euler_angles(2 * np.eye(3))
+        self.assertTrue(np.allclose(linalg.convert_rotation_matrix_to_euler_angles(2 * np.eye(3), check=False), 0))
+
+    def test_quaternion_uncertainty(self):
+        stds = np.random.uniform(0.1, 1, (20, 6))
+        covariances = linalg.get_covariance_matrix_from_euler_uncertainty(stds[:, 3:], stds[:, :3])
+        covariances = linalg.convert_euler_uncertainty_to_quaternion_uncertainty(self.euler_angles, covariances)
+        self.assertEqual(covariances.shape, (20, 7, 7))
+
+        for euler_angles, std, covariance in zip(self.euler_angles, stds, covariances):
+            expected = linalg.get_covariance_matrix_from_euler_uncertainty(std[3:], std[:3])
+            expected = linalg.convert_euler_uncertainty_to_quaternion_uncertainty(euler_angles, expected)
+            self.assertTrue(np.allclose(covariance, expected))
+
+
+class TestAlign(unittest.TestCase):
+
+    def setUp(self):
+        self.points = np.random.normal(size=(50, 3))
+        self.rotation_matrix = linalg.convert_euler_angles_to_rotation_matrix([0.3, -0.1, 0.7])
+        noise = np.random.normal(scale=0.01, size=(50, 3))
+        self.reference_points = 1.5 * self.points @ self.rotation_matrix.T + [1, -2, 0.5] + noise
+
+    def test_align(self):
+        rotation_matrix, translation, scale = linalg.align(self.points, self.reference_points)
+        self.assertTrue(np.allclose(rotation_matrix, self.rotation_matrix, atol=1e-2))
+        self.assertTrue(np.allclose(translation, [1, -2, 0.5], atol=1e-2))
+        self.assertAlmostEqual(scale, 1.5, places=2)
+
+    def test_incremental(self):
+        for by in ('mean', 'start'):
+            aligner = linalg.IncrementalAligner(by=by)
+            for point, reference_point in zip(self.points, self.reference_points):
+                aligner.update(point, reference_point)
+
+            rotation_matrix, translation, scale = linalg.align(self.points, self.reference_points, by=by)
+            aligned_points = scale * self.points @ rotation_matrix.T + translation
+            ate = np.mean(np.sum((aligned_points - self.reference_points) ** 2, axis=1)) ** 0.5
+
+            incremental_rotation_matrix, incremental_translation, incremental_scale = aligner.get_transform()
+            self.assertEqual(len(aligner), 50)
+            self.assertTrue(np.allclose(incremental_rotation_matrix, rotation_matrix))
+            self.assertTrue(np.allclose(incremental_translation, translation))
+            self.assertAlmostEqual(incremental_scale, scale)
+            self.assertAlmostEqual(aligner.get_absolute_trajectory_error(), ate)
+
+
+class TestLie(unittest.TestCase):
+
+    def get_twists(self, size):
+        twists = np.random.normal(size=(size, 7))
+        # rotation angles from tiny to almost pi, where closed forms switch to series
+        angles = np.concatenate([np.logspace(-9, 0, size // 2), np.pi - np.logspace(-9, -1, size - size // 2)])
+        twists[:, :3] *= (angles / np.linalg.norm(twists[:, :3], axis=1))[:, None]
+        twists[::3, 6] = 0
+        return twists
+
+    def test_exp_log(self):
+        twists = self.get_twists(40)
+        self.assertTrue(np.allclose(linalg.SE3.exp(twists[:, :6]).log(), twists[:, :6], atol=1e-9))
+        self.assertTrue(np.allclose(linalg.Sim3.exp(twists).log(), twists, atol=1e-9))
+
+    def test_exp(self):
+        twists = self.get_twists(20)
+        for twist, matrix in zip(twists, linalg.Sim3.exp(twists).as_matrices()):
+            algebra = np.zeros((4, 4))
+            algebra[:3, :3] = linalg.lie.skew(twist[:3]) + twist[6] * np.eye(3)
+            algebra[:3, 3] = twist[3:6]
+            self.assertTrue(np.allclose(matrix, scipy.linalg.expm(algebra), atol=1e-9))
+
+    def test_group_operations(self):
+        for group, dim in ((linalg.SE3, 6), (linalg.Sim3, 7)):
+            poses = group.exp(np.random.normal(size=(10, dim)))
+            twists = np.random.normal(scale=0.3, size=(10, dim))
+            self.assertTrue(np.allclose((poses @ poses.inverse()).as_matrices(), np.eye(4)))
+            self.assertTrue(np.allclose((poses[:3] @ poses[3:6]).as_matrices(),
+                                        poses[:3].as_matrices() @ poses[3:6].as_matrices()))
+
+            conjugated = poses @ group.exp(twists) @ poses.inverse()
+            adjoint_twists = (poses.adjoint() @ twists[..., None])[..., 0]
+            self.assertTrue(np.allclose(conjugated.as_matrices(), group.exp(adjoint_twists).as_matrices()))
+
+    def test_interpolate(self):
+        euler_angles = np.array([[0, 0, 0], [0, 0, 1], [0, 0, -1]])
+        poses = linalg.SE3(linalg.convert_euler_angles_to_rotation_matrix(euler_angles), [[0, 0, 0], [2, 0, 0], [2, 2, 0]])
+        interpolated = poses.interpolate([0, 1, 3], [-1, 0, 0.5, 1, 2, 5])
+
+        expected_euler_angles = [[0, 0, 0], [0, 0, 0], [0, 0, 0.5], [0, 0, 1], [0, 0, 0], [0, 0, -1]]
+        expected_translations = [[0, 0, 0], [0, 0, 0], [1, 0, 0], [2, 0, 0], [2, 1, 0], [2, 2, 0]]
+        self.assertTrue(np.allclose(linalg.convert_rotation_matrix_to_euler_angles(interpolated.rotation_matrices),
+                                    expected_euler_angles))
+        self.assertTrue(np.allclose(interpolated.translations, expected_translations))
+
+
+class TestIntrinsics(unittest.TestCase):
+
+    def test_registry(self):
+        intrinsics = linalg.get_intrinsics(f_x=0.6, f_y=0.8, c_x=0.5, c_y=0.5, width=30, height=20)
+        self.assertIs(intrinsics, linalg.get_intrinsics(f_x=0.6, f_y=0.8, c_x=0.5, c_y=0.5, width=30, height=20))
+
+        other_intrinsics = linalg.Intrinsics(f_x=0.6, f_y=0.8, c_x=0.5, c_y=0.5, width=30, height=20)
+        self.assertIs(intrinsics.rays, other_intrinsics.rays)
+        self.assertIs(intrinsics.pixels, other_intrinsics.pixels)
+        self.assertFalse(intrinsics.rays.flags.writeable)
+        self.assertTrue(np.allclose(intrinsics.rays, intrinsics.forward(intrinsics.pixels)))
+
+    def test_batch(self):
+        intrinsics = linalg.Intrinsics(f_x=0.7, f_y=0.9, c_x=0.45, c_y=0.55, width=30, height=20)
+        depths = np.random.uniform(1, 10, (4, 20, 30))
+
+        points = intrinsics.to_points(depths)
+        pixels = intrinsics.to_pixels(points)
+        self.assertEqual(points.shape, (4, 3, 20, 30))
+        self.assertTrue(np.allclose(pixels, intrinsics.pixels[None]))
+
+        for depth, sample_points in zip(depths, points):
+            self.assertTrue(np.allclose(intrinsics.to_points(depth), sample_points))
+            self.assertTrue(np.allclose(intrinsics.to_pixels(sample_points), intrinsics.pixels))